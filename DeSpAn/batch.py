@@ -0,0 +1,323 @@
+"""Batch runs of the pipeline for many epoch pairs (e.g. the sections of a corridor) on a shared worker pool"""
+
+import argparse
+from concurrent.futures import FIRST_COMPLETED, Executor, Future, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from datetime import datetime
+import json
+import multiprocessing
+import os
+from pathlib import Path
+import sys
+import time
+import traceback
+from typing import Any, Iterator
+
+from omegaconf import OmegaConf
+import yaml
+
+import DeSpAn
+from DeSpAn import cli
+from DeSpAn.config import RunConfig
+from DeSpAn.report import host_info, read_peak_rss, start_peak_rss
+
+
+SUMMARY_VERSION = 1
+
+
+@dataclass(frozen=True)
+class BatchJob:
+    """
+    Run of the pipeline for an epoch pair.
+
+    Attributes
+    ----------
+    name : str
+    epoch1 : pathlib.Path
+        Point cloud file (or folder) of the first epoch.
+    epoch2 : pathlib.Path
+        Point cloud file (or folder) of the second epoch.
+    results_dir : pathlib.Path
+    config_file : pathlib.Path, optional
+    overrides : dict[str, Any]
+        Nested settings applied on top of the configuration file (see `DeSpAn.config.RunConfig`).
+    memory_gb : float, optional
+        Memory budget of the job, the running jobs of a batch do not exceed the budget of the batch together.
+    index : int
+        Position in the manifest.
+    """
+
+    name: str
+    epoch1: Path
+    epoch2: Path
+    results_dir: Path
+    config_file: Path = None
+    overrides: dict[str, Any] = field(default_factory=dict)
+    memory_gb: float = None
+    index: int = 0
+
+    @property
+    def memory_budget(self) -> int:
+        """
+        Memory budget in bytes (0 without budget).
+        """
+        return 0 if self.memory_gb is None else int(self.memory_gb * 2 ** 30)
+
+    def argv(self) -> list[str]:
+        """
+        Command line arguments of the job (see `DeSpAn.cli`).
+        """
+        argv = [] if self.config_file is None else ["-cf", f"{self.config_file}"]
+        return argv + ["-e1", f"{self.epoch1}", "-e2", f"{self.epoch2}", "-r", f"{self.results_dir}"]
+
+
+def load_manifest(manifest_path: Path) -> list[BatchJob]:
+    """
+    Loads the jobs of a manifest.
+
+    The manifest is a YAML (or JSON) file with a list of `jobs`, each with the paths `epoch1`, `epoch2` and
+    `results_dir` and optionally a `name`, a `config_file`, `overrides` (nested settings or dot-list overrides, e.g.
+    ``app_settings.segment_length=200``) and a `memory_gb` budget. `config_file`, `overrides` and `memory_gb` at the
+    top level apply to all jobs (the overrides of a job are merged into them). Relative paths are relative to the
+    manifest.
+
+    Parameters
+    ----------
+    manifest_path : pathlib.Path
+
+    Returns
+    -------
+    jobs : list[DeSpAn.batch.BatchJob]
+
+    Raises
+    ------
+    ValueError
+        If a job lacks a path or two jobs have the same name or results folder.
+    """
+    manifest_path = Path(manifest_path).absolute()
+    with open(manifest_path, "r") as f:
+        manifest = yaml.safe_load(f) or {}
+
+    def path(value) -> Path | None:
+        return None if value is None else (manifest_path.parent / Path(value)).resolve()
+
+    jobs = []
+    for index, entry in enumerate(manifest.get("jobs") or []):
+        for key in ["epoch1", "epoch2", "results_dir"]:
+            if entry.get(key) is None:
+                raise ValueError(f"Job {index:d} of '{manifest_path}' has no {key}")
+        results_dir = path(entry["results_dir"])
+        jobs.append(BatchJob(
+            name=f"{entry.get('name', results_dir.name)}", epoch1=path(entry["epoch1"]), epoch2=path(entry["epoch2"]),
+            results_dir=results_dir, config_file=path(entry.get("config_file", manifest.get("config_file"))),
+            overrides=_merge_overrides(manifest.get("overrides"), entry.get("overrides")),
+            memory_gb=entry.get("memory_gb", manifest.get("memory_gb")), index=index))
+
+    for attribute in ["name", "results_dir"]:
+        values = [getattr(job, attribute) for job in jobs]
+        duplicates = sorted({f"{value}" for value in values if values.count(value) > 1})
+        if duplicates:
+            raise ValueError(f"Jobs of '{manifest_path}' share the {attribute} {', '.join(duplicates)}")
+    return jobs
+
+
+def _merge_overrides(*overrides) -> dict[str, Any]:
+    # Nested settings or dot-list overrides, the later ones take precedence
+    configs = [OmegaConf.create(dict(override)) if isinstance(override, dict) else OmegaConf.from_dotlist(override)
+               for override in overrides if override]
+    return OmegaConf.to_container(OmegaConf.merge(*configs)) if configs else {}
+
+
+def run_job(job: BatchJob) -> dict:
+    """
+    Runs the pipeline for a job (in a worker process of the batch).
+
+    The output of the job (including its child processes) is written to *batch_job.log* in its results folder.
+
+    Parameters
+    ----------
+    job : DeSpAn.batch.BatchJob
+
+    Returns
+    -------
+    record : dict
+        *status* (*completed* or *failed*), *start*, *wall_time*, *peak_rss* (bytes, of the worker process during the
+        job) and the *error* of failed jobs.
+    """
+    job.results_dir.mkdir(parents=True, exist_ok=True)
+    log_path = job.results_dir / "batch_job.log"
+    record = {"status": "failed", "start": datetime.now().isoformat(timespec="seconds"), "log": f"{log_path}"}
+    # Workers are reused, hence the high-water mark of the previous jobs is reset
+    peak_key = start_peak_rss()
+    start = time.perf_counter()
+    with _redirect_output(log_path):
+        try:
+            cli.main(RunConfig(job.argv(), job.overrides))
+            record["status"] = "completed"
+        except Exception:
+            record["error"] = traceback.format_exc()
+            traceback.print_exc()
+    record["wall_time"] = time.perf_counter() - start
+    record["peak_rss"] = read_peak_rss(peak_key)
+    return record
+
+
+@contextmanager
+def _redirect_output(log_path: Path) -> Iterator[None]:
+    # The file descriptors are redirected, hence threads and child processes (e.g. the loader pools) are included
+    sys.stdout.flush()
+    sys.stderr.flush()
+    saved_fds = [os.dup(1), os.dup(2)]
+    with open(log_path, "a") as log:
+        os.dup2(log.fileno(), 1)
+        os.dup2(log.fileno(), 2)
+        try:
+            yield
+        finally:
+            sys.stdout.flush()
+            sys.stderr.flush()
+            for fd, saved_fd in zip((1, 2), saved_fds):
+                os.dup2(saved_fd, fd)
+                os.close(saved_fd)
+
+
+def run_batch(jobs: list[BatchJob], summary_path: Path, nb_workers: int = 1, max_memory_gb: float = None,
+              jobs_per_worker: int = None) -> dict:
+    """
+    Runs jobs on a bounded pool of worker processes.
+
+    The jobs start in order as long as fewer than `nb_workers` jobs are running and their memory budgets fit into
+    `max_memory_gb` together. A job exceeding it runs alone, i.e. it waits for the running jobs and no job starts
+    before it finished. The workers import DeSpAn and compose the default
+    configuration once for all their jobs. A failing job does not stop the batch, and jobs of a worker pool that broke
+    (e.g. a worker killed for exceeding the memory) are recorded as failed and the pool is restarted.
+
+    Parameters
+    ----------
+    jobs : list[DeSpAn.batch.BatchJob]
+    summary_path : pathlib.Path
+        JSON summary of the batch, written after each job.
+    nb_workers : int, default=1
+        Maximum number of jobs running at once.
+    max_memory_gb : float, optional
+        Memory budget of the running jobs together (physical memory of the machine if `None`).
+    jobs_per_worker : int, optional
+        Number of jobs after which a worker process is replaced (e.g. to release fragmented memory). `None` keeps
+        the workers for the whole batch.
+
+    Returns
+    -------
+    summary : dict
+        *status*, the numbers of *completed* and *failed* jobs, *wall_time* and the records of the *jobs* (see
+        `run_job`, with *name*, *index*, *results_dir*, *memory_budget*, *queued_time* and *memory_exceeded*).
+    """
+    if max_memory_gb is None:
+        max_memory = host_info()["memory"] or 0
+    else:
+        max_memory = int(max_memory_gb * 2 ** 30)
+    start_time = datetime.now()
+    start = time.perf_counter()
+    summary = {"version": SUMMARY_VERSION, "despan_version": DeSpAn.__version__, "status": "running",
+               "start": start_time.isoformat(timespec="seconds"), "host": host_info(), "nb_workers": nb_workers,
+               "max_memory": max_memory, "completed": 0, "failed": 0, "wall_time": 0.0, "jobs": []}
+
+    def finish(job: BatchJob, record: dict) -> None:
+        record = {"name": job.name, "index": job.index, "results_dir": f"{job.results_dir}",
+                  "memory_budget": job.memory_budget or None, **record}
+        record["memory_exceeded"] = bool(job.memory_budget and (record.get("peak_rss") or 0) > job.memory_budget)
+        summary["jobs"] = sorted(summary["jobs"] + [record], key=lambda job_record: job_record["index"])
+        summary[record["status"]] += 1
+        summary["wall_time"] = time.perf_counter() - start
+        print(f"Job '{job.name}' {record['status']}"
+              + (" (memory budget exceeded)" if record["memory_exceeded"] else ""))
+        _write_summary(summary_path, summary)
+
+    pending = list(jobs)
+    running: dict[Future, tuple[BatchJob, float]] = dict()
+    executor = _new_executor(nb_workers, jobs_per_worker)
+    broken = False
+    try:
+        while pending or running:
+            if broken and not running:
+                executor.shutdown(wait=True)
+                executor = _new_executor(nb_workers, jobs_per_worker)
+                broken = False
+            # Nothing is submitted to a broken pool, it is restarted once its running jobs finished
+            while pending and not broken and _may_start(pending[0], [job for job, _ in running.values()], nb_workers,
+                                                        max_memory):
+                job = pending.pop(0)
+                if job.memory_budget > max_memory:
+                    print(f"Job '{job.name}' exceeds the memory budget of the batch, it runs alone")
+                print(f"Starting job '{job.name}' ({job.results_dir})")
+                running[executor.submit(run_job, job)] = (job, time.perf_counter() - start)
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                job, queued_time = running.pop(future)
+                try:
+                    record = future.result()
+                except BrokenProcessPool:
+                    broken = True
+                    record = {"status": "failed", "error": "The worker process terminated abruptly (e.g. killed for "
+                                                           "exceeding the memory)"}
+                finish(job, {"queued_time": queued_time, **record})
+        summary["status"] = "completed"
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+        summary["wall_time"] = time.perf_counter() - start
+        if summary["status"] == "running":
+            summary["status"] = "interrupted"
+        _write_summary(summary_path, summary)
+    return summary
+
+
+def _new_executor(nb_workers: int, jobs_per_worker: int = None) -> Executor:
+    return ProcessPoolExecutor(max_workers=nb_workers, mp_context=multiprocessing.get_context("spawn"),
+                               max_tasks_per_child=jobs_per_worker)
+
+
+def _may_start(job: BatchJob, running_jobs: list[BatchJob], nb_workers: int, max_memory: int) -> bool:
+    # Jobs exceeding the memory budget of the batch only start on an idle pool and block it until they finished
+    if not running_jobs:
+        return True
+    if len(running_jobs) >= nb_workers or job.memory_budget > max_memory:
+        return False
+    if any(running_job.memory_budget > max_memory for running_job in running_jobs):
+        return False
+    return sum(running_job.memory_budget for running_job in running_jobs) + job.memory_budget <= max_memory
+
+
+def _write_summary(summary_path: Path, summary: dict) -> None:
+    summary_path.parent.mkdir(parents=True, exist_ok=True)
+    with open(summary_path, "w") as f:
+        json.dump(summary, f, indent=2, default=str)
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Runs the DeSpAn pipeline for the jobs of a manifest")
+    parser.add_argument("manifest", type=Path, help="YAML (or JSON) file with the jobs (see DeSpAn.batch)")
+    parser.add_argument("-nw", "--nb_workers", type=int, default=1, help="Maximum number of jobs running at once")
+    parser.add_argument("-mm", "--max_memory_gb", type=float,
+                        help="Memory budget of the running jobs together (default: physical memory)")
+    parser.add_argument("--jobs_per_worker", type=int,
+                        help="Number of jobs after which a worker process is replaced (default: never)")
+    parser.add_argument("-s", "--summary", type=Path,
+                        help="Summary file (default: <manifest folder>/batch_summary_<timestamp>.json)")
+    args = parser.parse_args()
+
+    jobs = load_manifest(args.manifest)
+    summary_path = args.summary
+    if summary_path is None:
+        summary_path = args.manifest.absolute().parent / f"batch_summary_{datetime.now():%Y%m%dT%H%M%S}.json"
+    print(f"Running {len(jobs):d} job(s) on {args.nb_workers:d} worker(s)")
+    summary = run_batch(jobs, summary_path, nb_workers=args.nb_workers, max_memory_gb=args.max_memory_gb,
+                        jobs_per_worker=args.jobs_per_worker)
+    print(f"{summary['completed']:d} job(s) completed, {summary['failed']:d} failed, summary written to "
+          f"'{summary_path}'")
+    return 1 if summary["failed"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
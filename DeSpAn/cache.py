@@ -0,0 +1,188 @@
+"""Cache of loaded (and filtered) epochs"""
+
+import hashlib
+import json
+import os
+from pathlib import Path
+import shutil
+from typing import Iterable
+
+import numpy as np
+
+from DeSpAn.filters import FilterFunction, filter_description
+from DeSpAn.geometry import PointCloudData
+
+
+CACHE_VERSION = 1
+MANIFEST_NAME = "manifest.json"
+
+
+def epoch_cache_key(pcd_path_list: list[Path],
+                    scalar_fields: list[str] = None,
+                    filter_functions: Iterable[FilterFunction] = None,
+                    merged: bool = True, coordinates: list = None) -> str:
+    """
+    Content address of an epoch, i.e. the hash of everything that determines the loaded point cloud.
+
+    The files are identified by their absolute path, size and modification time. Filter expressions are identified by
+    their expression and filter functions by their `repr`, which is stable for e.g. `functools.partial(np.equal, 2)`.
+    Functions whose `repr` contains a memory address (e.g. lambdas) result in a new key for each run and hence never
+    hit the cache.
+
+    Parameters
+    ----------
+    pcd_path_list : list[pathlib.Path]
+        Files of the epoch (in loading order, which determines the tile ids).
+    scalar_fields : list[str], optional
+    filter_functions : Iterable[DeSpAn.filters.PointFilter or tuple[str, func]], optional
+    merged : bool, default=True
+        The files are merged with tile ids (see `DeSpAn.geometry.merge_pcd`).
+    coordinates : list, optional
+        Settings of compact coordinates (see `DeSpAn.core.get_point_cloud_data`).
+
+    Returns
+    -------
+    key : str
+    """
+    files = []
+    for pcd_path in pcd_path_list:
+        stat = Path(pcd_path).stat()
+        files.append([str(Path(pcd_path).absolute()), stat.st_size, stat.st_mtime_ns])
+    description = {
+        "version": CACHE_VERSION,
+        "files": files,
+        "scalar_fields": list(scalar_fields) if scalar_fields is not None else None,
+        "filters": filter_description(filter_functions) if filter_functions is not None else None,
+        "merged": merged,
+        "coordinates": coordinates,
+    }
+    return hashlib.sha256(json.dumps(description, sort_keys=True).encode()).hexdigest()
+
+
+def load_cached_pcd(cache_dir: Path, key: str, storage_dir: Path = None) -> PointCloudData | None:
+    """
+    Loads a cached point cloud and marks it as recently used.
+
+    Parameters
+    ----------
+    cache_dir : pathlib.Path
+    key : str
+        See `epoch_cache_key`.
+    storage_dir : pathlib.Path, optional
+        Memory-map the cached arrays (read-only) instead of loading them, reductions of the point cloud are written to
+        `storage_dir` (see `DeSpAn.geometry.PointCloudData`).
+
+    Returns
+    -------
+    pcd : DeSpAn.geometry.PointCloudData or None
+        `None` if the key is not (or not completely) cached.
+    """
+    entry_dir = Path(cache_dir) / key
+    manifest_path = entry_dir / MANIFEST_NAME
+    if not manifest_path.is_file():
+        return None
+
+    try:
+        with open(manifest_path, "r") as f:
+            manifest = json.load(f)
+        arrays = {name: np.load(entry_dir / file_name, mmap_mode=None if storage_dir is None else "r",
+                                allow_pickle=False)
+                  for name, file_name in manifest["arrays"].items()}
+    except (OSError, ValueError, KeyError):
+        return None
+
+    os.utime(manifest_path)
+    return PointCloudData(arrays.pop("xyz"),
+                          color=arrays.pop("color", None),
+                          normals=arrays.pop("normals", None),
+                          scalar_fields={name[3:]: array for name, array in arrays.items()},
+                          storage_dir=storage_dir,
+                          origin=None if manifest.get("origin") is None else np.array(manifest["origin"]),
+                          scale=None if manifest.get("scale") is None else np.array(manifest["scale"]))
+
+
+def store_cached_pcd(cache_dir: Path, key: str, pcd: PointCloudData, max_size: int = None) -> bool:
+    """
+    Stores a point cloud as one *npy* file per array plus a manifest and evicts the least recently used entries
+    exceeding `max_size`.
+
+    The entry is written to a temporary directory first and renamed afterwards, hence concurrent runs never see
+    partially written entries.
+
+    Parameters
+    ----------
+    cache_dir : pathlib.Path
+    key : str
+        See `epoch_cache_key`.
+    pcd : DeSpAn.geometry.PointCloudData
+    max_size : int, optional
+        Maximum size of the cache in bytes.
+
+    Returns
+    -------
+    stored : bool
+        `False` if the point cloud alone exceeds `max_size`.
+    """
+    arrays = {"xyz": pcd.xyz}
+    if pcd.color is not None:
+        arrays["color"] = pcd.color
+    if pcd.normals is not None:
+        arrays["normals"] = pcd.normals
+    for sf, values in pcd.scalar_fields.items():
+        arrays[f"sf_{sf}"] = values
+
+    nb_bytes = sum(array.nbytes for array in arrays.values())
+    if max_size is not None and nb_bytes > max_size:
+        print(f"Point cloud ({nb_bytes / 2 ** 30:.1f} GiB) exceeds the cache size, not cached")
+        return False
+
+    cache_dir = Path(cache_dir)
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    entry_dir = cache_dir / key
+    tmp_dir = cache_dir / f".{key}.{os.getpid()}.tmp"
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    tmp_dir.mkdir()
+
+    manifest = {"version": CACHE_VERSION, "nb_points": pcd.xyz.shape[0], "nb_bytes": nb_bytes, "arrays": {},
+                "origin": None if pcd.origin is None else pcd.origin.tolist(),
+                "scale": None if pcd.scale is None else pcd.scale.tolist()}
+    for i, (name, array) in enumerate(arrays.items()):
+        # Scalar field names are arbitrary, hence the files are numbered
+        file_name = f"{i:03d}.npy"
+        np.save(tmp_dir / file_name, np.ascontiguousarray(array), allow_pickle=False)
+        manifest["arrays"][name] = file_name
+    with open(tmp_dir / MANIFEST_NAME, "w") as f:
+        json.dump(manifest, f, indent=2)
+
+    try:
+        os.replace(tmp_dir, entry_dir)
+    except OSError:
+        # Stored by another run in the meantime
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    if max_size is not None:
+        _evict(cache_dir, max_size, keep=key)
+    return True
+
+
+def _evict(cache_dir: Path, max_size: int, keep: str = None) -> None:
+    """
+    Removes the least recently used entries (modification time of the manifest) until the cache fits into `max_size`.
+    """
+    entries = []
+    for entry_dir in cache_dir.iterdir():
+        manifest_path = entry_dir / MANIFEST_NAME
+        if entry_dir.name.startswith(".") or not manifest_path.is_file():
+            continue
+        nb_bytes = sum(f.stat().st_size for f in entry_dir.iterdir())
+        entries.append((manifest_path.stat().st_mtime_ns, entry_dir, nb_bytes))
+
+    total_size = sum(nb_bytes for _, _, nb_bytes in entries)
+    for _, entry_dir, nb_bytes in sorted(entries, key=lambda entry: entry[0]):
+        if total_size <= max_size:
+            break
+        if entry_dir.name == keep:
+            continue
+        print(f"Evicting cached point cloud {entry_dir.name[:12]} ({nb_bytes / 2 ** 30:.1f} GiB)")
+        shutil.rmtree(entry_dir, ignore_errors=True)
+        total_size -= nb_bytes
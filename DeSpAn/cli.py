@@ -2,195 +2,954 @@
 
 import sys
 import subprocess
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import nullcontext
+from dataclasses import asdict
+from datetime import datetime
+from functools import partial
+from itertools import chain
+import multiprocessing
 from pathlib import Path
+import re
+from typing import Callable
 
-from shapely.geometry import Polygon
 import numpy as np
+import shapely
+from shapely.geometry import MultiPolygon, Polygon
 
 from DeSpAn.config import RunConfig
-from DeSpAn.core import get_point_cloud_data, border_extraction, cut_to_common_box
-from DeSpAn.data_io import save_ply, load_ply
+from DeSpAn.core import (
+    get_point_cloud_data,
+    border_extraction,
+    cut_to_common_box,
+    plan_tiles,
+    stream_merge,
+)
+from DeSpAn.data_io import (
+    save_ply,
+    load_ply,
+    save_laz,
+    load_laz,
+    find_pcd_in_directory,
+    read_pcd_header,
+    box_cut_ply,
+    ply_bounds,
+)
+from DeSpAn.filters import PointFilter, filter_description
+from DeSpAn.geometry import MEMMAP_CHUNK_SIZE, PointCloudData
+from DeSpAn.m3c2 import (
+    M3C2Parameters,
+    M3C2Reference,
+    m3c2,
+    m3c2_reference,
+    write_params_file,
+)
+from DeSpAn.report import RunReport, host_info
+from DeSpAn.segmentation import process_segments
+from DeSpAn.stages import Stage, run_stages
 
 
-RUN_CFG = RunConfig()
+# Configuration of the running pipeline (set by `main`)
+RUN_CFG: RunConfig = None
+# Estimated memory of a later epoch of a time series (coordinates, colors, scalar fields, KD-tree and queries)
+TIME_SERIES_BYTES_PER_POINT = 100
 
 
-def main() -> int:
+def _save_pcd(
+    report: RunReport, pcd_path: Path, pcd: PointCloudData, epoch: str = None
+) -> None:
+    with report.step(
+        "save", epoch=epoch, points_in=pcd.nb_points, files_out=[pcd_path]
+    ):
+        if pcd_path.suffix == ".laz":
+            save_laz(
+                pcd_path,
+                pcd,
+                float_dtype=RUN_CFG.app_settings.ply_float_dtype,
+                scale=RUN_CFG.app_settings.coordinate_scale,
+            )
+            return
+        save_ply(
+            pcd_path,
+            pcd,
+            xyz_dtype=RUN_CFG.app_settings.ply_xyz_dtype,
+            float_dtype=RUN_CFG.app_settings.ply_float_dtype,
+        )
 
-    filter_functions = (
-        [("classification", lambda npa: npa == 2)]
-        if RUN_CFG.app_settings.filter_ground_points
-        else None
+
+def _load_stage_pcd(
+    report: RunReport, results: dict, pcd_path: Path, epoch: str = None
+) -> PointCloudData:
+    # Point clouds of previous stages of the same run are reused, otherwise their output is loaded
+    if pcd_path in results:
+        return results.pop(pcd_path)
+    print(f"Loading '{pcd_path.name}'")
+    with report.step("load", epoch=epoch, files_in=[pcd_path]) as record:
+        scale = (
+            RUN_CFG.app_settings.coordinate_scale
+            if RUN_CFG.app_settings.compact_coordinates == "int32"
+            else None
+        )
+        if pcd_path.suffix == ".laz":
+            pcd = load_laz(pcd_path)
+            if RUN_CFG.app_settings.compact_coordinates is not None:
+                pcd.compact(scale=scale)
+        elif RUN_CFG.app_settings.compact_coordinates is not None:
+            # Converted from the mapping of the file, without a float64 copy (origin as in `PointCloudData.compact`)
+            minimum_corner, maximum_corner = ply_bounds(pcd_path)
+            pcd = load_ply(
+                pcd_path,
+                origin=np.round((minimum_corner + maximum_corner) / 2),
+                scale=None if scale is None else np.full((3,), float(scale)),
+            )
+        else:
+            pcd = load_ply(pcd_path)
+        record.points_out = pcd.nb_points
+    return pcd
+
+
+def _per_epoch(func: Callable, *epoch_args: tuple) -> list:
+    # The epochs are independent up to their intersection, numpy, shapely and the file I/O release the GIL
+    if not RUN_CFG.app_settings.concurrent_epochs:
+        return [func(*args) for args in epoch_args]
+    with ThreadPoolExecutor(max_workers=len(epoch_args)) as executor:
+        futures = [executor.submit(func, *args) for args in epoch_args]
+        return [future.result() for future in futures]
+
+
+def _core_point_subsample(m3c2_params: M3C2Parameters) -> tuple[str, float] | None:
+    # Mode and size of the core point subsampling, None uses all points of the first epoch
+    mode = RUN_CFG.app_settings.core_point_mode
+    if mode == "all" or (mode == "settings" and not m3c2_params.subsample_enabled):
+        return None
+    if mode == "settings":
+        # As CloudCompare does without a core points cloud
+        mode = "spacing"
+    spacing = RUN_CFG.app_settings.core_point_spacing
+    if spacing is None:
+        spacing = m3c2_params.subsample_radius
+    if spacing is None:
+        raise ValueError(
+            "The core point spacing is neither configured nor defined in the M3C2 settings (SubsampleRadius)"
+        )
+    return mode, spacing
+
+
+def _epoch_tiles(data_path: Path) -> list[Path]:
+    if data_path.is_dir():
+        return find_pcd_in_directory(
+            data_path,
+            RUN_CFG.app_settings.greedy_file_types,
+            RUN_CFG.app_settings.greedy_directory_search,
+        )
+    return [data_path]
+
+
+def _load_epoch(
+    report: RunReport,
+    data_path: Path | list[Path],
+    tiles: list[Path],
+    scalar_fields: list[str],
+    filter_functions: list[PointFilter],
+    nb_workers: int,
+    storage_dir: Path = None,
+    epoch: str = None,
+) -> PointCloudData:
+    # Loading and merging interleave (the tiles are merged as they arrive), hence they are one step
+    with report.step("load", epoch=epoch, files_in=tiles) as record:
+        pcd = get_point_cloud_data(
+            data_path,
+            pcd_file_types=RUN_CFG.app_settings.greedy_file_types,
+            greedy=RUN_CFG.app_settings.greedy_directory_search,
+            scalar_fields=scalar_fields,
+            filter_functions=filter_functions or None,
+            nb_workers=nb_workers,
+            preallocate=RUN_CFG.app_settings.preallocate_merge,
+            chunk_size=RUN_CFG.app_settings.laz_chunk_size,
+            cache_dir=RUN_CFG.paths.epoch_cache,
+            max_cache_size=int(RUN_CFG.app_settings.epoch_cache_size_gb * 2**30),
+            storage_dir=storage_dir,
+            compact_coordinates=RUN_CFG.app_settings.compact_coordinates,
+            coordinate_scale=RUN_CFG.app_settings.coordinate_scale,
+        )
+        record.points_out = pcd.nb_points
+    return pcd
+
+
+def _load_stage_border(results: dict, border_path: Path) -> Polygon | MultiPolygon:
+    if border_path in results:
+        return results[border_path]
+    with open(border_path, "r") as f:
+        return shapely.from_wkt(f.read())
+
+
+def _epoch_field_suffix(epoch: str) -> str:
+    # Scalar field names of ply files must not contain whitespace
+    return re.sub(r"\W+", "_", epoch).strip("_")
+
+
+def _time_series_concurrency(tile_lists: list[list[Path]]) -> int:
+    # Number of later epochs that fit into the memory at once (estimated from the point counts in the headers)
+    memory = RUN_CFG.app_settings.time_series_memory_gb
+    memory = (
+        (host_info()["memory"] or 0) // 2 if memory is None else int(memory * 2**30)
     )
-    scalar_fields = []
-    if RUN_CFG.app_settings.retain_intensities:
-        scalar_fields.append("intensity")
-    if RUN_CFG.app_settings.filter_ground_points:
-        scalar_fields.append("classification")
-    pcd_e1 = get_point_cloud_data(
-        RUN_CFG.paths.pcd_e1,
-        pcd_file_types=RUN_CFG.app_settings.greedy_file_types,
-        greedy=RUN_CFG.app_settings.greedy_directory_search,
-        scalar_fields=scalar_fields,
-        filter_functions=filter_functions,
+    nb_points = max(
+        sum(read_pcd_header(tile).point_count for tile in tiles) for tiles in tile_lists
     )
-
-    pcd_e2 = get_point_cloud_data(
-        RUN_CFG.paths.pcd_e2,
-        pcd_file_types=RUN_CFG.app_settings.greedy_file_types,
-        greedy=RUN_CFG.app_settings.greedy_directory_search,
-        scalar_fields=scalar_fields,
-        filter_functions=filter_functions,
+    return int(
+        np.clip(
+            memory // max(nb_points * TIME_SERIES_BYTES_PER_POINT, 1),
+            1,
+            len(tile_lists),
+        )
     )
-    #
 
-    save_ply(
-        RUN_CFG.paths.intermediate_results
-        / f"01a_{RUN_CFG.project_meta.epoch1_name}_merged.ply",
-        pcd_e1,
-    )
 
-    save_ply(
-        RUN_CFG.paths.intermediate_results
-        / f"01b_{RUN_CFG.project_meta.epoch2_name}_merged.ply",
-        pcd_e2,
-    )
+def _time_series(
+    report: RunReport, scalar_fields: list[str], filter_functions: list[PointFilter]
+) -> None:
+    """
+    Compares the later epochs (`paths.pcd_epochs`) with the first epoch as time series.
+
+    The reference epoch is loaded once, and its border, the normals and the statistics of its M3C2 cylinders (see
+    `DeSpAn.m3c2.M3C2Reference`) are computed once for all epochs. The later epochs are cut to the reference border
+    (intersected with their own border) and compared concurrently as far as `time_series_memory_gb` allows. The core
+    points are written to a single file with the scalar fields *m3c2_distance_<epoch>*,
+    *distance_uncertainty_<epoch>* and *significant_change_<epoch>* per epoch (*nan* outside of the epoch).
+    """
+    if RUN_CFG.app_settings.m3c2_backend != "native":
+        raise ValueError("Time series require the native M3C2 backend")
 
-    cut_to_common_box((pcd_e1, pcd_e2))
+    results_dir = RUN_CFG.paths.intermediate_results
+    reference_name = RUN_CFG.project_meta.epoch1_name
+    epoch_paths = RUN_CFG.paths.pcd_epochs
+    epoch_names = RUN_CFG.project_meta.epoch_names or [
+        path.stem for path in epoch_paths
+    ]
+    if len(epoch_names) != len(epoch_paths):
+        raise ValueError(
+            f"{len(epoch_names):d} epoch names for {len(epoch_paths):d} later epochs"
+        )
+    suffixes = [_epoch_field_suffix(epoch) for epoch in epoch_names]
+    if len(set(suffixes)) != len(suffixes):
+        raise ValueError(f"The epoch names are not unique ({', '.join(epoch_names)})")
 
-    pcd_e1_path_boxcut = (
-        RUN_CFG.paths.intermediate_results
-        / f"02a_{RUN_CFG.project_meta.epoch1_name}_boxcut.ply"
+    reference_tiles = _epoch_tiles(RUN_CFG.paths.pcd_e1)
+    epoch_tiles = [_epoch_tiles(path) for path in epoch_paths]
+    # Common boxes of the headers of the reference and the pruned epochs (see `plan_tiles`)
+    epoch_boxes = [None] * len(epoch_paths)
+    if RUN_CFG.app_settings.prune_tiles and RUN_CFG.paths.pcd_e1.is_dir():
+        # Only the tiles of the later epochs are pruned, the reference is shared
+        with report.step("plan_tiles"):
+            for i, path in enumerate(epoch_paths):
+                if path.is_dir():
+                    (_, epoch_tiles[i]), epoch_boxes[i] = plan_tiles(
+                        [reference_tiles, epoch_tiles[i]],
+                        bounds_cache_path=results_dir / "tile_bounds.json",
+                    )
+
+    border_path = results_dir / f"03_{reference_name}_border.wkt"
+    time_series_path = (
+        results_dir
+        / f"04_{reference_name}_time_series_m3c2.{RUN_CFG.app_settings.stage_formats['m3c2']}"
     )
-    pcd_e2_path_boxcut = (
-        RUN_CFG.paths.intermediate_results
-        / f"02b_{RUN_CFG.project_meta.epoch2_name}_boxcut.ply"
+    nb_concurrent = _time_series_concurrency(epoch_tiles)
+    nb_epoch_workers = max(RUN_CFG.app_settings.nb_workers // nb_concurrent, 1)
+
+    def border_epoch(pcd: PointCloudData, epoch: str) -> Polygon | MultiPolygon:
+        with report.step("border", epoch=epoch, points_in=pcd.nb_points):
+            return border_extraction(
+                pcd,
+                mode=RUN_CFG.app_settings.border_mode,
+                cell_size=RUN_CFG.app_settings.border_cell_size,
+            )
+
+    def compare_epoch(
+        reference: M3C2Reference,
+        reference_bounds: tuple[np.ndarray, np.ndarray],
+        border_reference: Polygon | MultiPolygon,
+        tiles: list[Path],
+        box: tuple[np.ndarray, np.ndarray] | None,
+        epoch: str,
+    ) -> dict[str, np.ndarray]:
+        storage_dir = None
+        if RUN_CFG.paths.memmap_storage is not None:
+            storage_dir = RUN_CFG.paths.memmap_storage / epoch
+        pcd = _load_epoch(
+            report,
+            tiles,
+            tiles,
+            scalar_fields,
+            filter_functions,
+            nb_epoch_workers,
+            storage_dir,
+            epoch,
+        )
+        pcd.defer_reductions()
+
+        # As `cut_to_common_box`, but the reference is not cut
+        with report.step("boxcut", epoch=epoch, points_in=pcd.nb_points) as record:
+            if box is None:
+                minimum_corner, maximum_corner = pcd.bounds()
+                box = (
+                    np.maximum(minimum_corner, reference_bounds[0]),
+                    np.minimum(maximum_corner, reference_bounds[1]),
+                )
+            pcd.box_cut(tuple(box[0]), tuple(box[1]))
+            record.points_out = pcd.nb_points
+
+        border_common = border_reference.intersection(border_epoch(pcd, epoch))
+        with report.step("crop", epoch=epoch, points_in=pcd.nb_points) as record:
+            pcd.polygon_crop(border_common)
+            record.points_out = pcd.nb_points
+
+        print(f"Running M3C2 (native) for epoch '{epoch}'")
+        with report.step(
+            "m3c2", epoch=epoch, points_in=reference.core_points.nb_points
+        ) as record:
+            distances = reference.compare(pcd)
+            # Core points outside of the common border are not compared (as in the border cut of two epochs)
+            outside = ~reference.core_points.polygon_mask(border_common)
+            distances["m3c2_distance"][outside] = np.nan
+            distances["distance_uncertainty"][outside] = np.nan
+            distances["significant_change"][outside] = 0
+            record.points_out = int(np.count_nonzero(~outside))
+        return distances
+
+    def time_series() -> None:
+        reference_pcd = _load_epoch(
+            report,
+            RUN_CFG.paths.pcd_e1,
+            reference_tiles,
+            scalar_fields,
+            filter_functions,
+            RUN_CFG.app_settings.nb_workers,
+            (
+                None
+                if RUN_CFG.paths.memmap_storage is None
+                else RUN_CFG.paths.memmap_storage / reference_name
+            ),
+            reference_name,
+        )
+        border_reference = border_epoch(reference_pcd, reference_name)
+        results_dir.mkdir(parents=True, exist_ok=True)
+        with open(border_path, "w") as f:
+            f.write(shapely.to_wkt(border_reference, rounding_precision=-1))
+
+        m3c2_params = M3C2Parameters.from_file(RUN_CFG.paths.m3c2_settings)
+        subsample = _core_point_subsample(m3c2_params)
+        core_points = reference_pcd
+        if subsample is not None:
+            print(f"Subsampling the core points ({subsample[0]} {subsample[1]})")
+            with report.step(
+                "core_points", points_in=reference_pcd.nb_points
+            ) as record:
+                core_points = reference_pcd.subsample(*subsample)
+                record.points_out = core_points.nb_points
+        # Reused by the border masks of all epochs
+        core_points.spatial_index()
+
+        print("Running M3C2 (native) on the reference epoch")
+        with report.step(
+            "m3c2_reference", epoch=reference_name, points_in=core_points.nb_points
+        ):
+            reference = m3c2_reference(core_points, reference_pcd, m3c2_params)
+        reference_bounds = reference_pcd.bounds()
+        del reference_pcd
+
+        print(f"Comparing {len(epoch_names):d} epoch(s), {nb_concurrent:d} at once")
+        with ThreadPoolExecutor(max_workers=nb_concurrent) as executor:
+            futures = [
+                executor.submit(
+                    compare_epoch,
+                    reference,
+                    reference_bounds,
+                    border_reference,
+                    tiles,
+                    box,
+                    epoch,
+                )
+                for tiles, box, epoch in zip(epoch_tiles, epoch_boxes, epoch_names)
+            ]
+            epoch_distances = [future.result() for future in futures]
+
+        scalar_fields_out = dict(core_points.scalar_fields)
+        scalar_fields_out.update(
+            {
+                "npoints_cloud1": reference.count.astype(np.uint32),
+                "std_cloud1": reference.std,
+            }
+        )
+        for suffix, distances in zip(suffixes, epoch_distances):
+            for name in [
+                "m3c2_distance",
+                "distance_uncertainty",
+                "significant_change",
+            ]:
+                scalar_fields_out[f"{name}_{suffix}"] = distances[name]
+        pcd_time_series = PointCloudData(
+            core_points.coordinates().copy(),
+            color=core_points.color,
+            normals=reference.normals,
+            scalar_fields=scalar_fields_out,
+        )
+        _save_pcd(report, time_series_path, pcd_time_series)
+
+    run_stages(
+        [
+            Stage(
+                "time_series",
+                tuple(reference_tiles)
+                + tuple(chain.from_iterable(epoch_tiles))
+                + (RUN_CFG.paths.m3c2_settings,),
+                (border_path, time_series_path),
+                time_series,
+                settings={
+                    "tiles": [
+                        [f"{tile}" for tile in tiles]
+                        for tiles in [reference_tiles] + epoch_tiles
+                    ],
+                    "epoch_names": epoch_names,
+                    "scalar_fields": scalar_fields,
+                    "filters": filter_description(filter_functions),
+                    "compact_coordinates": RUN_CFG.app_settings.compact_coordinates,
+                    "coordinate_scale": RUN_CFG.app_settings.coordinate_scale,
+                    "border_mode": RUN_CFG.app_settings.border_mode,
+                    "border_cell_size": RUN_CFG.app_settings.border_cell_size,
+                    "m3c2_settings": f"{RUN_CFG.paths.m3c2_settings}",
+                    "core_point_mode": RUN_CFG.app_settings.core_point_mode,
+                    "core_point_spacing": RUN_CFG.app_settings.core_point_spacing,
+                    "ply_xyz_dtype": RUN_CFG.app_settings.ply_xyz_dtype,
+                    "ply_float_dtype": RUN_CFG.app_settings.ply_float_dtype,
+                },
+            )
+        ],
+        results_dir / "stages.json",
+        report=report,
     )
 
-    save_ply(pcd_e1_path_boxcut, pcd_e1)
-    save_ply(pcd_e2_path_boxcut, pcd_e2)
 
-    border_e1_xy = border_extraction(pcd_e1)
-    border_e2_xy = border_extraction(pcd_e2)
-    #
-    border_e1 = Polygon(border_e1_xy)
-    border_e2 = Polygon(border_e2_xy)
+def main(run_cfg: RunConfig = None) -> int:
+    """
+    Runs the pipeline.
+
+    Parameters
+    ----------
+    run_cfg : DeSpAn.config.RunConfig, optional
+        Configuration of the run (e.g. a job of a batch, see `DeSpAn.batch`). `None` parses the command line.
 
-    border_common = border_e1.intersection(border_e2)
-    # TODO: CHECK FOR MULTIPOLYGON
+    Returns
+    -------
+    exit_code : int
+    """
+    global RUN_CFG
+    RUN_CFG = RunConfig() if run_cfg is None else run_cfg
 
-    border_xy = np.array(border_common.exterior.coords.xy).T
-    offset_xy = -np.round(
-        np.array(border_common.exterior.centroid.coords.xy).T.squeeze()
+    results_dir = RUN_CFG.paths.intermediate_results
+    report = RunReport(
+        results_dir / f"run_report_{datetime.now():%Y%m%dT%H%M%S}.json",
+        profile_dir=(
+            results_dir / "profiles" if RUN_CFG.app_settings.profile_steps else None
+        ),
+        settings=asdict(RUN_CFG),
     )
 
+    # The readers decode the dimensions of the filters, hence they need not be kept
+    filter_functions = [
+        PointFilter(expression) for expression in RUN_CFG.app_settings.point_filters
+    ]
+    if RUN_CFG.app_settings.filter_ground_points:
+        filter_functions.insert(0, PointFilter("classification == 2"))
+    scalar_fields = []
+    if RUN_CFG.app_settings.retain_intensities:
+        scalar_fields.append("intensity")
+    if RUN_CFG.app_settings.filter_ground_points:
+        scalar_fields.append("classification")
+
+    if RUN_CFG.paths.pcd_epochs:
+        status = "failed"
+        try:
+            _time_series(report, scalar_fields, filter_functions)
+            status = "completed"
+        finally:
+            report.write(status)
+        return 0
+    if RUN_CFG.paths.pcd_e2 is None:
+        raise ValueError(
+            "Neither a second epoch (pcd_e2) nor later epochs (pcd_epochs) are configured"
+        )
+
+    data_path_e1 = RUN_CFG.paths.pcd_e1
+    data_path_e2 = RUN_CFG.paths.pcd_e2
+    # Common box of the headers of all tiles, the box cut uses it instead of the bounds of the pruned epochs
+    tile_box = None
+    if (
+        RUN_CFG.app_settings.prune_tiles
+        and data_path_e1.is_dir()
+        and data_path_e2.is_dir()
+    ):
+        with report.step("plan_tiles"):
+            (data_path_e1, data_path_e2), tile_box = plan_tiles(
+                [
+                    find_pcd_in_directory(
+                        data_path,
+                        RUN_CFG.app_settings.greedy_file_types,
+                        RUN_CFG.app_settings.greedy_directory_search,
+                    )
+                    for data_path in (data_path_e1, data_path_e2)
+                ],
+                bounds_cache_path=results_dir / "tile_bounds.json",
+            )
+
+    tiles_e1, tiles_e2 = [
+        data_path if isinstance(data_path, list) else _epoch_tiles(data_path)
+        for data_path in (data_path_e1, data_path_e2)
+    ]
+
+    storage_dir_e1 = storage_dir_e2 = None
+    if RUN_CFG.paths.memmap_storage is not None:
+        storage_dir_e1 = RUN_CFG.paths.memmap_storage / RUN_CFG.project_meta.epoch1_name
+        storage_dir_e2 = RUN_CFG.paths.memmap_storage / RUN_CFG.project_meta.epoch2_name
+
+    epoch1_name = RUN_CFG.project_meta.epoch1_name
+    epoch2_name = RUN_CFG.project_meta.epoch2_name
+    # Suffixes of the point cloud outputs of the stages (ply or laz)
+    formats = RUN_CFG.app_settings.stage_formats
+    pcd_e1_path_merged = results_dir / f"01a_{epoch1_name}_merged.{formats['merge']}"
+    pcd_e2_path_merged = results_dir / f"01b_{epoch2_name}_merged.{formats['merge']}"
+    pcd_e1_path_boxcut = results_dir / f"02a_{epoch1_name}_boxcut.{formats['boxcut']}"
+    pcd_e2_path_boxcut = results_dir / f"02b_{epoch2_name}_boxcut.{formats['boxcut']}"
     pcd_e1_path_bordercut = (
-        RUN_CFG.paths.intermediate_results
-        / f"03a_{RUN_CFG.project_meta.epoch1_name}_bordercut.ply"
+        results_dir / f"03a_{epoch1_name}_bordercut.{formats['bordercut']}"
     )
     pcd_e2_path_bordercut = (
-        RUN_CFG.paths.intermediate_results
-        / f"03b_{RUN_CFG.project_meta.epoch2_name}_bordercut.ply"
+        results_dir / f"03b_{epoch2_name}_bordercut.{formats['bordercut']}"
     )
-
-    print("Running border cut on first point cloud")
-    cc_call_e1 = subprocess.run(
-        [
-            RUN_CFG.paths.CC_exe,
-            "-SILENT",
-            "-LOG_FILE",
-            f"{RUN_CFG.paths.intermediate_results / 'boxcut_e1.log'}",
-            "-C_EXPORT_FMT",
-            "PLY",
-            "-AUTO_SAVE",
-            "OFF",
-            "-O",
-            "-GLOBAL_SHIFT",
-            *[f"{x:0.3f}" for x in offset_xy],
-            "0.0",
-            f"{pcd_e1_path_boxcut}",
-            "-CROP2D",
-            "Z",
-            str(border_xy.shape[0]),
-            *[f"{x:0.3f}" for x in (border_xy + offset_xy).flatten()],
-            "-SAVE_CLOUDS",
-            "FILE",
-            f"{pcd_e1_path_bordercut}",
-        ],
-        shell=False,
-        check=True,
-        text=True,
-        capture_output=True,
+    border_path = results_dir / f"03_{epoch1_name}_{epoch2_name}_border.wkt"
+    m3c2_path = results_dir / f"04_{epoch1_name}_{epoch2_name}_m3c2.{formats['m3c2']}"
+    core_points_path = (
+        results_dir / f"04_{epoch1_name}_{epoch2_name}_core_points.{formats['m3c2']}"
     )
+    m3c2_log_path = results_dir / "log_m3c2.log"
+    # CloudCompare settings with NormalMode=1 if the normals of epoch 1 are estimated in the bordercut stage
+    m3c2_settings_normals_path = results_dir / "m3c2_params_reference_normals.txt"
 
-    print("Running border cut on second point cloud")
-    cc_call_e2 = subprocess.run(
-        [
-            RUN_CFG.paths.CC_exe,
-            "-SILENT",
-            "-LOG_FILE",
-            f"{RUN_CFG.paths.intermediate_results / 'boxcut_e2.log'}",
-            "-C_EXPORT_FMT",
-            "PLY",
-            "-AUTO_SAVE",
-            "OFF",
-            "-O",
-            "-GLOBAL_SHIFT",
-            *[f"{x:0.3f}" for x in offset_xy],
-            "0.0",
-            f"{pcd_e2_path_boxcut}",
-            "-CROP2D",
-            "Z",
-            str(border_xy.shape[0]),
-            *[f"{x:0.3f}" for x in (border_xy + offset_xy).flatten()],
-            "-SAVE_CLOUDS",
-            "FILE",
-            f"{pcd_e2_path_bordercut}",
-        ],
-        shell=False,
-        check=True,
-        text=True,
-        capture_output=True,
+    native_m3c2 = RUN_CFG.app_settings.m3c2_backend == "native"
+    # Outputs of the stages of this run (by path), which are not loaded again by the following stages
+    results = dict()
+
+    # Concurrent epochs share the workers
+    nb_epoch_workers = (
+        max(RUN_CFG.app_settings.nb_workers // 2, 1)
+        if RUN_CFG.app_settings.concurrent_epochs
+        else RUN_CFG.app_settings.nb_workers
     )
 
-    print("Running M3C2")
+    def merge() -> None:
+        def merge_epoch(
+            data_path: Path,
+            tiles: list[Path],
+            storage_dir: Path,
+            pcd_path: Path,
+            epoch: str,
+        ) -> None:
+            if RUN_CFG.app_settings.streaming_merge:
+                stream_epoch(tiles, pcd_path, epoch)
+                return
+            pcd = _load_epoch(
+                report,
+                data_path,
+                tiles,
+                scalar_fields,
+                filter_functions,
+                nb_epoch_workers,
+                storage_dir,
+                epoch,
+            )
+            save_epoch(pcd_path, pcd, epoch)
 
-    cc_m3c2 = subprocess.run(
-        [
-            RUN_CFG.paths.CC_exe,
-            "-SILENT",
-            "-NO_TIMESTAMP",
-            "-LOG_FILE",
-            f"{RUN_CFG.paths.intermediate_results / 'log_m3c2.log'}",
-            "-C_EXPORT_FMT",
-            "PLY",
-            "-AUTO_SAVE",
-            "OFF",
-            "-O",
-            "-GLOBAL_SHIFT",
-            *[f"{x:.3f}" for x in offset_xy],
-            "0.0",
-            f"{pcd_e1_path_bordercut}",
-            "-O",
-            "-GLOBAL_SHIFT",
-            *[f"{x:.3f}" for x in offset_xy],
-            "0.0",
-            f"{pcd_e2_path_bordercut}",
-            "-M3C2",
-            f"{RUN_CFG.paths.m3c2_settings}",
-            "-SET_ACTIVE_SF",
-            "8",
-            "-SF_COLOR_SCALE",
-            f"{RUN_CFG.paths.hsv_settings}",
-            "-SF_CONVERT_TO_RGB",
-            "FALSE",
-            "-SAVE_CLOUDS",
-        ],
-        shell=False,
-        check=True,
-        text=True,
-        capture_output=True,
-    )
+        _per_epoch(
+            merge_epoch,
+            (data_path_e1, tiles_e1, storage_dir_e1, pcd_e1_path_merged, epoch1_name),
+            (data_path_e2, tiles_e2, storage_dir_e2, pcd_e2_path_merged, epoch2_name),
+        )
+
+    def stream_epoch(tiles: list[Path], pcd_path: Path, epoch: str) -> None:
+        # The tiles are written to the merged file as they are read, the epoch is never held in memory
+        with report.step(
+            "load", epoch=epoch, files_in=tiles, files_out=[pcd_path]
+        ) as record:
+            record.points_out = stream_merge(
+                tiles,
+                pcd_path,
+                scalar_fields=scalar_fields,
+                filter_functions=filter_functions or None,
+                chunk_size=RUN_CFG.app_settings.laz_chunk_size or MEMMAP_CHUNK_SIZE,
+                xyz_dtype=RUN_CFG.app_settings.ply_xyz_dtype,
+                float_dtype=RUN_CFG.app_settings.ply_float_dtype,
+            )
+
+    def stream_boxcut() -> None:
+        # The common box is determined from the merged files (without pruned tiles) and the points within are copied
+        # chunk by chunk
+        if tile_box is None:
+            bounds = _per_epoch(
+                ply_bounds, (pcd_e1_path_merged,), (pcd_e2_path_merged,)
+            )
+            minimum_corner = tuple(np.amax([bound[0] for bound in bounds], axis=0))
+            maximum_corner = tuple(np.amin([bound[1] for bound in bounds], axis=0))
+        else:
+            minimum_corner, maximum_corner = tuple(tile_box[0]), tuple(tile_box[1])
+        with report.step(
+            "boxcut",
+            files_in=[pcd_e1_path_merged, pcd_e2_path_merged],
+            files_out=[pcd_e1_path_boxcut, pcd_e2_path_boxcut],
+        ) as record:
+            record.points_out = sum(
+                _per_epoch(
+                    partial(
+                        box_cut_ply,
+                        minimum_corner=minimum_corner,
+                        maximum_corner=maximum_corner,
+                    ),
+                    (pcd_e1_path_merged, pcd_e1_path_boxcut),
+                    (pcd_e2_path_merged, pcd_e2_path_boxcut),
+                )
+            )
+
+    def save_epoch(pcd_path: Path, pcd: PointCloudData, epoch: str) -> None:
+        _save_pcd(report, pcd_path, pcd, epoch)
+        results[pcd_path] = pcd
+
+    def load_epochs(
+        pcd_e1_path: Path, pcd_e2_path: Path
+    ) -> tuple[PointCloudData, PointCloudData]:
+        return _per_epoch(
+            partial(_load_stage_pcd, report, results),
+            (pcd_e1_path, epoch1_name),
+            (pcd_e2_path, epoch2_name),
+        )
+
+    def boxcut() -> None:
+        if RUN_CFG.app_settings.streaming_merge:
+            stream_boxcut()
+            return
+        pcd_e1, pcd_e2 = load_epochs(pcd_e1_path_merged, pcd_e2_path_merged)
+        # The cut is applied when the points are accessed, the files are saved from the selection
+        pcd_e1.defer_reductions()
+        pcd_e2.defer_reductions()
+
+        with report.step(
+            "boxcut", points_in=pcd_e1.nb_points + pcd_e2.nb_points
+        ) as record:
+            cut_to_common_box((pcd_e1, pcd_e2), box=tile_box)
+            record.points_out = pcd_e1.nb_points + pcd_e2.nb_points
+
+        _per_epoch(
+            save_epoch,
+            (pcd_e1_path_boxcut, pcd_e1, epoch1_name),
+            (pcd_e2_path_boxcut, pcd_e2, epoch2_name),
+        )
+
+    def border_epoch(
+        pcd: PointCloudData, epoch: str, executor: ProcessPoolExecutor = None
+    ) -> Polygon | MultiPolygon:
+        with report.step("border", epoch=epoch, points_in=pcd.nb_points):
+            return border_extraction(
+                pcd,
+                mode=RUN_CFG.app_settings.border_mode,
+                cell_size=RUN_CFG.app_settings.border_cell_size,
+                executor=executor,
+            )
+
+    def crop_epoch(
+        pcd: PointCloudData, epoch: str, border: Polygon | MultiPolygon
+    ) -> None:
+        with report.step("crop", epoch=epoch, points_in=pcd.nb_points) as record:
+            pcd.polygon_crop(border)
+            record.points_out = pcd.nb_points
+
+    def normals_epoch(pcd: PointCloudData, epoch: str) -> None:
+        # Saved with the bordercut output, M3C2 reuses them with the normals of cloud 1 (NormalMode=1)
+        print(f"Estimating the normals of {epoch}")
+        with report.step("normals", epoch=epoch, points_in=pcd.nb_points):
+            pcd.estimate_normals(
+                RUN_CFG.app_settings.normal_scales,
+                nb_threads=RUN_CFG.app_settings.nb_workers,
+            )
+
+    def bordercut() -> None:
+        pcd_e1, pcd_e2 = load_epochs(pcd_e1_path_boxcut, pcd_e2_path_boxcut)
+        pcd_e1.defer_reductions()
+        pcd_e2.defer_reductions()
+
+        # The alpha shape holds the GIL, hence it is computed in processes (only the subsample is transferred)
+        with (
+            ProcessPoolExecutor(
+                max_workers=2, mp_context=multiprocessing.get_context("spawn")
+            )
+            if RUN_CFG.app_settings.concurrent_epochs
+            and RUN_CFG.app_settings.border_mode == "alphashape"
+            else nullcontext()
+        ) as border_executor:
+            border_e1, border_e2 = _per_epoch(
+                partial(border_epoch, executor=border_executor),
+                (pcd_e1, epoch1_name),
+                (pcd_e2, epoch2_name),
+            )
+
+        border_common = border_e1.intersection(border_e2)
+
+        if RUN_CFG.app_settings.segment_length is not None:
+            print("Running border cut on corridor segments")
+            with report.step(
+                "crop", points_in=pcd_e1.nb_points + pcd_e2.nb_points
+            ) as record:
+                pcd_e1, pcd_e2, _ = process_segments(
+                    pcd_e1,
+                    pcd_e2,
+                    border_common,
+                    RUN_CFG.app_settings.segment_length,
+                    RUN_CFG.app_settings.segment_overlap,
+                    nb_workers=RUN_CFG.app_settings.nb_workers,
+                )
+                record.points_out = pcd_e1.nb_points + pcd_e2.nb_points
+        else:
+            print("Running border cut on both point clouds")
+            _per_epoch(
+                partial(crop_epoch, border=border_common),
+                (pcd_e1, epoch1_name),
+                (pcd_e2, epoch2_name),
+            )
+
+        if RUN_CFG.app_settings.normal_scales is not None:
+            normals_epoch(pcd_e1, epoch1_name)
+
+        _per_epoch(
+            save_epoch,
+            (pcd_e1_path_bordercut, pcd_e1, epoch1_name),
+            (pcd_e2_path_bordercut, pcd_e2, epoch2_name),
+        )
+        with open(border_path, "w") as f:
+            f.write(shapely.to_wkt(border_common, rounding_precision=-1))
+        results[border_path] = border_common
+
+    def compute_m3c2() -> None:
+        border_common = _load_stage_border(results, border_path)
+
+        if native_m3c2:
+            pcd_e1, pcd_e2 = load_epochs(pcd_e1_path_bordercut, pcd_e2_path_bordercut)
+            m3c2_params = M3C2Parameters.from_file(RUN_CFG.paths.m3c2_settings)
+            if RUN_CFG.app_settings.normal_scales is not None:
+                print("Using the normals of the bordercut stage (NormalMode=1)")
+                m3c2_params = m3c2_params.with_reference_normals()
+            subsample = _core_point_subsample(m3c2_params)
+            if RUN_CFG.app_settings.segment_length is not None:
+                print("Running M3C2 (native) on corridor segments")
+                with report.step("m3c2", points_in=pcd_e1.nb_points) as record:
+                    _, _, pcd_m3c2 = process_segments(
+                        pcd_e1,
+                        pcd_e2,
+                        border_common,
+                        RUN_CFG.app_settings.segment_length,
+                        RUN_CFG.app_settings.segment_overlap,
+                        m3c2_params,
+                        nb_workers=RUN_CFG.app_settings.nb_workers,
+                        core_point_subsample=subsample,
+                    )
+                    record.points_out = pcd_m3c2.nb_points
+            else:
+                core_points = pcd_e1
+                if subsample is not None:
+                    print(
+                        f"Subsampling the core points ({subsample[0]} {subsample[1]})"
+                    )
+                    with report.step(
+                        "core_points", points_in=pcd_e1.nb_points
+                    ) as record:
+                        core_points = pcd_e1.subsample(*subsample)
+                        record.points_out = core_points.nb_points
+                print("Running M3C2 (native)")
+                with report.step("m3c2", points_in=core_points.nb_points) as record:
+                    pcd_m3c2 = m3c2(core_points, pcd_e1, pcd_e2, m3c2_params)
+                    record.points_out = pcd_m3c2.nb_points
+            _save_pcd(report, m3c2_path, pcd_m3c2)
+            return
+
+        # CloudCompare subsamples the first cloud itself (settings) or uses a third cloud as core points
+        core_points_cloud = []
+        if RUN_CFG.app_settings.core_point_mode == "all":
+            core_points_cloud = [pcd_e1_path_bordercut]
+        elif RUN_CFG.app_settings.core_point_mode != "settings":
+            subsample = _core_point_subsample(
+                M3C2Parameters.from_file(RUN_CFG.paths.m3c2_settings)
+            )
+            pcd_e1 = _load_stage_pcd(
+                report, results, pcd_e1_path_bordercut, epoch1_name
+            )
+            print(f"Subsampling the core points ({subsample[0]} {subsample[1]})")
+            with report.step("core_points", points_in=pcd_e1.nb_points) as record:
+                core_points = pcd_e1.subsample(*subsample)
+                record.points_out = core_points.nb_points
+            _save_pcd(report, core_points_path, core_points)
+            core_points_cloud = [core_points_path]
+
+        m3c2_settings = RUN_CFG.paths.m3c2_settings
+        if RUN_CFG.app_settings.normal_scales is not None:
+            print("Using the normals of the bordercut stage (NormalMode=1)")
+            m3c2_settings = write_params_file(
+                m3c2_settings, m3c2_settings_normals_path, {"NormalMode": 1}
+            )
+
+        offset_xy = -np.round(np.array(border_common.centroid.coords.xy).T.squeeze())
+
+        print("Running M3C2")
+
+        with report.step(
+            "m3c2",
+            files_in=[pcd_e1_path_bordercut, pcd_e2_path_bordercut],
+            files_out=[m3c2_log_path],
+        ):
+            cc_m3c2 = subprocess.run(
+                [
+                    RUN_CFG.paths.CC_exe,
+                    "-SILENT",
+                    "-NO_TIMESTAMP",
+                    "-LOG_FILE",
+                    f"{m3c2_log_path}",
+                    "-C_EXPORT_FMT",
+                    "PLY",
+                    "-AUTO_SAVE",
+                    "OFF",
+                    "-O",
+                    "-GLOBAL_SHIFT",
+                    *[f"{x:.3f}" for x in offset_xy],
+                    "0.0",
+                    f"{pcd_e1_path_bordercut}",
+                    "-O",
+                    "-GLOBAL_SHIFT",
+                    *[f"{x:.3f}" for x in offset_xy],
+                    "0.0",
+                    f"{pcd_e2_path_bordercut}",
+                    *chain.from_iterable(
+                        [
+                            "-O",
+                            "-GLOBAL_SHIFT",
+                            *[f"{x:.3f}" for x in offset_xy],
+                            "0.0",
+                            f"{path}",
+                        ]
+                        for path in core_points_cloud
+                    ),
+                    "-M3C2",
+                    f"{m3c2_settings}",
+                    "-SET_ACTIVE_SF",
+                    "8",
+                    "-SF_COLOR_SCALE",
+                    f"{RUN_CFG.paths.hsv_settings}",
+                    "-SF_CONVERT_TO_RGB",
+                    "FALSE",
+                    "-SAVE_CLOUDS",
+                ],
+                shell=False,
+                check=True,
+                text=True,
+                capture_output=True,
+            )
+
+    ply_settings = {
+        "ply_xyz_dtype": RUN_CFG.app_settings.ply_xyz_dtype,
+        "ply_float_dtype": RUN_CFG.app_settings.ply_float_dtype,
+    }
+    segment_settings = {
+        "segment_length": RUN_CFG.app_settings.segment_length,
+        "segment_overlap": RUN_CFG.app_settings.segment_overlap,
+    }
+    stages = [
+        Stage(
+            "merge",
+            tuple(tiles_e1 + tiles_e2),
+            (pcd_e1_path_merged, pcd_e2_path_merged),
+            merge,
+            settings={
+                "tiles": [
+                    [f"{tile}" for tile in tiles] for tiles in (tiles_e1, tiles_e2)
+                ],
+                "scalar_fields": scalar_fields,
+                "filters": filter_description(filter_functions),
+                "compact_coordinates": RUN_CFG.app_settings.compact_coordinates,
+                "coordinate_scale": RUN_CFG.app_settings.coordinate_scale,
+                "streaming_merge": RUN_CFG.app_settings.streaming_merge,
+                **ply_settings,
+            },
+        ),
+        Stage(
+            "boxcut",
+            (pcd_e1_path_merged, pcd_e2_path_merged),
+            (pcd_e1_path_boxcut, pcd_e2_path_boxcut),
+            boxcut,
+            settings=ply_settings,
+        ),
+        Stage(
+            "bordercut",
+            (pcd_e1_path_boxcut, pcd_e2_path_boxcut),
+            (pcd_e1_path_bordercut, pcd_e2_path_bordercut, border_path),
+            bordercut,
+            settings={
+                "border_mode": RUN_CFG.app_settings.border_mode,
+                "border_cell_size": RUN_CFG.app_settings.border_cell_size,
+                "normal_scales": RUN_CFG.app_settings.normal_scales,
+                **segment_settings,
+                **ply_settings,
+            },
+        ),
+        Stage(
+            "m3c2",
+            (pcd_e1_path_bordercut, pcd_e2_path_bordercut, border_path)
+            + (
+                (RUN_CFG.paths.m3c2_settings,)
+                if native_m3c2
+                else (RUN_CFG.paths.m3c2_settings, RUN_CFG.paths.hsv_settings)
+            ),
+            # CloudCompare names its results itself, hence only its log file is declared
+            (
+                (m3c2_path,)
+                if native_m3c2
+                else (m3c2_log_path,)
+                + (
+                    (core_points_path,)
+                    if RUN_CFG.app_settings.core_point_mode not in ["settings", "all"]
+                    else ()
+                )
+            ),
+            compute_m3c2,
+            settings={
+                "m3c2_backend": RUN_CFG.app_settings.m3c2_backend,
+                "m3c2_settings": f"{RUN_CFG.paths.m3c2_settings}",
+                "hsv_settings": (
+                    None if native_m3c2 else f"{RUN_CFG.paths.hsv_settings}"
+                ),
+                "core_point_mode": RUN_CFG.app_settings.core_point_mode,
+                "core_point_spacing": RUN_CFG.app_settings.core_point_spacing,
+                **segment_settings,
+                **ply_settings,
+            },
+        ),
+    ]
+
+    status = "failed"
+    try:
+        run_stages(
+            stages,
+            results_dir / "stages.json",
+            from_stage=RUN_CFG.app_settings.from_stage,
+            until_stage=RUN_CFG.app_settings.until_stage,
+            report=report,
+        )
+        status = "completed"
+    finally:
+        report.write(status)
 
     return 0
 
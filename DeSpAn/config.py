@@ -2,18 +2,30 @@ __all__ = ["RunConfig"]
 
 import os
 import argparse
+from copy import deepcopy
 from dataclasses import dataclass, field
+from functools import lru_cache
 from pathlib import Path
+from typing import Mapping, Sequence
 
 from hydra import compose, initialize_config_module, initialize_config_dir
 from hydra.utils import instantiate
 from omegaconf import OmegaConf
 
+from DeSpAn.filters import PointFilter
+
+PIPELINE_STAGES = ["merge", "boxcut", "bordercut", "m3c2"]
+STAGE_FORMATS = ["ply", "laz"]
+CORE_POINT_MODES = ["settings", "all", "voxel_centroid", "voxel_nearest", "spacing"]
+
 
 class Singleton(type):
     _instances = {}
 
     def __call__(cls, *args, **kwargs):
+        if args or kwargs:
+            # Explicit arguments build independent instances (e.g. the jobs of a batch)
+            return super().__call__(*args, **kwargs)
         if cls not in cls._instances:
             cls._instances[cls] = super().__call__(*args, **kwargs)
         return cls._instances[cls]
@@ -24,6 +36,11 @@ class _ProjectMeta:
     name: str
     epoch1_name: str
     epoch2_name: str
+    epoch_names: list[str] = None
+
+    def __post_init__(self):
+        if self.epoch_names is not None:
+            object.__setattr__(self, "epoch_names", [f"{n}" for n in self.epoch_names])
 
 
 @dataclass(frozen=True)
@@ -32,6 +49,31 @@ class _AppSettings:
     filter_ground_points: bool
     greedy_directory_search: bool
     greedy_file_types: list[str]
+    nb_workers: int = 1
+    preallocate_merge: bool = True
+    laz_chunk_size: int = 5_000_000
+    streaming_merge: bool = False
+    prune_tiles: bool = True
+    m3c2_backend: str = "cloudcompare"
+    border_mode: str = "alphashape"
+    border_cell_size: float = 1.0
+    segment_length: float = None
+    segment_overlap: float = 10.0
+    epoch_cache_size_gb: float = 50.0
+    ply_xyz_dtype: str = None
+    ply_float_dtype: str = None
+    compact_coordinates: str = None
+    coordinate_scale: float = 0.001
+    from_stage: str = None
+    until_stage: str = None
+    concurrent_epochs: bool = True
+    profile_steps: bool = False
+    core_point_mode: str = "settings"
+    core_point_spacing: float = None
+    point_filters: list[str] = None
+    time_series_memory_gb: float = None
+    stage_formats: dict[str, str] = None
+    normal_scales: list[float] = None
 
     def __post_init__(self):
         object.__setattr__(
@@ -39,6 +81,86 @@ class _AppSettings:
             "greedy_file_types",
             [ft if ft[0] == "." else f".{ft}" for ft in self.greedy_file_types],
         )
+        object.__setattr__(
+            self,
+            "point_filters",
+            [] if self.point_filters is None else [f"{e}" for e in self.point_filters],
+        )
+        for expression in self.point_filters:
+            # Raises a ValueError for invalid expressions
+            PointFilter(expression)
+        stage_formats = {} if self.stage_formats is None else self.stage_formats
+        for stage, stage_format in stage_formats.items():
+            if stage not in PIPELINE_STAGES or stage_format not in STAGE_FORMATS:
+                raise ValueError(
+                    f"Unknown output format '{stage_format}' of stage '{stage}' ({', '.join(STAGE_FORMATS)})"
+                )
+        object.__setattr__(
+            self,
+            "stage_formats",
+            {stage: f"{stage_formats.get(stage, 'ply')}" for stage in PIPELINE_STAGES},
+        )
+        if self.streaming_merge and "laz" in [
+            self.stage_formats["merge"],
+            self.stage_formats["boxcut"],
+        ]:
+            raise ValueError(
+                "The streaming merge writes ply files (stage_formats of merge and boxcut)"
+            )
+        if self.m3c2_backend not in ["cloudcompare", "native"]:
+            raise ValueError(
+                f"Unknown M3C2 backend '{self.m3c2_backend}' (cloudcompare or native)"
+            )
+        if self.border_mode not in ["alphashape", "raster"]:
+            raise ValueError(
+                f"Unknown border mode '{self.border_mode}' (alphashape or raster)"
+            )
+        if self.segment_length is not None and self.segment_length <= 0:
+            raise ValueError(f"Segment length must be positive ({self.segment_length})")
+        for ply_dtype in [self.ply_xyz_dtype, self.ply_float_dtype]:
+            if ply_dtype is not None and ply_dtype not in ["f4", "f8"]:
+                raise ValueError(f"Unknown ply output dtype '{ply_dtype}' (f4 or f8)")
+        for stage in [self.from_stage, self.until_stage]:
+            if stage is not None and stage not in PIPELINE_STAGES:
+                raise ValueError(
+                    f"Unknown stage '{stage}' ({', '.join(PIPELINE_STAGES)})"
+                )
+        if self.compact_coordinates not in [None, "float32", "int32"]:
+            raise ValueError(
+                f"Unknown compact coordinates '{self.compact_coordinates}' (float32 or int32)"
+            )
+        if self.coordinate_scale <= 0:
+            raise ValueError(
+                f"Coordinate scale must be positive ({self.coordinate_scale})"
+            )
+        if self.epoch_cache_size_gb <= 0:
+            raise ValueError(
+                f"Epoch cache size must be positive ({self.epoch_cache_size_gb})"
+            )
+        if self.segment_overlap < 0:
+            raise ValueError(
+                f"Segment overlap must not be negative ({self.segment_overlap})"
+            )
+        if self.core_point_mode not in CORE_POINT_MODES:
+            raise ValueError(
+                f"Unknown core point mode '{self.core_point_mode}' ({', '.join(CORE_POINT_MODES)})"
+            )
+        if self.core_point_spacing is not None and self.core_point_spacing <= 0:
+            raise ValueError(
+                f"Core point spacing must be positive ({self.core_point_spacing})"
+            )
+        if self.normal_scales is not None:
+            object.__setattr__(
+                self, "normal_scales", [float(scale) for scale in self.normal_scales]
+            )
+            if not self.normal_scales or min(self.normal_scales) <= 0:
+                raise ValueError(
+                    f"Normal scales must be positive ({self.normal_scales})"
+                )
+        if self.time_series_memory_gb is not None and self.time_series_memory_gb <= 0:
+            raise ValueError(
+                f"Time series memory must be positive ({self.time_series_memory_gb})"
+            )
 
 
 @dataclass(init=False, frozen=True)
@@ -49,6 +171,9 @@ class _Paths:
     CC_exe: Path = field(compare=False)
     m3c2_settings: Path
     hsv_settings: Path
+    epoch_cache: Path = None
+    memmap_storage: Path = None
+    pcd_epochs: list[Path] = None
 
     def __init__(
         self,
@@ -58,15 +183,37 @@ class _Paths:
         intermediate_results: str,
         m3c2_settings: str,
         hsv_settings: str,
+        epoch_cache: str = None,
+        memmap_storage: str = None,
+        pcd_epochs: list[str] = None,
     ) -> None:
         object.__setattr__(self, "pcd_e1", Path(pcd_e1).absolute())
-        object.__setattr__(self, "pcd_e2", Path(pcd_e2).absolute())
+        # The second epoch is not needed for time series (pcd_epochs)
+        if pcd_e2 is not None:
+            object.__setattr__(self, "pcd_e2", Path(pcd_e2).absolute())
+        else:
+            object.__setattr__(self, "pcd_e2", None)
         object.__setattr__(self, "CC_exe", Path(CC_exe).absolute())
         object.__setattr__(
             self, "intermediate_results", Path(intermediate_results).absolute()
         )
         object.__setattr__(self, "m3c2_settings", Path(m3c2_settings).absolute())
         object.__setattr__(self, "hsv_settings", Path(hsv_settings).absolute())
+        if epoch_cache is not None:
+            object.__setattr__(self, "epoch_cache", Path(epoch_cache).absolute())
+        if memmap_storage is not None:
+            object.__setattr__(self, "memmap_storage", Path(memmap_storage).absolute())
+        if pcd_epochs:
+            object.__setattr__(
+                self, "pcd_epochs", [Path(p).absolute() for p in pcd_epochs]
+            )
+
+
+@lru_cache(maxsize=None)
+def _default_config():
+    # Composed once per process (e.g. for all jobs of a batch worker), the callers modify copies
+    with initialize_config_module(version_base=None, config_module="DeSpAn.conf"):
+        return compose(config_name="default_config")
 
 
 @dataclass(init=False, frozen=True)
@@ -75,7 +222,27 @@ class RunConfig(metaclass=Singleton):
     app_settings: _AppSettings = None
     paths: _Paths = None
 
-    def __init__(self):
+    def __init__(
+        self,
+        argv: Sequence[str] = None,
+        overrides: Mapping | Sequence[str] = None,
+    ):
+        """
+        Composes the configuration of a run from the default configuration, the configuration file, the overrides
+        and the command line arguments (in increasing priority).
+
+        Parameters
+        ----------
+        argv : Sequence[str], optional
+            Command line arguments (without the program name). `None` parses `sys.argv`.
+        overrides : Mapping or Sequence[str], optional
+            Nested settings (e.g. ``{"app_settings": {"nb_workers": 4}}``) or dot-list overrides (e.g.
+            ``["app_settings.nb_workers=4"]``) applied on top of the configuration file.
+
+        Notes
+        -----
+        Without arguments, `RunConfig()` returns the configuration of the process (parsed from `sys.argv` once).
+        """
         parser = argparse.ArgumentParser()
         parser.add_argument(
             "-cf",
@@ -98,6 +265,14 @@ class RunConfig(metaclass=Singleton):
             help="Path of the second epoch's point cloud file (or folder)",
             default=argparse.SUPPRESS,
         )
+        parser.add_argument(
+            "-en",
+            "--epochs",
+            type=str,
+            nargs="+",
+            help="Paths of later epochs (files or folders) to compare with the first epoch as time series",
+            default=argparse.SUPPRESS,
+        )
         parser.add_argument(
             "-r",
             "--results_dir",
@@ -121,11 +296,46 @@ class RunConfig(metaclass=Singleton):
             help="Should point cloud be filtered to only contain ground points (0: false, 1: true)",
             default=argparse.SUPPRESS,
         )
+        parser.add_argument(
+            "-nw",
+            "--nb_workers",
+            type=int,
+            help="Number of worker processes used to load the point cloud files of an epoch",
+            default=argparse.SUPPRESS,
+        )
+        parser.add_argument(
+            "-m3c2",
+            "--m3c2_backend",
+            type=str,
+            choices=["cloudcompare", "native"],
+            help="Compute M3C2 with CloudCompare or the native (multi-threaded) implementation",
+            default=argparse.SUPPRESS,
+        )
+        parser.add_argument(
+            "-ec",
+            "--epoch_cache",
+            type=str,
+            help="Directory to cache the loaded epochs in (reused if the input files and filters did not change)",
+            default=argparse.SUPPRESS,
+        )
+        parser.add_argument(
+            "--from-stage",
+            type=str,
+            choices=PIPELINE_STAGES,
+            help="Run the pipeline from this stage on (the outputs of the previous stages have to exist)",
+            default=argparse.SUPPRESS,
+        )
+        parser.add_argument(
+            "--until-stage",
+            type=str,
+            choices=PIPELINE_STAGES,
+            help="Stop the pipeline after this stage",
+            default=argparse.SUPPRESS,
+        )
         # TODO: Add the additional configuration arguments
-        args = parser.parse_args()
+        args = parser.parse_args(argv)
 
-        with initialize_config_module(version_base=None, config_module="DeSpAn.conf"):
-            default_cfg = compose(config_name="default_config")
+        default_cfg = deepcopy(_default_config())
 
         file_config_path = Path(args.config_file).absolute()
 
@@ -139,8 +349,21 @@ class RunConfig(metaclass=Singleton):
         else:
             run_cfg_dict = default_cfg
 
+        if overrides is not None:
+            run_cfg_dict = OmegaConf.merge(
+                run_cfg_dict,
+                (
+                    OmegaConf.from_dotlist(list(overrides))
+                    if not isinstance(overrides, Mapping)
+                    else OmegaConf.create(dict(overrides))
+                ),
+            )
+
         for k, p in run_cfg_dict.paths.items():
-            if not k == "_target_":
+            if k == "pcd_epochs" and p is not None:
+                root_dir = Path(os.path.dirname(os.path.abspath(__file__)))
+                run_cfg_dict.paths[k] = [f"{(root_dir / e).resolve()}" for e in p]
+            elif not k == "_target_":
                 if p is not None and not Path(p).is_absolute():
                     root_dir = Path(os.path.dirname(os.path.abspath(__file__)))
                     run_cfg_dict.paths[
@@ -152,11 +375,23 @@ class RunConfig(metaclass=Singleton):
                 run_cfg_dict.paths.pcd_e1 = Path(value).absolute()
             if key == "epoch2":
                 run_cfg_dict.paths.pcd_e2 = Path(value).absolute()
+            if key == "epochs":
+                run_cfg_dict.paths.pcd_epochs = [f"{Path(v).absolute()}" for v in value]
             if key == "results_dir":
                 run_cfg_dict.paths.intermediate_results = Path(value).absolute()
             if key == "greedy_dir_search":
                 run_cfg_dict.app_settings.greedy_directory_search = bool(value)
             if key == "filter_ground_points":
                 run_cfg_dict.app_settings.filter_ground_points = bool(value)
+            if key == "nb_workers":
+                run_cfg_dict.app_settings.nb_workers = value
+            if key == "m3c2_backend":
+                run_cfg_dict.app_settings.m3c2_backend = value
+            if key == "from_stage":
+                run_cfg_dict.app_settings.from_stage = value
+            if key == "until_stage":
+                run_cfg_dict.app_settings.until_stage = value
+            if key == "epoch_cache":
+                run_cfg_dict.paths.epoch_cache = Path(value).absolute()
         for key, value in run_cfg_dict.items():
             object.__setattr__(self, key, instantiate(value))
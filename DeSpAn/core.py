@@ -1,20 +1,36 @@
+from collections import deque
+from concurrent.futures import Executor, ProcessPoolExecutor
+import multiprocessing
 from pathlib import Path
-from typing import Any, Callable, Iterable, Tuple
+from typing import Callable, Iterable, Iterator, Sequence
 
 import alphashape
 import numpy as np
-from shapely.geometry import Polygon
+from scipy import ndimage
+import shapely
+from shapely.geometry import MultiPolygon, Polygon
 
-from DeSpAn.geometry import PointCloudData, merge_pcd
-from DeSpAn.data_io import find_pcd_in_directory, load_laz, load_ply
+from DeSpAn.cache import epoch_cache_key, load_cached_pcd, store_cached_pcd
+from DeSpAn.filters import FilterFunction
+from DeSpAn.geometry import (MEMMAP_CHUNK_SIZE, PointCloudData, color_to_uint8, merge_pcd, merge_pcd_preallocated,
+                             tile_id_dtype)
+from DeSpAn.data_io import (PlyWriter, find_pcd_in_directory, iter_laz_chunks, load_laz, load_ply, ply_dtype,
+                            read_pcd_header, read_tile_headers)
 
 
-def get_point_cloud_data(data_path: Path,
+def get_point_cloud_data(data_path: Path | list[Path],
                          pcd_file_types: list[str] = None,
                          greedy: bool = False,
                          scalar_fields: list[str] = None,
-                         filter_functions: Iterable[Tuple[str, Callable[[np.ndarray],
-                                                                    np.ndarray[Any, np.dtype[bool]]]]] = None
+                         filter_functions: Iterable[FilterFunction] = None,
+                         nb_workers: int = 1,
+                         preallocate: bool = False,
+                         chunk_size: int = None,
+                         cache_dir: Path = None,
+                         max_cache_size: int = None,
+                         storage_dir: Path = None,
+                         compact_coordinates: str = None,
+                         coordinate_scale: float = 0.001
                          ) -> PointCloudData:
     """
     Load *point cloud data*  from either a file or directory (possible inclusion of subdirectories). In case of a
@@ -24,81 +40,371 @@ def get_point_cloud_data(data_path: Path,
 
     Parameters
     ----------
-    data_path : pathlib.Path
+    data_path : pathlib.Path or list[pathlib.Path]
         Path to point cloud file or directory. In case of directory all files of type `pcd_file_types` will be loaded
-        and merged.
+        and merged. A list of files (e.g. from `plan_tiles`) is loaded and merged like a directory.
     pcd_file_types : list[str], optional
         List of file type endings to load when `data_path` points to directory. In case of
     greedy : bool, default=False
         Additional search in subdirectories.
     scalar_fields : list[str], optional
         Scalar fields to keep.
-    filter_functions : Iterable[tuple[str, func]]
-        List of filter functions to run on the data. Each filter function is represented by the scalar field string and
-        a function which takes one value and returns a boolean.
+    filter_functions : Iterable[DeSpAn.filters.PointFilter or tuple[str, func]]
+        List of filters to run on the data while loading (see `DeSpAn.data_io.load_laz`). Each filter is either an
+        expression or represented by the scalar field string and a function which takes one value and returns a
+        boolean. For `nb_workers` > 1 the functions have to be picklable (e.g. no lambdas).
+    nb_workers : int, default=1
+        Number of worker processes used to load the files of a directory. With `nb_workers` > 1 the files are loaded
+        and filtered in a process pool and merged in the same order as in the serial case.
+    preallocate : bool, default=False
+        Read the point counts and dtypes from the file headers and allocate the merged arrays once (see
+        `DeSpAn.geometry.merge_pcd_preallocated`). Each file is copied into its slice right after loading, which avoids
+        holding all files and the merged copy in memory at the same time.
+    chunk_size : int, optional
+        Stream *las/laz* files in chunks of `chunk_size` points and apply the filter functions to each chunk (see
+        `DeSpAn.data_io.iter_laz_chunks`). `None` reads each file at once.
+    cache_dir : pathlib.Path, optional
+        Reuse the loaded point cloud of a previous run if the files, scalar fields and filter functions did not change
+        (see `DeSpAn.cache.epoch_cache_key`), otherwise store it after loading.
+    max_cache_size : int, optional
+        Maximum size of `cache_dir` in bytes, the least recently used point clouds are evicted.
+    storage_dir : pathlib.Path, optional
+        Merge the files of a directory into memmaps in `storage_dir` (always preallocated) for point clouds larger than
+        the memory (see `DeSpAn.geometry.PointCloudData`). Cached point clouds are memory-mapped from `cache_dir`.
+    compact_coordinates : str, optional
+        Store the coordinates relative to the center of all files (from the headers) as *float32* or as *int32* in
+        units of `coordinate_scale` (see `DeSpAn.geometry.PointCloudData.compact`). The coordinates of *las/laz* files
+        are converted per chunk, i.e. the float64 coordinates of a whole file are never held in memory.
+    coordinate_scale : float, default=0.001
+        Scale of the *int32* coordinates.
 
     Returns
     -------
     pcd : DeSpAn.geometry.PointCloudData
 
     """
-    if data_path.is_dir() and pcd_file_types is not None:
-        pcd_path_list = find_pcd_in_directory(data_path, pcd_file_types, greedy)
-
-        pcds = tuple(get_point_cloud_data(pcd_path, pcd_file_types, greedy, scalar_fields, filter_functions)
-                     for pcd_path in pcd_path_list)
-        return merge_pcd(pcds)
+    if isinstance(data_path, list) or (data_path.is_dir() and pcd_file_types is not None):
+        pcd_path_list = (data_path if isinstance(data_path, list) else
+                         find_pcd_in_directory(data_path, pcd_file_types, greedy))
     elif data_path.is_file():
-        if data_path.suffix in [".laz", ".las"]:
-            pcd = load_laz(data_path, scalar_fields=scalar_fields)
-        elif data_path.suffix == ".ply":
-            pcd = load_ply(data_path, scalar_fields=scalar_fields)
-        # elif data_path.suffix == ".npy":
-        #     return np.load(data_path)
+        pcd_path_list = None
+    else:
+        raise FileNotFoundError
+
+    origin, scale = None, None
+    if compact_coordinates is not None:
+        origin, scale = _common_frame(pcd_path_list if pcd_path_list is not None else [data_path],
+                                      compact_coordinates, coordinate_scale)
+
+    cache_key = None
+    if cache_dir is not None:
+        cache_key = epoch_cache_key(pcd_path_list if pcd_path_list is not None else [data_path], scalar_fields,
+                                    filter_functions, merged=pcd_path_list is not None,
+                                    coordinates=None if origin is None else [compact_coordinates, coordinate_scale])
+        pcd = load_cached_pcd(cache_dir, cache_key, storage_dir=storage_dir)
+        if pcd is not None:
+            print(f"{pcd.xyz.shape[0]:,d} points loaded from cache '{cache_key[:12]}'.")
+            return pcd
+
+    if pcd_path_list is None:
+        pcd = _load_pcd_file(data_path, scalar_fields, filter_functions, chunk_size, origin, scale)
+    else:
+        load_args = [(pcd_path, scalar_fields, filter_functions, chunk_size, origin, scale)
+                     for pcd_path in pcd_path_list]
+
+        if nb_workers > 1 and len(pcd_path_list) > 1:
+            # "spawn" avoids forking a parent whose decompression threads (lazrs) are already running
+            with ProcessPoolExecutor(max_workers=min(nb_workers, len(pcd_path_list)),
+                                     mp_context=multiprocessing.get_context("spawn")) as executor:
+                # The results are yielded in submission order, hence the tile ids of the merge stay the same
+                pcds = ordered_map(executor, _load_pcd_file, load_args, max_pending=2 * nb_workers)
+                pcd = _merge_loaded_pcds(pcds, pcd_path_list, scalar_fields, preallocate, storage_dir)
         else:
-            raise NotImplementedError
-        if filter_functions is not None:
-            for f in filter_functions:
-                pcd.filter(*f)
+            pcds = (_load_pcd_file(*args) for args in load_args)
+            pcd = _merge_loaded_pcds(pcds, pcd_path_list, scalar_fields, preallocate, storage_dir)
+
+    if cache_key is not None:
+        store_cached_pcd(cache_dir, cache_key, pcd, max_size=max_cache_size)
+    return pcd
 
-        print(f"{pcd.xyz.shape[0]:,d}")
-        return pcd
+
+def _load_pcd_file(pcd_path: Path,
+                   scalar_fields: list[str] = None,
+                   filter_functions: Iterable[FilterFunction] = None,
+                   chunk_size: int = None,
+                   origin: np.ndarray = None,
+                   scale: np.ndarray = None
+                   ) -> PointCloudData:
+    """
+    Load and filter a single point cloud file (module level to be usable in worker processes).
+
+    Parameters
+    ----------
+    pcd_path : pathlib.Path
+    scalar_fields : list[str], optional
+    filter_functions : Iterable[DeSpAn.filters.PointFilter or tuple[str, func]], optional
+    chunk_size : int, optional
+    origin : np.ndarray, optional
+        Local frame of compact coordinates (see `DeSpAn.geometry.PointCloudData.compact`).
+    scale : np.ndarray, optional
+
+    Returns
+    -------
+    pcd : DeSpAn.geometry.PointCloudData
+    """
+    # The filters are pushed down into the readers
+    if pcd_path.suffix in [".laz", ".las"]:
+        pcd = load_laz(pcd_path, scalar_fields=scalar_fields, filter_functions=filter_functions,
+                       chunk_size=chunk_size, origin=origin, scale=scale)
+    elif pcd_path.suffix == ".ply":
+        pcd = load_ply(pcd_path, scalar_fields=scalar_fields, filter_functions=filter_functions, origin=origin,
+                       scale=scale)
+    # elif pcd_path.suffix == ".npy":
+    #     return np.load(pcd_path)
     else:
-        raise FileNotFoundError
+        raise NotImplementedError
+
+    print(f"{pcd.xyz.shape[0]:,d}")
+    return pcd
+
+
+def _common_frame(pcd_path_list: list[Path], compact_coordinates: str,
+                  coordinate_scale: float) -> tuple[np.ndarray, np.ndarray | None]:
+    """
+    Local frame (origin and scale) of compact coordinates centered on the bounding box of all files.
+    """
+    if compact_coordinates not in ["float32", "int32"]:
+        raise ValueError(f"Unknown compact coordinates '{compact_coordinates}' (float32 or int32)")
+    headers = read_tile_headers(pcd_path_list)
+    minimum_corner = np.amin([header.minimum_corner for header in headers], axis=0)
+    maximum_corner = np.amax([header.maximum_corner for header in headers], axis=0)
+    origin = np.round((minimum_corner + maximum_corner) / 2)
+    return origin, None if compact_coordinates == "float32" else np.full((3,), coordinate_scale, dtype=float)
+
+
+def ordered_map(executor: Executor, func: Callable, args_list: Iterable[tuple], max_pending: int) -> Iterator:
+    """
+    Like `Executor.map`, but limits the number of submitted (and hence buffered) results to `max_pending`.
+    """
+    pending = deque()
+    for args in args_list:
+        pending.append(executor.submit(func, *args))
+        if len(pending) >= max_pending:
+            yield pending.popleft().result()
+    while pending:
+        yield pending.popleft().result()
+
+
+def _merge_loaded_pcds(pcds: Iterable[PointCloudData], pcd_path_list: list[Path], scalar_fields: list[str] = None,
+                       preallocate: bool = False, storage_dir: Path = None) -> PointCloudData:
+    """
+    Merges the loaded point clouds of `pcd_path_list`, either with `merge_pcd` or preallocated based on the headers
+    (always for memmaps in `storage_dir`).
+    """
+    if not preallocate and storage_dir is None:
+        return merge_pcd(tuple(pcds))
+
+    nb_points, color, normals, merged_scalar_fields = _merged_layout(pcd_path_list, scalar_fields)
+    return merge_pcd_preallocated(pcds, nb_points=nb_points, nb_pcds=len(pcd_path_list), color=color,
+                                  normals=normals, scalar_fields=merged_scalar_fields, storage_dir=storage_dir)
+
+
+def _merged_layout(pcd_path_list: list[Path],
+                   scalar_fields: list[str] = None) -> tuple[int, bool, bool, dict[str, np.dtype]]:
+    """
+    Upper bound of the number of points, colors, normals and scalar fields (with their common dtypes) of the merged
+    files, based on the headers (see `DeSpAn.geometry.merge_pcd_preallocated`).
+    """
+    headers = [read_pcd_header(pcd_path, scalar_fields=scalar_fields) for pcd_path in pcd_path_list]
+    common_scalar_fields = set.intersection(*(set(header.scalar_fields) for header in headers))
+    merged_scalar_fields = {sf: np.result_type(*(header.scalar_fields[sf] for header in headers))
+                            for sf in sorted(common_scalar_fields)}
+    return (sum(header.point_count for header in headers), all(header.has_color for header in headers),
+            all(header.has_normals for header in headers), merged_scalar_fields)
+
+
+def stream_merge(pcd_path_list: list[Path], pcd_path: Path, scalar_fields: list[str] = None,
+                 filter_functions: Iterable[FilterFunction] = None, chunk_size: int = MEMMAP_CHUNK_SIZE,
+                 minimum_corner: tuple[float, float, float] = None, maximum_corner: tuple[float, float, float] = None,
+                 xyz_dtype: str = None, float_dtype: str = None) -> int:
+    """
+    Merges point cloud files into a *ply* file without holding the merged point cloud in memory.
+
+    The layout of the merged file is taken from the headers of the files (as in `get_point_cloud_data` with
+    `preallocate`) and the points are appended file by file (*las/laz* files chunk by chunk, see
+    `DeSpAn.data_io.iter_laz_chunks`) with a *point_cloud_merge* scalar field, hence the memory does not depend on the
+    number of files. The vertex count of the header is corrected at the end (see `DeSpAn.data_io.PlyWriter`).
+
+    Parameters
+    ----------
+    pcd_path_list : list[pathlib.Path]
+        Files to merge (in the order of the tile ids).
+    pcd_path : pathlib.Path
+        Merged *ply* file.
+    scalar_fields : list[str], optional
+    filter_functions : Iterable[DeSpAn.filters.PointFilter or tuple[str, func]], optional
+        See `get_point_cloud_data`.
+    chunk_size : int, default=MEMMAP_CHUNK_SIZE
+        Number of points to decompress and write at once.
+    minimum_corner : tuple[float, float, float], optional
+    maximum_corner : tuple[float, float, float], optional
+        Only write the points within this box (see `DeSpAn.geometry.PointCloudData.box_cut`).
+    xyz_dtype : str, optional
+    float_dtype : str, optional
+        Output dtypes as in `DeSpAn.data_io.save_ply`.
+
+    Returns
+    -------
+    nb_points : int
+        Number of written points.
+    """
+    nb_points, color, normals, merged_scalar_fields = _merged_layout(pcd_path_list, scalar_fields)
+    merged_scalar_fields["point_cloud_merge"] = tile_id_dtype(len(pcd_path_list))
+    layout = PointCloudData.empty(0, color=color, normals=normals, scalar_fields=merged_scalar_fields)
+
+    with PlyWriter(pcd_path, ply_dtype(layout, xyz_dtype=xyz_dtype, float_dtype=float_dtype), nb_points,
+                   block_size=chunk_size) as writer:
+        for i, tile_path in enumerate(pcd_path_list, start=1):
+            if tile_path.suffix in [".laz", ".las"]:
+                chunks = iter_laz_chunks(tile_path, chunk_size, scalar_fields=scalar_fields,
+                                         filter_functions=filter_functions)
+            else:
+                chunks = _load_pcd_file(tile_path, scalar_fields, filter_functions).chunks(chunk_size)
+
+            nb_tile_points = 0
+            for chunk in chunks:
+                if minimum_corner is not None:
+                    chunk.box_cut(minimum_corner, maximum_corner)
+                chunk = PointCloudData(chunk.xyz, color=None if chunk.color is None else color_to_uint8(chunk.color),
+                                       normals=chunk.normals,
+                                       scalar_fields={**chunk.scalar_fields,
+                                                      "point_cloud_merge": np.full((chunk.nb_points,), i)})
+                writer.write(chunk)
+                nb_tile_points += chunk.nb_points
+            print(f"{nb_tile_points:,d} points of '{tile_path.name}' written to '{pcd_path.name}'.")
+    return writer.nb_points
 
 
 # def cut_to_common_outline_border(pcds: Iterable[PointCloudData]) -> None:
 #     cut_to_common_box
 
 
+def plan_tiles(pcd_path_lists: Sequence[list[Path]], margin: float = 0.0, bounds_cache_path: Path = None
+               ) -> tuple[list[list[Path]], tuple[np.ndarray, np.ndarray] | None]:
+    """
+    Removes the tiles that cannot contribute to the common bounding box of all epochs before loading them.
+
+    The common box is determined like in `cut_to_common_box`, but from the bounding boxes in the file headers (or the
+    cached bounds, see `DeSpAn.data_io.read_tile_headers`) of all tiles. The box has to be passed on to the cut (see
+    `cut_to_common_box`): the bounds of the retained tiles can be smaller than those of all tiles (a skipped tile can
+    extend an epoch on another axis), hence a box recomputed from the loaded points could differ from the box of an
+    unpruned run. With the box of all headers the retained points are the same with and without pruning.
+
+    Parameters
+    ----------
+    pcd_path_lists : Sequence[list[pathlib.Path]]
+        Tiles of each epoch.
+    margin : float, default=0.0
+        Additional margin as in `cut_to_common_box`.
+    bounds_cache_path : pathlib.Path, optional
+        Cache file for the bounds of files without bounds in their header (*ply*).
+
+    Returns
+    -------
+    pcd_path_lists : list[list[pathlib.Path]]
+        Tiles of each epoch that intersect the common box.
+    box : tuple[np.ndarray, np.ndarray] or None
+        Minimum and maximum corner of the common box (infinite on axes without extent), `None` if the epochs do not
+        overlap.
+    """
+    epoch_headers = [read_tile_headers(pcd_path_list, bounds_cache_path=bounds_cache_path)
+                     for pcd_path_list in pcd_path_lists]
+
+    minimum_corner = np.ones((3,), dtype=float) * -np.inf
+    maximum_corner = np.ones((3,), dtype=float) * np.inf
+
+    for headers in epoch_headers:
+        minimum_corner = np.maximum(minimum_corner, np.amin([header.minimum_corner for header in headers], axis=0))
+        maximum_corner = np.minimum(maximum_corner, np.amax([header.maximum_corner for header in headers], axis=0))
+
+    if np.any(minimum_corner > maximum_corner):
+        print("The epochs do not overlap, no tiles are skipped.")
+        return [list(pcd_path_list) for pcd_path_list in pcd_path_lists], None
+
+    if margin:
+        span = maximum_corner - minimum_corner
+        minimum_corner = minimum_corner - margin * span
+        maximum_corner = maximum_corner + margin * span
+
+    # Same as `PointCloudData.box_cut`: axes without extent are ignored
+    span = maximum_corner - minimum_corner
+    minimum_corner[span == 0] = -np.inf
+    maximum_corner[span == 0] = np.inf
+
+    planned_path_lists = []
+    for i, headers in enumerate(epoch_headers, start=1):
+        kept_headers = [header for header in headers
+                        if np.all(header.maximum_corner >= minimum_corner) and
+                        np.all(header.minimum_corner <= maximum_corner)]
+        nb_skipped_tiles = len(headers) - len(kept_headers)
+        nb_skipped_points = (sum(header.point_count for header in headers) -
+                             sum(header.point_count for header in kept_headers))
+        print(f"Epoch {i:d}: skipped {nb_skipped_tiles:,d} of {len(headers):,d} tile(s) "
+              f"({nb_skipped_points:,d} points) outside of the common box.")
+        planned_path_lists.append([header.pcd_path for header in kept_headers])
+
+    return planned_path_lists, (minimum_corner, maximum_corner)
+
+
 def border_extraction(pcd: PointCloudData, alpha_value: float = 20.0, nb_points: int = 10000,
-                      show_plot: bool = False) -> np.ndarray:
-    # xrange = (np.floor(pcd[:, 0].min()), np.ceil(pcd[:, 0].max()) + 1)
-    # xedges = np.arange(*xrange, step=raster_size)
-    #
-    # yrange = (np.floor(pcd[:, 1].min()), np.ceil(pcd[:, 1].max()) + 1)
-    # yedges = np.arange(*yrange, step=raster_size)
-    #
-    # H, xedges, yedges = np.histogram2d(pcd[:, 0], pcd[:, 1], bins=(xedges, yedges))
-    #
-    # H[H > 0] = 1
-    #
-    # # Get x-gradient in "sx"
-    # sx = ndimage.sobel(H, axis=0, mode='constant')
-    # # Get y-gradient in "sy"
-    # sy = ndimage.sobel(H, axis=1, mode='constant')
-    # # Get square root of sum of squares
-    # sobel = np.hypot(sx, sy)
-    #
-    # if show_plot:
-    #     sobel_binary = sobel.copy()
-    #     sobel_binary[sobel_binary > 0] = 1
-    #     plt.figure()
-    #     plt.imshow(sobel_binary.T, origin="lower", extent=[xedges[0], xedges[-1], yedges[0], yedges[-1]], cmap=plt.cm.gray, aspect="equal")
-    #     plt.show()
-    #
-    # x_i, y_i = np.nonzero(sobel)
-    # borderish_points = np.array([xedges[x_i], yedges[y_i]]).T
+                      show_plot: bool = False, mode: str = "alphashape", cell_size: float = 1.0,
+                      closing_iterations: int = 1, simplify_tolerance: float = None,
+                      executor: Executor = None) -> Polygon | MultiPolygon:
+    """
+    Extracts the outline of the point cloud in the *xy*-plane.
+
+    Parameters
+    ----------
+    pcd : DeSpAn.geometry.PointCloudData
+    alpha_value : float, default=20.0
+        Alpha value of the alpha shape (on normalised coordinates), only used for `mode` *alphashape*.
+    nb_points : int, default=10000
+        Number of randomly selected points for the alpha shape, only used for `mode` *alphashape*.
+    show_plot : bool, default=False
+    mode : str, default="alphashape"
+        *alphashape*: alpha shape of a random subsample. *raster*: outline of the occupancy raster of all points
+        (deterministic and linear in the number of points, see `raster_border`).
+    cell_size : float, default=1.0
+        Cell size of the occupancy raster, only used for `mode` *raster*.
+    closing_iterations : int, default=1
+        Iterations of the morphological closing of the occupancy raster, only used for `mode` *raster*.
+    simplify_tolerance : float, optional
+        Tolerance to simplify the raster outline (defaults to `cell_size`), only used for `mode` *raster*.
+    executor : concurrent.futures.Executor, optional
+        Computes the alpha shape (e.g. in a process pool, only the subsample is transferred), only used for `mode`
+        *alphashape*.
+
+    Returns
+    -------
+    border : shapely.geometry.Polygon or shapely.geometry.MultiPolygon
+
+    Raises
+    ------
+    ValueError
+        If the mode is neither *alphashape* nor *raster*.
+    """
+    if mode == "raster":
+        if pcd.scale is not None and pcd.scale[0] != pcd.scale[1]:
+            # Square cells require the same scale in x and y
+            return raster_border(pcd.coordinates()[:, 0:2], cell_size, closing_iterations=closing_iterations,
+                                 simplify_tolerance=simplify_tolerance)
+        # Rasterized in the local frame of compact point clouds
+        unit = 1.0 if pcd.scale is None else pcd.scale[0]
+        border = raster_border(pcd.xyz[:, 0:2], cell_size / unit, closing_iterations=closing_iterations,
+                               simplify_tolerance=None if simplify_tolerance is None else simplify_tolerance / unit)
+        return border if pcd.origin is None else shapely.transform(border, pcd.to_world)
+    elif mode != "alphashape":
+        raise ValueError(f"Unknown border mode '{mode}' (alphashape or raster)")
 
     borderish_points = pcd.xyz[:, 0:2]
 
@@ -107,16 +413,79 @@ def border_extraction(pcd: PointCloudData, alpha_value: float = 20.0, nb_points:
     bp_norm = (borderish_points - bp_mean) / bp_scale
     bp_norm_ds = bp_norm[np.random.permutation(bp_norm.shape[0])[:nb_points], :]
 
-    als200 = alphashape.alphashape(bp_norm_ds, alpha=alpha_value)
+    if executor is None:
+        als200 = alphashape.alphashape(bp_norm_ds, alpha=alpha_value)
+    else:
+        als200 = executor.submit(alphashape.alphashape, bp_norm_ds, alpha_value).result()
 
-    if isinstance(als200, Polygon):
-        return np.array(als200.exterior.xy).T * bp_scale + bp_mean
-        # return als200
+    if isinstance(als200, (Polygon, MultiPolygon)):
+        return shapely.transform(als200, lambda coords: pcd.to_world(coords * bp_scale + bp_mean))
     else:
         raise NotImplementedError
 
 
-def cut_to_common_box(pcds: Iterable[PointCloudData], margin: float = 0.0) -> None:
+def raster_border(xy: np.ndarray, cell_size: float, closing_iterations: int = 1,
+                  simplify_tolerance: float = None) -> Polygon | MultiPolygon:
+    """
+    Outline of the occupied cells of a raster in the *xy*-plane.
+
+    All points are binned into an occupancy raster, gaps are closed morphologically and holes are filled. The
+    boundary edges between occupied and empty cells are polygonized and the resulting outline is simplified.
+
+    Parameters
+    ----------
+    xy : np.ndarray
+        nx2 array of coordinates.
+    cell_size : float
+    closing_iterations : int, default=1
+    simplify_tolerance : float, optional
+        Defaults to `cell_size`.
+
+    Returns
+    -------
+    border : shapely.geometry.Polygon or shapely.geometry.MultiPolygon
+    """
+    simplify_tolerance = cell_size if simplify_tolerance is None else simplify_tolerance
+
+    # Raster with an empty margin, which is large enough for the closing to not touch the raster border
+    margin = closing_iterations + 1
+    origin = np.floor(np.amin(xy, axis=0) / cell_size) * cell_size - margin * cell_size
+    shape = tuple(((np.amax(xy, axis=0) - origin) // cell_size).astype(np.intp) + margin + 1)
+
+    occupancy = np.zeros(shape, dtype=bool)
+    # Binned in chunks, which keeps the cell indices of (memory-mapped) point clouds small
+    for start in range(0, xy.shape[0], MEMMAP_CHUNK_SIZE):
+        cells = ((xy[start:start + MEMMAP_CHUNK_SIZE] - origin) // cell_size).astype(np.intp)
+        occupancy[cells[:, 0], cells[:, 1]] = True
+    del cells
+
+    if closing_iterations:
+        occupancy = ndimage.binary_closing(occupancy, structure=np.ones((3, 3), dtype=bool),
+                                           iterations=closing_iterations)
+    occupancy = ndimage.binary_fill_holes(occupancy)
+
+    # Unit boundary edges (in cell coordinates): between cells (i - 1, j) and (i, j) the edge (i, j) -> (i, j + 1)
+    # and between cells (i, j - 1) and (i, j) the edge (i, j) -> (i + 1, j)
+    i, j = np.nonzero(occupancy[1:, :] != occupancy[:-1, :])
+    x_edges = np.stack((np.stack((i + 1, j), axis=1), np.stack((i + 1, j + 1), axis=1)), axis=1)
+    i, j = np.nonzero(occupancy[:, 1:] != occupancy[:, :-1])
+    y_edges = np.stack((np.stack((i, j + 1), axis=1), np.stack((i + 1, j + 1), axis=1)), axis=1)
+    edges = np.concatenate((x_edges, y_edges)) * cell_size + origin
+
+    faces = shapely.get_parts(shapely.polygonize(shapely.linestrings(edges)))
+    # Faces of enclosed empty regions are dropped
+    face_points = shapely.get_coordinates(shapely.point_on_surface(faces))
+    face_cells = ((face_points - origin) // cell_size).astype(np.intp)
+    faces = faces[occupancy[face_cells[:, 0], face_cells[:, 1]]]
+
+    border = shapely.unary_union(faces).simplify(simplify_tolerance)
+    if isinstance(border, (Polygon, MultiPolygon)):
+        return border
+    return MultiPolygon([part for part in shapely.get_parts(border) if isinstance(part, Polygon)])
+
+
+def cut_to_common_box(pcds: Iterable[PointCloudData], margin: float = 0.0,
+                      box: tuple[np.ndarray, np.ndarray] = None) -> None:
     """
     Determines the minimum common bounding box and reduces all point clouds to the points within.
 
@@ -125,13 +494,22 @@ def cut_to_common_box(pcds: Iterable[PointCloudData], margin: float = 0.0) -> No
     pcds : Iterable[DeSpAn.geometry.PointCloudData]
     margin : float, default=0.0
         Additional margin to extend the bounding box (Factor by which the diagonal gets expanded).
+    box : tuple[np.ndarray, np.ndarray], optional
+        Common box of all tiles (see `plan_tiles`, including its margin), used instead of the box of the point clouds,
+        e.g. if they were loaded from pruned tiles.
     """
+    if box is not None:
+        for pcd in pcds:
+            pcd.box_cut(tuple(box[0]), tuple(box[1]))
+        return
+
     minimum_corner = np.ones((3,), dtype=float) * -np.inf
     maximum_corner = np.ones((3,), dtype=float) * np.inf
 
     for pcd in pcds:
-        minimum_corner = np.maximum(minimum_corner, np.amin(pcd.xyz, axis=0))
-        maximum_corner = np.minimum(maximum_corner, np.amax(pcd.xyz, axis=0))
+        pcd_minimum_corner, pcd_maximum_corner = pcd.bounds()
+        minimum_corner = np.maximum(minimum_corner, pcd_minimum_corner)
+        maximum_corner = np.minimum(maximum_corner, pcd_maximum_corner)
 
     if margin:
         span = maximum_corner - minimum_corner
@@ -1,15 +1,63 @@
 ## TODO: Rework to use yield instead of generating a list and iterating over it
 
+from dataclasses import dataclass, field, replace
 from datetime import datetime
 from itertools import compress
+import json
 from pathlib import Path
-from typing import Any, Callable
+from typing import BinaryIO, Iterable, Iterator, Tuple
 
 import numpy as np
+from numpy.lib.recfunctions import structured_to_unstructured
 import laspy
-from plyfile import PlyElement, PlyData
+from plyfile import PlyData
 
-from DeSpAn.geometry import PointCloudData, merge_pcd
+from DeSpAn.filters import FilterFunction, filter_dimensions, filter_mask
+from DeSpAn.geometry import (INT32_LIMIT, MEMMAP_CHUNK_SIZE, PointCloudData, color_to_uint8, coordinates_in_frame,
+                             merge_pcd, merge_pcd_preallocated, points_in_box)
+
+
+PLY_DTYPES = {"char": "i1", "int8": "i1", "uchar": "u1", "uint8": "u1", "short": "i2", "int16": "i2",
+              "ushort": "u2", "uint16": "u2", "int": "i4", "int32": "i4", "uint": "u4", "uint32": "u4",
+              "float": "f4", "float32": "f4", "double": "f8", "float64": "f8"}
+PLY_TYPE_NAMES = {"i1": "char", "u1": "uchar", "i2": "short", "u2": "ushort", "i4": "int", "u4": "uint", "f4": "float",
+                  "f8": "double"}
+LAS_FLAG_FIELDS = ["scan_direction_flag", "edge_of_flight_line", "synthetic", "key_point", "withheld", "overlap"]
+# The multithreaded lazrs backend is preferred, laspy falls back to the next available one
+LAZ_BACKENDS = (laspy.LazBackend.LazrsParallel, laspy.LazBackend.Lazrs, laspy.LazBackend.Laszip)
+# VLR with the scalar fields of files written by `save_laz`
+SCALAR_FIELDS_VLR = ("DeSpAn", 1)
+
+
+@dataclass(frozen=True)
+class PointCloudHeader:
+    """
+    Information about a point cloud file that is available without reading the points.
+
+    Attributes
+    ----------
+    pcd_path : pathlib.Path
+    point_count : int
+        Number of points in the file.
+    has_color : bool
+        Colors are available (and will be loaded with `retain_colors`).
+    has_normals : bool
+        Normals are available (and will be loaded with `retain_normals`).
+    scalar_fields : dict[str, np.dtype]
+        Scalar fields (and their dtypes) that the corresponding loader will return.
+    minimum_corner : np.ndarray, optional
+        Minimum corner of the bounding box (if stored in the header).
+    maximum_corner : np.ndarray, optional
+        Maximum corner of the bounding box (if stored in the header).
+    """
+
+    pcd_path: Path
+    point_count: int
+    has_color: bool = False
+    has_normals: bool = False
+    scalar_fields: dict[str, np.dtype] = field(default_factory=dict)
+    minimum_corner: np.ndarray = None
+    maximum_corner: np.ndarray = None
 
 
 def find_pcd_in_directory(directory_path, pcd_file_types: list[str], greedy: bool = True) -> list[Path]:
@@ -22,71 +70,517 @@ def find_pcd_in_directory(directory_path, pcd_file_types: list[str], greedy: boo
     return file_list
 
 
-def save_ply(pcd_path: Path, pcd: PointCloudData, retain_colors: bool = True, retain_normals: bool = True,
-             scalar_fields: list[str] = None) -> None:
+def read_pcd_header(pcd_path: Path, scalar_fields: list[str] = None) -> PointCloudHeader:
     """
+    Reads the header of a *las/laz* or *ply* file.
 
     Parameters
     ----------
-    pcd_path
-    pcd
-    retain_colors
-    retain_normals
-    scalar_fields
+    pcd_path : pathlib.Path
+    scalar_fields : list[str], optional
+        Scalar fields to keep (as passed to `load_laz`/`load_ply`). `None` reports all available scalar fields.
+
+    Returns
+    -------
+    header : DeSpAn.data_io.PointCloudHeader
+    """
+    if pcd_path.suffix.lower() in [".laz", ".las"]:
+        with laspy.open(pcd_path) as reader:
+            las_header = reader.header
+        dimensions = {dim.name: dim for dim in las_header.point_format.dimensions}
+        has_normals = len(set(dimensions) & {"nx", "ny", "nz"}) == 3
+
+        scalar_fields = _las_scalar_fields(las_header, scalar_fields)
+        common_scalar_fields = dimensions.keys() if scalar_fields is None else set(scalar_fields) & set(dimensions)
+        header_scalar_fields = dict()
+        for sf in common_scalar_fields:
+            if sf.lower() not in ["x", "y", "z", "red", "green", "blue"] + (["nx", "ny", "nz"] if has_normals else []):
+                if sf in LAS_FLAG_FIELDS:
+                    header_scalar_fields[sf] = np.dtype(bool)
+                elif dimensions[sf].dtype is None:
+                    header_scalar_fields[sf] = np.min_scalar_type(2 ** dimensions[sf].num_bits - 1)
+                else:
+                    header_scalar_fields[sf] = np.dtype(dimensions[sf].dtype)
+
+        return PointCloudHeader(pcd_path, las_header.point_count,
+                                has_color=len(set(dimensions) & {"red", "green", "blue"}) == 3,
+                                has_normals=has_normals,
+                                scalar_fields=header_scalar_fields,
+                                minimum_corner=np.array(las_header.mins, dtype=float),
+                                maximum_corner=np.array(las_header.maxs, dtype=float))
+    elif pcd_path.suffix.lower() == ".ply":
+        with open(pcd_path, "rb") as f:
+            _, point_count, properties, _ = _read_ply_header(f)
+        ply_scalar_fields = list(properties.keys())
+
+        scalar_fields = None if scalar_fields is None else [sf.lower() for sf in scalar_fields]
+        common_scalar_fields = ply_scalar_fields if scalar_fields is None else list(set(scalar_fields) &
+                                                                                    set(ply_scalar_fields))
+        header_scalar_fields = {sf: properties[sf].newbyteorder("=") for sf in common_scalar_fields
+                                if sf.lower() not in ["x", "y", "z", "r", "g", "b", "red", "green", "blue",
+                                                      "nx", "ny", "nz"]}
+
+        return PointCloudHeader(pcd_path, point_count,
+                                has_color=len(set(ply_scalar_fields) & {"r", "g", "b", "red", "green", "blue"}) == 3,
+                                has_normals=len(set(ply_scalar_fields) & {"nx", "ny", "nz"}) == 3,
+                                scalar_fields=header_scalar_fields)
+    else:
+        raise NotImplementedError
+
+
+def read_tile_headers(pcd_paths: list[Path], bounds_cache_path: Path = None) -> list[PointCloudHeader]:
     """
-    nb_points = pcd.xyz.shape[0]
+    Reads the headers of multiple files and makes sure the bounding boxes are available.
 
-    dtype_list = [("x", "f8"), ("y", "f8"), ("z", "f8"), ]
+    *ply* files do not store a bounding box, hence their bounds are taken from the cache file (if the file size and
+    modification time still match) or computed from the coordinates once and added to the cache.
 
-    if retain_colors and pcd.color is not None:
-        assert pcd.color.shape == (nb_points, 3)
-        dtype_list.extend([("red", "u1"), ("green", "u1"), ("blue", "u1"), ])
+    Parameters
+    ----------
+    pcd_paths : list[pathlib.Path]
+    bounds_cache_path : pathlib.Path, optional
+        *json* file with the cached bounds of previous runs.
 
-    if retain_normals and pcd.normals is not None:
-        assert pcd.normals.shape == (nb_points, 3)
-        dtype_list.extend([("nx", "f8"), ("ny", "f8"), ("nz", "f8"), ])
+    Returns
+    -------
+    headers : list[DeSpAn.data_io.PointCloudHeader]
+    """
+    bounds_cache = dict()
+    if bounds_cache_path is not None and bounds_cache_path.is_file():
+        with open(bounds_cache_path, "r") as f:
+            bounds_cache = json.load(f)
+
+    headers = []
+    cache_changed = False
+    for pcd_path in pcd_paths:
+        header = read_pcd_header(pcd_path)
+        if header.minimum_corner is None:
+            stat = pcd_path.stat()
+            cached = bounds_cache.get(f"{pcd_path}")
+            if cached is None or cached["size"] != stat.st_size or cached["mtime_ns"] != stat.st_mtime_ns:
+                xyz = load_ply(pcd_path, retain_colors=False, retain_normals=False, scalar_fields=[],
+                               memory_map=True).xyz
+                cached = {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns,
+                          "minimum_corner": np.amin(xyz, axis=0).tolist(),
+                          "maximum_corner": np.amax(xyz, axis=0).tolist()}
+                bounds_cache[f"{pcd_path}"] = cached
+                cache_changed = True
+            header = replace(header, minimum_corner=np.array(cached["minimum_corner"], dtype=float),
+                             maximum_corner=np.array(cached["maximum_corner"], dtype=float))
+        headers.append(header)
+
+    if bounds_cache_path is not None and cache_changed:
+        bounds_cache_path.parent.mkdir(parents=True, exist_ok=True)
+        with open(bounds_cache_path, "w") as f:
+            json.dump(bounds_cache, f, indent=1)
+
+    return headers
+
+
+def _read_ply_header(f: BinaryIO) -> tuple[str, int, dict[str, np.dtype], int | None]:
+    """
+    Parses the header of a *ply* file (only the *vertex* element is evaluated).
 
-    pcd_scalar_fields = pcd.scalar_fields.keys()
-    common_scalar_fields = pcd_scalar_fields if scalar_fields is None else list(set(scalar_fields) &
-                                                                                set(pcd_scalar_fields))
+    Parameters
+    ----------
+    f : BinaryIO
+        File opened in binary mode and positioned at the start.
 
-    for sf in common_scalar_fields:
-        assert pcd.scalar_fields[sf].shape == (nb_points, )
-        dtype_list.append((sf, pcd.scalar_fields[sf].dtype.str))
+    Returns
+    -------
+    ply_format : str
+        *ascii*, *binary_little_endian* or *binary_big_endian*.
+    point_count : int
+    properties : dict[str, np.dtype]
+        Properties of the *vertex* element (in order of the file).
+    vertex_offset : int or None
+        Number of bytes up to the start of the vertex data (`None` if other elements precede the vertices).
+    """
+    if f.readline().strip() != b"ply":
+        raise ValueError("Not a ply file.")
+
+    ply_format = None
+    point_count = 0
+    properties = dict()
+    current_element = None
+    vertex_first = None
+    while True:
+        line = f.readline()
+        if not line:
+            raise ValueError("Unexpected end of ply header.")
+        tokens = line.decode("ascii").split()
+        if not tokens or tokens[0] in ["comment", "obj_info"]:
+            continue
+        if tokens[0] == "end_header":
+            break
+        if tokens[0] == "format":
+            ply_format = tokens[1]
+        elif tokens[0] == "element":
+            current_element = tokens[1]
+            if vertex_first is None:
+                vertex_first = current_element == "vertex"
+            if current_element == "vertex":
+                point_count = int(tokens[2])
+        elif tokens[0] == "property" and current_element == "vertex":
+            if tokens[1] == "list":
+                raise NotImplementedError("List properties are not supported for vertices.")
+            byte_order = ">" if ply_format == "binary_big_endian" else "<"
+            properties[tokens[2]] = np.dtype(byte_order + PLY_DTYPES[tokens[1]])
+
+    return ply_format, point_count, properties, f.tell() if vertex_first else None
 
-    pcd_np_st = np.empty((nb_points,), dtype=dtype_list)
 
-    pcd_np_st["x"] = pcd.xyz[:, 0]
-    pcd_np_st["y"] = pcd.xyz[:, 1]
-    pcd_np_st["z"] = pcd.xyz[:, 2]
+def save_ply(pcd_path: Path, pcd: PointCloudData, retain_colors: bool = True, retain_normals: bool = True,
+             scalar_fields: list[str] = None, xyz_dtype: str = None, float_dtype: str = None,
+             block_size: int = 1_000_000) -> None:
+    """
+    Writes a binary little-endian *ply* file.
 
-    if retain_colors and pcd.color is not None:
-        pcd_np_st["red"] = pcd.color[:, 0]
-        pcd_np_st["green"] = pcd.color[:, 1]
-        pcd_np_st["blue"] = pcd.color[:, 2]
+    The columns are copied block by block into a small interleaved buffer and written straight to the file, hence no
+    structured copy of the whole point cloud is built (and pending reductions of the point cloud are gathered block by
+    block, see `DeSpAn.geometry.PointCloudData.defer_reductions`). The dtypes of the columns are kept unless `xyz_dtype`
+    or `float_dtype` is given (boolean scalar fields are written as *uchar*).
 
-    if retain_normals and pcd.normals is not None:
-        pcd_np_st["nx"] = pcd.normals[:, 0]
-        pcd_np_st["ny"] = pcd.normals[:, 1]
-        pcd_np_st["nz"] = pcd.normals[:, 2]
+    Parameters
+    ----------
+    pcd_path : pathlib.Path
+    pcd : DeSpAn.geometry.PointCloudData
+    retain_colors : bool, default=True
+    retain_normals : bool, default=True
+    scalar_fields : list[str], optional
+        Scalar fields to write. `None` writes all scalar fields.
+    xyz_dtype : str, optional
+        Output dtype of the coordinates (e.g. *f4*), compact coordinates are written as world coordinates (*f8*).
+        Note that single precision is not sufficient for the centimetre level at the magnitude of projected
+        coordinates.
+    float_dtype : str, optional
+        Output dtype of the normals and floating point scalar fields.
+    block_size : int, default=1_000_000
+        Number of points per written block.
+    """
+    # The dtypes of the columns (an empty selection does not apply pending reductions)
+    dtype = ply_dtype(pcd.select(slice(0, 0)), retain_colors, retain_normals, scalar_fields, xyz_dtype, float_dtype)
+    with PlyWriter(pcd_path, dtype, pcd.nb_points, block_size=block_size) as writer:
+        writer.write(pcd)
 
-    for sf in common_scalar_fields:
-        pcd_np_st[sf] = pcd.scalar_fields[sf]
 
-    # TODO: Rename program in comment
-    el = PlyElement.describe(pcd_np_st, "vertex", comments=["Created with dranjan/python-plyfile in REASSESS program",
-                                                            f"Created {datetime.now():%Y-%m-%dT%H:%M:%S}"])
+def save_laz(pcd_path: Path, pcd: PointCloudData, retain_colors: bool = True, retain_normals: bool = True,
+             scalar_fields: list[str] = None, float_dtype: str = None, scale: float = 0.001,
+             block_size: int = 1_000_000) -> None:
+    """
+    Writes a *las* or (for the suffix *.laz*) *laz* file, compressed with the multithreaded *lazrs* backend if
+    available.
+
+    The points are written block by block as in `save_ply` (LAS 1.4, point format 7 with colors, otherwise 6). Scalar
+    fields of the point format (e.g. *intensity* or *classification*) are written to the standard dimensions, the other
+    scalar fields and the normals (*nx*, *ny*, *nz*) as extra bytes. The written scalar fields are recorded in a VLR,
+    hence `load_laz` returns the same scalar fields and not the unused standard dimensions.
+
+    Parameters
+    ----------
+    pcd_path : pathlib.Path
+    pcd : DeSpAn.geometry.PointCloudData
+    retain_colors : bool, default=True
+    retain_normals : bool, default=True
+    scalar_fields : list[str], optional
+        Scalar fields to write. `None` writes all scalar fields.
+    float_dtype : str, optional
+        Output dtype of the normals and floating point scalar fields.
+    scale : float, default=0.001
+        Resolution of the coordinates (scaled integers). The offsets are the origin of compact point clouds (exact for
+        int32 coordinates of the same scale), otherwise the rounded first point.
+    block_size : int, default=1_000_000
+        Number of points per written block.
+    """
+    columns = _ply_columns(pcd.select(slice(0, 0)), retain_colors, retain_normals, scalar_fields,
+                           float_dtype=float_dtype)
+    point_format = laspy.PointFormat(7 if "red" in [name for name, _, _ in columns] else 6)
+    header = laspy.LasHeader(point_format=point_format, version="1.4")
+    header.scales = np.full((3,), scale)
+    if pcd.origin is not None:
+        header.offsets = pcd.origin
+    elif pcd.nb_points:
+        header.offsets = np.round(pcd.coordinates(slice(0, 1))[0])
+
+    written_scalar_fields = []
+    for name, column, dtype in columns[3:]:
+        if name in ["red", "green", "blue"]:
+            continue
+        if name not in point_format.dimension_names:
+            dtype = np.dtype(column.dtype if dtype is None else dtype)
+            dtype = np.dtype(np.uint8) if dtype == bool else dtype
+            if dtype.kind not in "iuf" or len(name) > 32:
+                raise ValueError(f"Scalar field '{name}' of dtype {dtype} cannot be written to a las file.")
+            header.add_extra_dim(laspy.ExtraBytesParams(name, dtype))
+        if name not in ["nx", "ny", "nz"]:
+            written_scalar_fields.append(name)
+    header.vlrs.append(laspy.VLR(*SCALAR_FIELDS_VLR, description="DeSpAn scalar fields",
+                                 record_data=json.dumps(written_scalar_fields).encode("utf-8")))
 
     if not pcd_path.parent.exists():
         pcd_path.parent.mkdir(parents=True, exist_ok=True)
 
-    PlyData([el]).write(f"{pcd_path}")
+    with laspy.open(pcd_path, mode="w", header=header, do_compress=pcd_path.suffix.lower() == ".laz",
+                    laz_backend=LAZ_BACKENDS) as writer:
+        for pcd_block in pcd.chunks(block_size):
+            points = laspy.ScaleAwarePointRecord.zeros(pcd_block.nb_points, header=header)
+            # Valid returns unless they are scalar fields
+            points.return_number[:] = 1
+            points.number_of_returns[:] = 1
+            for name, column, _ in _ply_columns(pcd_block, retain_colors, retain_normals, scalar_fields):
+                # Colors are scaled to 16 bit (x * 257, which `load_laz` maps back exactly)
+                points[name] = column.astype(np.uint16) * 257 if name in ["red", "green", "blue"] else column
+            writer.write_points(points)
+
+
+def ply_dtype(layout: PointCloudData, retain_colors: bool = True, retain_normals: bool = True,
+              scalar_fields: list[str] = None, xyz_dtype: str = None, float_dtype: str = None) -> np.dtype:
+    """
+    Vertex dtype of a *ply* file of a point cloud, see `save_ply`.
 
+    Parameters
+    ----------
+    layout : DeSpAn.geometry.PointCloudData
+        Point cloud with the colors, normals and scalar fields of the file (e.g. an empty selection or
+        `DeSpAn.geometry.PointCloudData.empty`).
+    retain_colors : bool, default=True
+    retain_normals : bool, default=True
+    scalar_fields : list[str], optional
+    xyz_dtype : str, optional
+    float_dtype : str, optional
 
-def load_ply(pcd_path: Path, retain_colors: bool = True, retain_normals: bool = True, scalar_fields: list[str] = None
-             ) -> PointCloudData:
+    Returns
+    -------
+    dtype : np.dtype
+        Structured little-endian dtype with a field per property.
     """
-    Loads a ply file using *dranjan/python-plyfile*.
+    dtype_list = []
+    for name, column, dtype in _ply_columns(layout, retain_colors, retain_normals, scalar_fields, xyz_dtype,
+                                            float_dtype):
+        dtype = np.dtype(column.dtype if dtype is None else dtype)
+        dtype = np.dtype(np.uint8) if dtype == bool else dtype
+        if dtype.kind not in "iuf" or dtype.itemsize > 8 or (dtype.kind != "f" and dtype.itemsize > 4):
+            raise ValueError(f"Scalar field '{name}' of dtype {dtype} cannot be written to a ply file.")
+        dtype_list.append((name, dtype.newbyteorder("<")))
+    return np.dtype(dtype_list)
+
+
+class PlyWriter:
+    """
+    Binary little-endian *ply* file that is written in parts (e.g. tile by tile), see `save_ply`.
+
+    The number of points does not have to be known in advance (e.g. for tiles that are filtered while loading): the
+    vertex count in the header is written with the width of `max_points` and corrected when the writer is closed. On
+    an exception within a `with` block the partial file is removed.
+
+    Parameters
+    ----------
+    pcd_path : pathlib.Path
+    dtype : np.dtype
+        Structured dtype of the vertices (see `ply_dtype`).
+    max_points : int
+        Upper bound of the number of points (e.g. the sum of the point counts in the tile headers).
+    block_size : int, default=1_000_000
+        Number of points per written block.
+
+    Attributes
+    ----------
+    nb_points : int
+        Number of points written so far.
+    minimum_corner, maximum_corner : np.ndarray
+        Bounding box of the points written so far.
+    """
+
+    def __init__(self, pcd_path: Path, dtype: np.dtype, max_points: int, block_size: int = 1_000_000) -> None:
+        self.pcd_path = Path(pcd_path)
+        self.dtype = np.dtype(dtype)
+        self.max_points = max_points
+        self.block_size = block_size
+        self.nb_points = 0
+        self.minimum_corner = np.full((3,), np.inf)
+        self.maximum_corner = np.full((3,), -np.inf)
+
+        header = ["ply", "format binary_little_endian 1.0", "comment Created with DeSpAn",
+                  f"comment Created {datetime.now():%Y-%m-%dT%H:%M:%S}"]
+        # Offset of the vertex count, which is zero-padded to the width of max_points when corrected
+        self._count_width = len(f"{max_points:d}")
+        self._count_offset = len(("\n".join(header) + "\nelement vertex ").encode("ascii"))
+        header.append(f"element vertex {max_points:d}")
+        for name in self.dtype.names:
+            field_dtype = self.dtype.fields[name][0]
+            header.append(f"property {PLY_TYPE_NAMES[field_dtype.kind + str(field_dtype.itemsize)]} {name}")
+        header.append("end_header")
+
+        if not self.pcd_path.parent.exists():
+            self.pcd_path.parent.mkdir(parents=True, exist_ok=True)
+        self._block = np.empty((min(block_size, max_points),), dtype=self.dtype)
+        self._file = open(self.pcd_path, "wb")
+        self._file.write(("\n".join(header) + "\n").encode("ascii"))
+
+    def __enter__(self) -> "PlyWriter":
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        self.close()
+        if exc_type is not None:
+            self.pcd_path.unlink(missing_ok=True)
+
+    def write(self, pcd: PointCloudData) -> None:
+        """
+        Appends the points of a point cloud (it has to provide all properties of the file, others are ignored).
+
+        Parameters
+        ----------
+        pcd : DeSpAn.geometry.PointCloudData
+        """
+        self._check_count(pcd.nb_points)
+        for pcd_block in pcd.chunks(self.block_size):
+            nb_block_points = pcd_block.nb_points
+            columns = {name: column for name, column, _ in _ply_columns(pcd_block)}
+            block = self._block[:nb_block_points]
+            for name in self.dtype.names:
+                block[name] = columns[name]
+            self.write_vertices(block)
+
+    def write_vertices(self, vertices: np.ndarray) -> None:
+        """
+        Appends vertices of the dtype of the file (e.g. rows of another *ply* file).
+
+        Parameters
+        ----------
+        vertices : np.ndarray
+            Structured array.
+        """
+        self._check_count(vertices.shape[0])
+        if vertices.shape[0]:
+            for i, axis in enumerate(["x", "y", "z"]):
+                self.minimum_corner[i] = min(self.minimum_corner[i], np.amin(vertices[axis]))
+                self.maximum_corner[i] = max(self.maximum_corner[i], np.amax(vertices[axis]))
+        np.asarray(vertices, dtype=self.dtype).tofile(self._file)
+        self.nb_points += vertices.shape[0]
+
+    def _check_count(self, nb_points: int) -> None:
+        if self.nb_points + nb_points > self.max_points:
+            raise ValueError(f"More than the {self.max_points:,d} announced points written to '{self.pcd_path}'.")
+
+    def close(self) -> None:
+        """
+        Corrects the vertex count and closes the file.
+        """
+        if self._file.closed:
+            return
+        if self.nb_points != self.max_points:
+            self._file.seek(self._count_offset)
+            self._file.write(f"{self.nb_points:0{self._count_width}d}".encode("ascii"))
+        self._file.close()
+
+
+def ply_bounds(pcd_path: Path, chunk_size: int = MEMMAP_CHUNK_SIZE) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Bounding box of the points of a binary *ply* file, read chunk by chunk from a mapping of the file.
+
+    Parameters
+    ----------
+    pcd_path : pathlib.Path
+    chunk_size : int, default=MEMMAP_CHUNK_SIZE
+
+    Returns
+    -------
+    minimum_corner, maximum_corner : np.ndarray
+    """
+    vertices = _map_ply_vertices(pcd_path)
+    minimum_corner = np.full((3,), np.inf)
+    maximum_corner = np.full((3,), -np.inf)
+    for start in range(0, vertices.shape[0], chunk_size):
+        chunk = vertices[start:start + chunk_size]
+        for i, axis in enumerate(["x", "y", "z"]):
+            minimum_corner[i] = min(minimum_corner[i], np.amin(chunk[axis]))
+            maximum_corner[i] = max(maximum_corner[i], np.amax(chunk[axis]))
+    return minimum_corner, maximum_corner
+
+
+def box_cut_ply(pcd_path: Path, out_path: Path, minimum_corner: Tuple[float, float, float],
+                maximum_corner: Tuple[float, float, float], chunk_size: int = MEMMAP_CHUNK_SIZE) -> int:
+    """
+    Writes the points of a binary *ply* file within a box to another file, chunk by chunk (the properties are copied
+    unchanged), i.e. at constant memory.
+
+    Parameters
+    ----------
+    pcd_path : pathlib.Path
+    out_path : pathlib.Path
+    minimum_corner : Tuple[float, float, float]
+    maximum_corner : Tuple[float, float, float]
+        As in `DeSpAn.geometry.PointCloudData.box_cut` (axes without extent are ignored).
+    chunk_size : int, default=MEMMAP_CHUNK_SIZE
+
+    Returns
+    -------
+    nb_points : int
+        Number of written points.
+    """
+    minimum_corner = np.array(minimum_corner, dtype=float)
+    maximum_corner = np.array(maximum_corner, dtype=float)
+    span = maximum_corner - minimum_corner
+    minimum_corner[span == 0] = -np.inf
+    maximum_corner[span == 0] = np.inf
+
+    vertices = _map_ply_vertices(pcd_path)
+    # Big-endian files are written little-endian
+    dtype = np.dtype([(name, vertices.dtype[name].newbyteorder("<")) for name in vertices.dtype.names])
+    with PlyWriter(out_path, dtype, vertices.shape[0], block_size=chunk_size) as writer:
+        for start in range(0, vertices.shape[0], chunk_size):
+            chunk = vertices[start:start + chunk_size]
+            xyz = np.column_stack([chunk[axis] for axis in ["x", "y", "z"]])
+            writer.write_vertices(chunk[points_in_box(xyz, minimum_corner, maximum_corner)])
+    return writer.nb_points
+
+
+def _map_ply_vertices(pcd_path: Path) -> np.ndarray:
+    # Read-only mapping of the vertices of a binary ply file
+    with open(pcd_path, "rb") as f:
+        ply_format, point_count, properties, vertex_offset = _read_ply_header(f)
+    if ply_format == "ascii" or vertex_offset is None:
+        raise NotImplementedError(f"'{pcd_path}' is not a binary ply file with the vertices first.")
+    return np.memmap(pcd_path, dtype=list(properties.items()), mode="r", offset=vertex_offset, shape=(point_count,))
+
+
+def _ply_columns(pcd: PointCloudData, retain_colors: bool = True, retain_normals: bool = True,
+                 scalar_fields: list[str] = None, xyz_dtype: str = None,
+                 float_dtype: str = None) -> list[tuple[str, np.ndarray, str | None]]:
+    """
+    Columns of a *ply* file (property name, values and output dtype), see `save_ply`.
+    """
+    # Compact coordinates are transformed to world coordinates (f8)
+    xyz = pcd.coordinates()
+    columns = [(axis, xyz[:, i], xyz_dtype) for i, axis in enumerate(["x", "y", "z"])]
+
+    if retain_colors and pcd.color is not None:
+        columns.extend((channel, pcd.color[:, i], None) for i, channel in enumerate(["red", "green", "blue"]))
+
+    if retain_normals and pcd.normals is not None:
+        columns.extend((axis, pcd.normals[:, i], float_dtype) for i, axis in enumerate(["nx", "ny", "nz"]))
+
+    pcd_scalar_fields = pcd.scalar_fields.keys()
+    common_scalar_fields = pcd_scalar_fields if scalar_fields is None else [sf for sf in pcd_scalar_fields
+                                                                            if sf in scalar_fields]
+
+    for sf in common_scalar_fields:
+        sf_dtype = float_dtype if np.issubdtype(pcd.scalar_fields[sf].dtype, np.floating) else None
+        columns.append((sf, pcd.scalar_fields[sf], sf_dtype))
+    return columns
+
+
+def load_ply(pcd_path: Path, retain_colors: bool = True, retain_normals: bool = True, scalar_fields: list[str] = None,
+             memory_map: bool = False, filter_functions: Iterable[FilterFunction] = None, origin: np.ndarray = None,
+             scale: np.ndarray = None) -> PointCloudData:
+    """
+    Loads a ply file.
+
+    The vertex block of binary files is memory-mapped and the columns are copied from the mapping (once). Other files
+    are read with *dranjan/python-plyfile*. The filters are evaluated on their dimensions first, the columns are only
+    copied for the retained points. Compact coordinates (`origin`) are converted chunk by chunk, i.e. without a
+    float64 copy of the coordinates.
 
     Parameters
     ----------
@@ -96,36 +590,74 @@ def load_ply(pcd_path: Path, retain_colors: bool = True, retain_normals: bool =
                     *ply-file*). `None` retains all available scalar fields.
     retain_colors : bool, default=True
     retain_normals : bool, default=True
+    memory_map : bool, default=False
+        Return the scalar fields (and the coordinates, if stored as consecutive native f8 properties) as (read-only)
+        views of the mapping instead of copies, i.e. they are only read from disk when accessed. The file stays open as
+        long as the arrays are referenced (not applicable to filtered point clouds).
+    filter_functions : Iterable[DeSpAn.filters.PointFilter or tuple[str, func]], optional
+        Filters as in `load_laz`.
+    origin : np.ndarray, optional
+        Return compact coordinates relative to `origin` (see `DeSpAn.geometry.PointCloudData.compact`).
+    scale : np.ndarray, optional
+        Scale of int32 compact coordinates (float32 if `None`).
 
     Returns
     -------
     pcd : DeSpAn.geometry.PointCloudData
     """
     with open(pcd_path, "rb") as f:
-        plydata = PlyData.read(f)
-    xyz = np.empty((plydata['vertex'].count, 3,), dtype=float)
-    xyz[:, 0] = plydata["vertex"]["x"]
-    xyz[:, 1] = plydata["vertex"]["y"]
-    xyz[:, 2] = plydata["vertex"]["z"]
+        ply_format, point_count, properties, vertex_offset = _read_ply_header(f)
+
+    if ply_format == "ascii" or vertex_offset is None:
+        with open(pcd_path, "rb") as f:
+            vertices = PlyData.read(f)["vertex"].data
+    else:
+        vertices = np.memmap(pcd_path, dtype=list(properties.items()), mode="r", offset=vertex_offset,
+                             shape=(point_count,))
 
-    ply_scalar_fields = [pe.name for pe in plydata["vertex"].properties]
+    mask = None
+    filter_functions = _file_filters(filter_functions, vertices.dtype.names, pcd_path)
+    if filter_functions:
+        mask = filter_mask(filter_functions, {dim: vertices[dim] for dim in filter_dimensions(filter_functions)},
+                           vertices.shape[0])
+
+    return _ply_vertices_to_pcd(vertices, retain_colors, retain_normals, scalar_fields, memory_map, mask=mask,
+                                origin=origin, scale=scale)
+
+
+def _ply_vertices_to_pcd(vertices: np.ndarray, retain_colors: bool = True, retain_normals: bool = True,
+                         scalar_fields: list[str] = None, memory_map: bool = False,
+                         mask: np.ndarray = None, origin: np.ndarray = None,
+                         scale: np.ndarray = None) -> PointCloudData:
+    """
+    Converts the structured array of the *vertex* element (the rows of `mask`) to a `PointCloudData`.
+    """
+    def column(name: str) -> np.ndarray:
+        return vertices[name] if mask is None else vertices[name][mask]
+
+    nb_points = vertices.shape[0] if mask is None else int(np.count_nonzero(mask))
+    xyz = _ply_xyz(vertices, nb_points, memory_map=memory_map, mask=mask, origin=origin, scale=scale)
+
+    ply_scalar_fields = list(vertices.dtype.names)
 
     # ply_scalar_fields_lower = [ply_sf.lower() for ply_sf in ply_scalar_fields]
     scalar_fields = None if scalar_fields is None else [sf.lower() for sf in scalar_fields]
 
     colors = None
     if retain_colors and len(set(ply_scalar_fields) & set(["r", "g", "b", "red", "green", "blue"])) == 3:
-        colors = np.empty((plydata['vertex'].count, 3,), dtype=np.uint8)
-        colors[:, 0] = plydata["vertex"]["r"] if "r" in ply_scalar_fields else plydata["vertex"]["red"]
-        colors[:, 1] = plydata["vertex"]["g"] if "g" in ply_scalar_fields else plydata["vertex"]["green"]
-        colors[:, 2] = plydata["vertex"]["b"] if "b" in ply_scalar_fields else plydata["vertex"]["blue"]
+        red = column("r" if "r" in ply_scalar_fields else "red")
+        colors = np.empty((nb_points, 3,), dtype=red.dtype.newbyteorder("="))
+        colors[:, 0] = red
+        colors[:, 1] = column("g" if "g" in ply_scalar_fields else "green")
+        colors[:, 2] = column("b" if "b" in ply_scalar_fields else "blue")
+        colors = color_to_uint8(colors)
 
     normals = None
     if retain_normals and len(set(ply_scalar_fields) & set(["nx", "ny", "nz"])) == 3:
-        normals = np.empty((plydata['vertex'].count, 3,), dtype=float)
-        normals[:, 0] = plydata["vertex"]["nx"]
-        normals[:, 1] = plydata["vertex"]["ny"]
-        normals[:, 2] = plydata["vertex"]["nz"]
+        normals = np.empty((nb_points, 3,), dtype=float)
+        normals[:, 0] = column("nx")
+        normals[:, 1] = column("ny")
+        normals[:, 2] = column("nz")
 
     common_scalar_fields = ply_scalar_fields if scalar_fields is None else list(set(scalar_fields) &
                                                                                 set(ply_scalar_fields))
@@ -133,14 +665,61 @@ def load_ply(pcd_path: Path, retain_colors: bool = True, retain_normals: bool =
     scalar_fields_dict = dict()
     for sf in common_scalar_fields:
         if sf.lower() not in ["x", "y", "z", "r", "g", "b", "red", "green", "blue", "nx", "ny", "nz"]:
-            scalar_fields_dict[sf] = np.array(plydata["vertex"][sf]).squeeze()
+            values = column(sf)
+            if memory_map and mask is None and values.dtype.isnative:
+                scalar_fields_dict[sf] = values.view(np.ndarray)
+            else:
+                scalar_fields_dict[sf] = np.ascontiguousarray(values, dtype=values.dtype.newbyteorder("="))
 
-    return PointCloudData(xyz, color=colors, normals=normals, scalar_fields=scalar_fields_dict)
+    return PointCloudData(xyz, color=colors, normals=normals, scalar_fields=scalar_fields_dict, origin=origin,
+                          scale=scale)
 
 
-def load_laz(pcd_path, retain_colors: bool = True, scalar_fields: list[str] = None):
+def _ply_xyz(vertices: np.ndarray, nb_points: int, memory_map: bool = False, mask: np.ndarray = None,
+             origin: np.ndarray = None, scale: np.ndarray = None) -> np.ndarray:
+    """
+    Coordinates of the *vertex* element (the rows of `mask`): converted chunk by chunk into the frame of `origin`, a
+    view of the mapping (`memory_map` and native f8 properties) or a float64 copy.
     """
-    Loads a ply file using *laspy*.
+    axes = ["x", "y", "z"]
+    if origin is not None:
+        xyz = np.empty((nb_points, 3,), dtype=np.float32 if scale is None else np.int32)
+        offset = 0
+        for start in range(0, vertices.shape[0], MEMMAP_CHUNK_SIZE):
+            chunk = vertices[start:start + MEMMAP_CHUNK_SIZE]
+            if mask is not None:
+                chunk = chunk[mask[start:start + MEMMAP_CHUNK_SIZE]]
+            world = np.empty((chunk.shape[0], 3,), dtype=float)
+            for i, axis in enumerate(axes):
+                world[:, i] = chunk[axis]
+            xyz[offset:offset + chunk.shape[0]] = coordinates_in_frame(world, origin, scale)
+            offset += chunk.shape[0]
+        return xyz
+
+    if memory_map and mask is None and all(vertices.dtype[axis] == np.dtype("=f8") for axis in axes):
+        # A strided view if x, y and z are consecutive properties (a copy otherwise)
+        return structured_to_unstructured(vertices[axes]).view(np.ndarray)
+
+    xyz = np.empty((nb_points, 3,), dtype=float)
+    for i, axis in enumerate(axes):
+        xyz[:, i] = vertices[axis] if mask is None else vertices[axis][mask]
+    return xyz
+
+
+def load_laz(pcd_path, retain_colors: bool = True, scalar_fields: list[str] = None,
+             filter_functions: Iterable[FilterFunction] = None, chunk_size: int = None, origin: np.ndarray = None,
+             scale: np.ndarray = None):
+    """
+    Loads a las/laz file using *laspy* (decompressed with the multithreaded *lazrs* backend if available).
+
+    The filters are evaluated on their dimensions first (whether or not they are kept as scalar fields), the other
+    dimensions are only extracted for the retained points. With `chunk_size` the file is streamed chunk by chunk (see
+    `iter_laz_chunks`) and the filters are applied to every chunk. Without filters the points are copied into arrays
+    allocated once for the point count of the header (see `DeSpAn.geometry.merge_pcd_preallocated`), with filters the
+    retained points of the chunks are concatenated once at the end (see `DeSpAn.geometry.merge_pcd`). Hence the peak
+    memory follows the retained points (twice their size with filters) and a chunk, not the size of the file. Extra
+    bytes *nx*, *ny* and *nz* are loaded as normals, and files written by `save_laz` are loaded with the scalar fields
+    they were written with.
 
     TODO: Extend usage from `dimension_names` to `extra_dimension_names`
 
@@ -151,41 +730,206 @@ def load_laz(pcd_path, retain_colors: bool = True, scalar_fields: list[str] = No
                     List of scalar fields to keep (will be intersected against the available scalar fields from the
                     *ply-file*). `None` retains all available scalar fields.
     retain_colors : bool, default=True
-    retain_normals : bool, default=True
+    filter_functions : Iterable[DeSpAn.filters.PointFilter or tuple[str, func]], optional
+        Filter expressions or functions as in `DeSpAn.geometry.PointCloudData.filter`, all of them have to hold.
+        Filters on dimensions that the file does not have are skipped.
+    chunk_size : int, optional
+        Number of points to decompress at once. `None` reads the whole file with `laspy.read`.
+    origin : np.ndarray, optional
+        Return compact coordinates relative to `origin` (see `DeSpAn.geometry.PointCloudData.compact`), which are
+        converted from the scaled integers of the file directly.
+    scale : np.ndarray, optional
+        Scale of int32 compact coordinates (float32 if `None`).
 
     Returns
     -------
     pcd : DeSpAn.geometry.PointCloudData
     """
-    pcd = laspy.read(pcd_path)
-    laz_scalar_fields = list(pcd.point_format.dimension_names)
+    if chunk_size is None:
+        las = laspy.read(pcd_path, laz_backend=LAZ_BACKENDS)
+        points = _filter_las_points(las.points, _file_filters(filter_functions, _las_dimensions(las.header),
+                                                              pcd_path))
+        pcd = _las_points_to_pcd(points, _las_xyz(points, las.header, origin, scale), retain_colors=retain_colors,
+                                 scalar_fields=_las_scalar_fields(las.header, scalar_fields), origin=origin,
+                                 scale=scale)
+        print(f"{pcd.xyz.shape[0]:,d} points added for file '{pcd_path.name:s}'.")
+        return pcd
+
+    header = read_pcd_header(Path(pcd_path), scalar_fields=scalar_fields)
+    if header.point_count == 0:
+        return load_laz(pcd_path, retain_colors=retain_colors, scalar_fields=scalar_fields,
+                        filter_functions=filter_functions, origin=origin, scale=scale)
+
+    chunks = iter_laz_chunks(pcd_path, chunk_size, retain_colors=retain_colors, scalar_fields=scalar_fields,
+                             filter_functions=filter_functions, origin=origin, scale=scale)
+    if not filter_functions:
+        # The point count of the header is exact
+        pcd = merge_pcd_preallocated(chunks, nb_points=header.point_count, nb_pcds=1,
+                                     color=retain_colors and header.has_color, normals=header.has_normals,
+                                     scalar_fields=header.scalar_fields, tile_ids=False)
+    else:
+        # Not sized by the header, which counts the points prior to filtering
+        pcd = merge_pcd(list(chunks), tile_ids=False)
+
+    print(f"{pcd.xyz.shape[0]:,d} points added for file '{pcd_path.name:s}'.")
+
+    return pcd
+
+
+def iter_laz_chunks(pcd_path, chunk_size: int, retain_colors: bool = True, scalar_fields: list[str] = None,
+                    filter_functions: Iterable[FilterFunction] = None,
+                    origin: np.ndarray = None, scale: np.ndarray = None) -> Iterator[PointCloudData]:
+    """
+    Streams a *las/laz* file with laspy's chunk iterator.
 
+    The filter functions are evaluated on the decoded filter dimensions of each chunk first, the remaining dimensions
+    are only extracted for the retained points.
+
+    Parameters
+    ----------
+    pcd_path : pathlib.Path
+    chunk_size : int
+        Number of points to decompress at once.
+    retain_colors : bool, default=True
+    scalar_fields : list[str], optional
+        As in `load_laz`.
+    filter_functions : Iterable[DeSpAn.filters.PointFilter or tuple[str, func]], optional
+        As in `load_laz`.
+    origin : np.ndarray, optional
+        As in `load_laz`.
+    scale : np.ndarray, optional
+        As in `load_laz`.
+
+    Yields
+    ------
+    pcd : DeSpAn.geometry.PointCloudData
+        Filtered points of a chunk.
+    """
+    with laspy.open(pcd_path, laz_backend=LAZ_BACKENDS) as reader:
+        chunk_filters = _file_filters(filter_functions, _las_dimensions(reader.header), pcd_path)
+        scalar_fields = _las_scalar_fields(reader.header, scalar_fields)
+        for points in reader.chunk_iterator(chunk_size):
+            points = _filter_las_points(points, chunk_filters)
+            yield _las_points_to_pcd(points, _las_xyz(points, reader.header, origin, scale),
+                                     retain_colors=retain_colors, scalar_fields=scalar_fields, copy=True,
+                                     origin=origin, scale=scale)
+
+
+def _file_filters(filter_functions: Iterable, dimensions: Iterable[str], pcd_path: Path) -> list:
+    """
+    Filters whose dimensions are available in a file, the others are skipped (with a message).
+    """
+    if filter_functions is None:
+        return []
+    dimensions = set(dimensions)
+    file_filters = []
+    for point_filter in filter_functions:
+        missing = [dim for dim in filter_dimensions([point_filter]) if dim not in dimensions]
+        if missing:
+            print(f"Filter {point_filter} skipped for '{Path(pcd_path).name}' (no dimension {', '.join(missing)})")
+        else:
+            file_filters.append(point_filter)
+    return file_filters
+
+
+def _las_scalar_fields(header, scalar_fields: list[str] = None) -> list[str] | None:
+    # Files written by `save_laz` are loaded with their scalar fields (not with the unused standard dimensions)
+    if scalar_fields is None:
+        for vlr in header.vlrs:
+            if (vlr.user_id, vlr.record_id) == SCALAR_FIELDS_VLR:
+                return json.loads(vlr.record_data.decode("utf-8"))
+    return scalar_fields
+
+
+def _las_dimensions(header) -> list[str]:
+    # The scaled coordinates are available besides the dimensions of the point format
+    return list(header.point_format.dimension_names) + ["x", "y", "z"]
+
+
+def _filter_las_points(points, filter_functions: list):
+    """
+    Decodes only the dimensions of the filters and returns the retained points.
+    """
+    if not filter_functions:
+        return points
+    columns = {dim: np.asarray(points[dim]) if dim in ["x", "y", "z"] else _las_scalar_field(points, dim, copy=False)
+               for dim in filter_dimensions(filter_functions)}
+    return points[filter_mask(filter_functions, columns, len(points))]
+
+
+def _las_xyz(points, header, origin: np.ndarray = None, scale: np.ndarray = None) -> np.ndarray:
+    """
+    Coordinates of *laspy* points, either as float64 world coordinates or converted axis by axis from the scaled
+    integers into the local frame of compact coordinates (exactly, if only the offsets differ by multiples of `scale`).
+    """
+    if origin is None:
+        xyz = np.empty((len(points), 3,), dtype=float)
+        xyz[:, 0] = points.x
+        xyz[:, 1] = points.y
+        xyz[:, 2] = points.z
+        return xyz
+
+    xyz = np.empty((len(points), 3,), dtype=np.float32 if scale is None else np.int32)
+    for i, dim in enumerate(["X", "Y", "Z"]):
+        if scale is None:
+            xyz[:, i] = points[dim] * header.scales[i] + (header.offsets[i] - origin[i])
+            continue
+        shift = (header.offsets[i] - origin[i]) / scale[i]
+        if header.scales[i] == scale[i] and shift == np.round(shift):
+            local = points[dim].astype(np.int64) + int(shift)
+        else:
+            local = np.round(points[dim] * (header.scales[i] / scale[i]) + shift)
+        if local.size and np.amax(np.abs(local)) > INT32_LIMIT:
+            raise ValueError(f"Coordinates exceed the int32 range of the scale {scale} around {origin}.")
+        xyz[:, i] = local
+    return xyz
+
+
+def _las_points_to_pcd(points, xyz: np.ndarray, retain_colors: bool = True, scalar_fields: list[str] = None,
+                       copy: bool = False, origin: np.ndarray = None, scale: np.ndarray = None) -> PointCloudData:
+    """
+    Converts *laspy* points (`LasData` or a point record of a chunk) to a point cloud.
+
+    With `copy` the scalar fields are copied out of the point record, so that the record itself can be released.
+    """
+    laz_scalar_fields = list(points.point_format.dimension_names)
+    nb_points = xyz.shape[0]
 
     colors = None
     if retain_colors and len(set(laz_scalar_fields) & set(["red", "green", "blue"])) == 3:
-        colors = np.empty((pcd.header.point_count, 3,), dtype=np.uint8)
-        colors[:, 0] = (pcd["red"] / 256).astype(np.uint8)
-        colors[:, 1] = (pcd["green"] / 256).astype(np.uint8)
-        colors[:, 2] = (pcd["blue"] / 256).astype(np.uint8)
+        colors = np.empty((nb_points, 3,), dtype=np.uint8)
+        colors[:, 0] = (points["red"] / 256).astype(np.uint8)
+        colors[:, 1] = (points["green"] / 256).astype(np.uint8)
+        colors[:, 2] = (points["blue"] / 256).astype(np.uint8)
+
+    # Normals are stored as extra bytes (e.g. by `save_laz`)
+    normals = None
+    if len(set(laz_scalar_fields) & {"nx", "ny", "nz"}) == 3:
+        normals = np.empty((nb_points, 3,), dtype=np.result_type(*(points[axis].dtype for axis in ["nx", "ny", "nz"])))
+        for i, axis in enumerate(["nx", "ny", "nz"]):
+            normals[:, i] = points[axis]
 
     common_scalar_fields = laz_scalar_fields if scalar_fields is None else list(set(scalar_fields) &
                                                                                 set(laz_scalar_fields))
 
     scalar_fields_dict = dict()
     for sf in common_scalar_fields:
-        if sf.lower() not in ["x", "y", "z", "red", "green", "blue"]:
-            if isinstance(pcd[sf], np.ndarray):
-                scalar_fields_dict[sf] = pcd[sf]
-            elif isinstance(pcd[sf], laspy.point.dims.SubFieldView):
-                if sf in ["scan_direction_flag", "edge_of_flight_line", "synthetic", "key_point", "withheld",
-                          "overlap"]:
-                    scalar_fields_dict[sf] = np.array(pcd[sf], dtype=bool)
-                else:
-                    scalar_fields_dict[sf] = np.array(pcd[sf])
-
-            else:
-                raise NotImplementedError
-
-    print(f"{pcd.header.point_count:,d} points added for file '{pcd_path.name:s}'.")
-
-    return PointCloudData(xyz=pcd.xyz, color=colors, scalar_fields=scalar_fields_dict)
+        if sf.lower() not in ["x", "y", "z", "red", "green", "blue"] + (["nx", "ny", "nz"] if normals is not None
+                                                                        else []):
+            scalar_fields_dict[sf] = _las_scalar_field(points, sf, copy=copy)
+
+    return PointCloudData(xyz=xyz, color=colors, normals=normals, scalar_fields=scalar_fields_dict, origin=origin,
+                          scale=scale)
+
+
+def _las_scalar_field(points, sf: str, copy: bool = True) -> np.ndarray:
+    values = points[sf]
+    if isinstance(values, np.ndarray):
+        return np.array(values) if copy else values
+    elif isinstance(values, laspy.point.dims.SubFieldView):
+        if sf in LAS_FLAG_FIELDS:
+            return np.array(values, dtype=bool)
+        else:
+            return np.array(values)
+    else:
+        raise NotImplementedError
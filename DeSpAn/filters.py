@@ -0,0 +1,208 @@
+"""Vectorized filter expressions on the dimensions of the points"""
+
+import ast
+from dataclasses import dataclass, field
+from functools import reduce
+import operator
+from typing import Any, Callable, Iterable, Mapping, Tuple
+
+import numpy as np
+
+
+_COMPARISONS = {ast.Eq: np.equal, ast.NotEq: np.not_equal, ast.Lt: np.less, ast.LtE: np.less_equal,
+                ast.Gt: np.greater, ast.GtE: np.greater_equal}
+_BINARY_OPERATORS = {ast.Add: operator.add, ast.Sub: operator.sub, ast.Mult: operator.mul, ast.Div: operator.truediv,
+                     ast.FloorDiv: operator.floordiv, ast.Mod: operator.mod, ast.BitAnd: operator.and_,
+                     ast.BitOr: operator.or_, ast.BitXor: operator.xor}
+_UNARY_OPERATORS = {ast.Not: np.logical_not, ast.USub: operator.neg, ast.UAdd: operator.pos,
+                    ast.Invert: operator.invert}
+
+
+@dataclass(frozen=True)
+class PointFilter:
+    """
+    Filter expression on the dimensions (scalar fields) of the points, compiled to a vectorized NumPy mask.
+
+    The expressions are Python expressions restricted to dimension names, numbers, comparisons (also chained and
+    `in`/`not in` a literal tuple, list or set), arithmetic and bitwise operators and `and`, `or` and `not`, e.g.
+    ``classification in (2, 9)``, ``1000 <= intensity < 40000``, ``not withheld and not overlap`` or
+    ``return_number == number_of_returns``. Nothing else (attributes, calls, subscripts, ...) is accepted, hence
+    expressions from configuration files cannot execute code.
+
+    Parameters
+    ----------
+    expression : str
+
+    Attributes
+    ----------
+    expression : str
+    dimensions : tuple[str, ...]
+        Dimensions used by the expression (in order of occurrence), which the readers decode for filtering.
+
+    Raises
+    ------
+    ValueError
+        If the expression is invalid or uses anything but the allowed syntax.
+    """
+
+    expression: str
+    dimensions: tuple[str, ...] = field(init=False)
+    _evaluate: Callable[[Mapping[str, np.ndarray]], Any] = field(init=False, repr=False, compare=False)
+
+    def __post_init__(self) -> None:
+        try:
+            tree = ast.parse(self.expression.strip(), mode="eval")
+        except SyntaxError as e:
+            raise ValueError(f"Invalid filter expression '{self.expression}' ({e.msg})") from None
+        dimensions = []
+        object.__setattr__(self, "_evaluate", self._compile(tree.body, dimensions))
+        object.__setattr__(self, "dimensions", tuple(dict.fromkeys(dimensions)))
+
+    def __reduce__(self) -> tuple:
+        # The compiled expression is not picklable, it is compiled again (e.g. in worker processes)
+        return PointFilter, (self.expression,)
+
+    def __call__(self, columns: Mapping[str, np.ndarray]) -> np.ndarray:
+        """
+        Evaluates the expression.
+
+        Parameters
+        ----------
+        columns : Mapping[str, np.ndarray]
+            Values of (at least) the `dimensions`, all of the same length.
+
+        Returns
+        -------
+        mask : np.ndarray
+            Boolean array, `True` for the points to keep.
+        """
+        nb_points = len(next(iter(columns.values()))) if columns else 0
+        mask = self._evaluate(columns)
+        if np.ndim(mask) == 0:
+            # Constant expressions (e.g. True)
+            return np.full((nb_points,), bool(mask))
+        return np.asarray(mask, dtype=bool)
+
+    def _compile(self, node: ast.AST, dimensions: list[str]) -> Callable[[Mapping[str, np.ndarray]], Any]:
+        # Translates the syntax tree into nested closures over the columns
+        if isinstance(node, ast.Name):
+            dimensions.append(node.id)
+            return lambda columns: columns[node.id]
+        if isinstance(node, ast.Constant) and isinstance(node.value, (bool, int, float)):
+            return lambda columns: node.value
+        if isinstance(node, ast.BoolOp):
+            operands = [self._compile(value, dimensions) for value in node.values]
+            function = np.logical_and if isinstance(node.op, ast.And) else np.logical_or
+            return lambda columns: reduce(function, [operand(columns) for operand in operands])
+        if isinstance(node, ast.UnaryOp) and type(node.op) in _UNARY_OPERATORS:
+            operand = self._compile(node.operand, dimensions)
+            function = _UNARY_OPERATORS[type(node.op)]
+            return lambda columns: function(operand(columns))
+        if isinstance(node, ast.BinOp) and type(node.op) in _BINARY_OPERATORS:
+            left = self._compile(node.left, dimensions)
+            right = self._compile(node.right, dimensions)
+            function = _BINARY_OPERATORS[type(node.op)]
+            return lambda columns: function(left(columns), right(columns))
+        if isinstance(node, ast.Compare) and isinstance(node.ops[0], (ast.In, ast.NotIn)):
+            if len(node.ops) > 1:
+                raise ValueError(f"Invalid filter expression '{self.expression}' ('in' cannot be chained)")
+            operand = self._compile(node.left, dimensions)
+            values = self._literal_values(node.comparators[0])
+            invert = isinstance(node.ops[0], ast.NotIn)
+            return lambda columns: np.isin(operand(columns), values, invert=invert)
+        if isinstance(node, ast.Compare) and all(type(op) in _COMPARISONS for op in node.ops):
+            operands = [self._compile(operand, dimensions) for operand in [node.left] + node.comparators]
+            functions = [_COMPARISONS[type(op)] for op in node.ops]
+            return lambda columns: _chained_comparison(functions, [operand(columns) for operand in operands])
+        raise self._invalid(node.ops[0] if isinstance(node, ast.Compare) else node)
+
+    def _literal_values(self, node: ast.AST) -> np.ndarray:
+        if not isinstance(node, (ast.Tuple, ast.List, ast.Set)):
+            raise ValueError(f"Invalid filter expression '{self.expression}' ('in' requires a tuple, list or set of "
+                             f"numbers)")
+        values = []
+        for element in node.elts:
+            sign = 1
+            if isinstance(element, ast.UnaryOp) and isinstance(element.op, ast.USub):
+                sign, element = -1, element.operand
+            if not isinstance(element, ast.Constant) or not isinstance(element.value, (bool, int, float)):
+                raise self._invalid(element)
+            values.append(sign * element.value)
+        return np.array(values)
+
+    def _invalid(self, node: ast.AST) -> ValueError:
+        return ValueError(f"Invalid filter expression '{self.expression}' ({type(node).__name__} is not allowed)")
+
+
+# Filter expression or scalar field identifier and truth function (see `DeSpAn.geometry.PointCloudData.filter`)
+FilterFunction = PointFilter | Tuple[str, Callable[[np.ndarray], np.ndarray[Any, np.dtype[bool]]]]
+
+
+def _chained_comparison(functions: list[Callable], operands: list) -> Any:
+    # a < b < c is evaluated as (a < b) and (b < c)
+    return reduce(np.logical_and, [function(left, right) for function, left, right in
+                                   zip(functions, operands[:-1], operands[1:])])
+
+
+def filter_dimensions(filter_functions: Iterable[FilterFunction]) -> list[str]:
+    """
+    Dimensions needed to evaluate filters.
+
+    Parameters
+    ----------
+    filter_functions : Iterable[PointFilter or tuple[str, func]]
+        Filter expressions or scalar field identifiers and truth functions (see
+        `DeSpAn.geometry.PointCloudData.filter`).
+
+    Returns
+    -------
+    dimensions : list[str]
+    """
+    dimensions = []
+    for point_filter in filter_functions:
+        dimensions.extend(point_filter.dimensions if isinstance(point_filter, PointFilter) else [point_filter[0]])
+    return list(dict.fromkeys(dimensions))
+
+
+def filter_mask(filter_functions: Iterable[FilterFunction], columns: Mapping[str, np.ndarray],
+                nb_points: int) -> np.ndarray:
+    """
+    Combined mask of filters (all of them have to hold).
+
+    Parameters
+    ----------
+    filter_functions : Iterable[PointFilter or tuple[str, func]]
+        See `filter_dimensions`.
+    columns : Mapping[str, np.ndarray]
+        Values of the dimensions of the filters.
+    nb_points : int
+
+    Returns
+    -------
+    mask : np.ndarray
+    """
+    mask = np.ones((nb_points,), dtype=bool)
+    for point_filter in filter_functions:
+        if isinstance(point_filter, PointFilter):
+            mask &= point_filter(columns)
+        else:
+            sf_filter, truth_func = point_filter
+            mask &= truth_func(columns[sf_filter])
+    return mask
+
+
+def filter_description(filter_functions: Iterable[FilterFunction]) -> list:
+    """
+    Stable description of filters (e.g. for cache keys): the expressions and, for truth functions, the scalar field
+    and the `repr` of the function.
+
+    Parameters
+    ----------
+    filter_functions : Iterable[PointFilter or tuple[str, func]]
+
+    Returns
+    -------
+    description : list
+    """
+    return [point_filter.expression if isinstance(point_filter, PointFilter) else
+            [point_filter[0], repr(point_filter[1])] for point_filter in filter_functions]
@@ -1,10 +1,24 @@
 from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
 from dataclasses import dataclass, field
 from itertools import compress
 import gc
-from typing import Iterable, Callable, Any, Tuple
+import os
+from pathlib import Path
+from typing import Iterable, Iterator, Callable, Any, Tuple
+import uuid
 
 import numpy as np
+from scipy.spatial import cKDTree
+import shapely
+from shapely.geometry import MultiPolygon, Polygon
+
+
+MEMMAP_CHUNK_SIZE = 10_000_000  # Points per chunk when processing memory-mapped point clouds
+INT32_LIMIT = np.iinfo(np.int32).max
+SUBSAMPLE_MODES = ["voxel_centroid", "voxel_nearest", "spacing"]
+# Arrays that are gathered when pending reductions are applied (see `PointCloudData.defer_reductions`)
+_DEFERRED_ATTRIBUTES = frozenset(["xyz", "color", "normals", "scalar_fields"])
 
 
 @dataclass(frozen=True)
@@ -16,17 +30,39 @@ class PointCloudData:
     Attributes
     ----------
     xyz : np.ndarray
-        nx3 float array with the *x*, *y* and *z* coordinates of the cloud.
+        nx3 float array with the *x*, *y* and *z* coordinates of the cloud. For compact point clouds (see `compact`)
+        the coordinates relative to `origin` (float32) or in units of `scale` (int32), use `coordinates` for the world
+        coordinates.
     color : np.ndarray
         nx3 uint8 array of *r*, *g* and *b* colors.
     normals : np.ndarray
+    scalar_fields : dict[str, np.ndarray]
+    storage_dir : pathlib.Path, optional
+        Directory of the memory-mapped arrays of an out-of-core point cloud. The arrays can be (read-only) memmaps of
+        any *npy* files, but the reduced arrays (`filter`, `box_cut`, `polygon_crop`) are written chunk by chunk to new
+        memmaps in `storage_dir` instead of RAM.
+    origin : np.ndarray, optional
+        Origin of the local coordinates of a compact point cloud.
+    scale : np.ndarray, optional
+        Scale of the (integer) local coordinates of a compact point cloud.
 
+    Notes
+    -----
+    The spatial index (see `spatial_index`) is built on the first query and discarded whenever the points change.
+    With `defer_reductions`, filters, cuts and crops only compose the selection of the points, which is applied to
+    all arrays once when they are accessed.
     """
 
     xyz: np.ndarray
     color: np.ndarray = None
     normals: np.ndarray = None
     scalar_fields: dict[str, np.ndarray] = field(default_factory=dict)
+    storage_dir: Path = field(default=None, compare=False)
+    origin: np.ndarray = field(default=None, compare=False)
+    scale: np.ndarray = field(default=None, compare=False)
+    _spatial_index: "GridIndex" = field(default=None, init=False, repr=False, compare=False)
+    _deferred: bool = field(default=False, init=False, repr=False, compare=False)
+    _selection: np.ndarray = field(default=None, init=False, repr=False, compare=False)
 
     def __post_init__(self) -> None:
         """
@@ -49,10 +85,232 @@ class PointCloudData:
         for sf in self.scalar_fields.values():
             assert sf.shape == (nb_pts,)
 
+        # Check the local frame
+        assert self.origin is None or self.origin.shape == (3,)
+        assert (self.scale is None) == (not np.issubdtype(self.xyz.dtype, np.integer))
+        assert self.scale is None or (self.origin is not None and self.scale.shape == (3,))
+
     def __repr__(self) -> str:
-        return f"Point cloud with {self.xyz.shape[0]:,d} point(s)"
+        return f"Point cloud with {self.nb_points:,d} point(s)"
+
+    @property
+    def nb_points(self) -> int:
+        """
+        Number of points (without applying pending reductions).
+        """
+        if self._selection is not None:
+            return self._selection.shape[0]
+        return self._xyz.shape[0]
+
+    def defer_reductions(self, enabled: bool = True) -> None:
+        """
+        Defers the reductions of the point cloud (`filter`, `box_cut`, `polygon_crop`).
+
+        The deferred reductions are evaluated on the needed columns only (e.g. the scalar field of a filter) and
+        compose a single selection of the points. The arrays are gathered once when they are accessed (see
+        `materialize`), while `select`, `chunks` and `DeSpAn.data_io.save_ply` gather the selected points only. Pending
+        reductions are not thread-safe, i.e. materialize the point cloud before sharing it between threads.
+
+        Parameters
+        ----------
+        enabled : bool, default=True
+            `False` applies the pending reductions and reduces the point cloud immediately again.
+        """
+        object.__setattr__(self, "_deferred", enabled)
+        if not enabled:
+            self.materialize()
+
+    def materialize(self) -> None:
+        """
+        Applies the pending reductions (see `defer_reductions`) to all arrays.
+        """
+        selection = self._selection
+        if selection is None:
+            return
+        object.__setattr__(self, "_selection", None)
+        deferred = self._deferred
+        object.__setattr__(self, "_deferred", False)
+        try:
+            if self.storage_dir is not None:
+                # The memmaps are reduced with a boolean mask
+                mask = np.zeros((self.xyz.shape[0],), dtype=bool)
+                mask[selection] = True
+                selection = mask
+            self._reduce_points_to(selection)
+        finally:
+            object.__setattr__(self, "_deferred", deferred)
+
+    @classmethod
+    def empty(cls, nb_points: int, color: bool = False, normals: bool = False,
+              scalar_fields: dict[str, np.dtype] = None, storage_dir: Path = None, xyz_dtype: np.dtype = float,
+              origin: np.ndarray = None, scale: np.ndarray = None) -> "PointCloudData":
+        """
+        Allocates an uninitialised point cloud (memory-mapped if `storage_dir` is given).
+
+        Parameters
+        ----------
+        nb_points : int
+        color : bool, default=False
+            Allocate a nx3 uint8 color array.
+        normals : bool, default=False
+            Allocate a nx3 float normals array.
+        scalar_fields : dict[str, np.dtype], optional
+            Scalar fields (and their dtypes) to allocate.
+        storage_dir : pathlib.Path, optional
+            Allocate the arrays as memmaps in this directory (see `allocate_array`).
+        xyz_dtype : np.dtype, default=float
+        origin : np.ndarray, optional
+            Local frame of compact point clouds (see `compact`).
+        scale : np.ndarray, optional
+
+        Returns
+        -------
+        pcd : DeSpAn.geometry.PointCloudData
+        """
+        scalar_fields = dict() if scalar_fields is None else scalar_fields
+        return cls(allocate_array((nb_points, 3,), xyz_dtype, storage_dir),
+                   color=allocate_array((nb_points, 3,), np.uint8, storage_dir) if color else None,
+                   normals=allocate_array((nb_points, 3,), float, storage_dir) if normals else None,
+                   scalar_fields={sf: allocate_array((nb_points,), dtype, storage_dir)
+                                  for sf, dtype in scalar_fields.items()},
+                   storage_dir=storage_dir, origin=origin, scale=scale)
+
+    def coordinates(self, index: slice | np.ndarray = slice(None)) -> np.ndarray:
+        """
+        World coordinates of (a selection of) the points.
+
+        Parameters
+        ----------
+        index : slice or np.ndarray, default=slice(None)
+            Rows to select.
+
+        Returns
+        -------
+        xyz : np.ndarray
+            nx3 float array (the array `xyz` itself for point clouds that are not compact).
+        """
+        xyz = self.xyz[index]
+        if self.origin is None:
+            return xyz
+        if self.scale is not None:
+            return xyz * self.scale + self.origin
+        return xyz.astype(float) + self.origin
+
+    def to_local(self, xyz: np.ndarray) -> np.ndarray:
+        """
+        Transforms world coordinates (nx3 or nx2) into the (float) local frame of `xyz`.
+        """
+        xyz = np.asarray(xyz, dtype=float)
+        if self.origin is None:
+            return xyz
+        dim = xyz.shape[-1]
+        local = xyz - self.origin[:dim]
+        return local if self.scale is None else local / self.scale[:dim]
+
+    def to_world(self, xyz: np.ndarray) -> np.ndarray:
+        """
+        Transforms local coordinates (nx3 or nx2) into world coordinates.
+        """
+        xyz = np.asarray(xyz, dtype=float)
+        if self.origin is None:
+            return xyz
+        dim = xyz.shape[-1]
+        return (xyz if self.scale is None else xyz * self.scale[:dim]) + self.origin[:dim]
+
+    def bounds(self) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Minimum and maximum corner of the bounding box (world coordinates).
+        """
+        if self._spatial_index is not None:
+            return (self.to_world(self._spatial_index.minimum_corner),
+                    self.to_world(self._spatial_index.maximum_corner))
+        return (self.to_world(np.amin(self.xyz, axis=0).astype(float)),
+                self.to_world(np.amax(self.xyz, axis=0).astype(float)))
+
+    def compact(self, origin: np.ndarray = None, scale: float | np.ndarray = None) -> None:
+        """
+        Stores the coordinates relative to `origin`, either as float32 or as int32 in units of `scale` (similar to the
+        scaled integer coordinates of *las* files), which halves the memory of `xyz`.
+
+        The precision loss is bounded by half a unit in the last place of float32, i.e. by 2**-24 times the largest
+        distance to `origin` (0.06 mm within 1 km, 0.5 mm within 8 km), or by `scale / 2` for int32 with a range of
+        +-2**31 * `scale` around `origin`. Filters, cuts, crops, merges and `DeSpAn.data_io.save_ply` work on the compact
+        coordinates directly.
+
+        Parameters
+        ----------
+        origin : np.ndarray, optional
+            Defaults to the center of the bounding box (rounded to integers).
+        scale : float or np.ndarray, optional
+            Store int32 coordinates in units of `scale`. `None` stores float32 coordinates.
+        """
+        if origin is None:
+            minimum_corner, maximum_corner = self.bounds()
+            origin = np.round((minimum_corner + maximum_corner) / 2)
+        origin = np.asarray(origin, dtype=float)
+        scale = None if scale is None else np.broadcast_to(np.asarray(scale, dtype=float), (3,)).copy()
+
+        xyz = allocate_array(self.xyz.shape, np.float32 if scale is None else np.int32, self.storage_dir)
+        for start in range(0, self.xyz.shape[0], MEMMAP_CHUNK_SIZE):
+            chunk = slice(start, start + MEMMAP_CHUNK_SIZE)
+            xyz[chunk] = coordinates_in_frame(self.coordinates(chunk), origin, scale)
+        object.__setattr__(self, "xyz", xyz)
+        object.__setattr__(self, "origin", origin)
+        object.__setattr__(self, "scale", scale)
+        object.__setattr__(self, "_spatial_index", None)
+
+    def spatial_index(self) -> "GridIndex":
+        """
+        Spatial index of the points (built on the first call and reused until the points change).
+
+        Once built, `box_cut`, `polygon_crop`, `polygon_mask` and `bounds` use the index instead of scanning all points.
+        The index holds two integers per point (the points sorted by grid cell) in memory, also for memory-mapped
+        point clouds.
+
+        Returns
+        -------
+        index : DeSpAn.geometry.GridIndex
+            Grid in the local frame of `xyz`.
+        """
+        if self._spatial_index is None:
+            object.__setattr__(self, "_spatial_index", GridIndex(self.xyz))
+        return self._spatial_index
+
+    def _truncate(self, nb_points: int) -> None:
+        object.__setattr__(self, "_spatial_index", None)
+        if self.storage_dir is not None:
+            # Memmaps cannot be resized, the unused end of the files is left in place
+            object.__setattr__(self, "xyz", self.xyz[:nb_points])
+            if self.color is not None:
+                object.__setattr__(self, "color", self.color[:nb_points])
+            if self.normals is not None:
+                object.__setattr__(self, "normals", self.normals[:nb_points])
+            for sf_key in self.scalar_fields.keys():
+                self.scalar_fields[sf_key] = self.scalar_fields[sf_key][:nb_points]
+            return
+
+        if nb_points == self.xyz.shape[0]:
+            return
+        # Copies of the retained points, views of the allocated arrays (e.g. held by callers) stay valid
+        object.__setattr__(self, "xyz", self.xyz[:nb_points].copy())
+        if self.color is not None:
+            object.__setattr__(self, "color", self.color[:nb_points].copy())
+        if self.normals is not None:
+            object.__setattr__(self, "normals", self.normals[:nb_points].copy())
+        for sf_key in self.scalar_fields.keys():
+            self.scalar_fields[sf_key] = self.scalar_fields[sf_key][:nb_points].copy()
 
     def _reduce_points_to(self, mask: np.ndarray) -> None:
+        object.__setattr__(self, "_spatial_index", None)
+        if self._deferred:
+            selection = np.flatnonzero(mask) if self._selection is None else self._selection[mask]
+            object.__setattr__(self, "_selection", selection)
+            return
+
+        if self.storage_dir is not None:
+            self._reduce_memmaps_to(mask)
+            return
+
         object.__setattr__(self, "xyz", self.xyz[mask])
         if self.color is not None:
             object.__setattr__(self, "color", self.color[mask])
@@ -61,11 +319,75 @@ class PointCloudData:
         for sf_key in self.scalar_fields.keys():
             self.scalar_fields[sf_key] = self.scalar_fields[sf_key][mask]
 
+    def _reduce_memmaps_to(self, mask: np.ndarray) -> None:
+        # Copies the selected points chunk by chunk into new memmaps (boolean masks only, to keep the point order)
+        nb_points = int(np.count_nonzero(mask))
+        object.__setattr__(self, "xyz", _reduce_array(self.xyz, mask, nb_points, self.storage_dir))
+        if self.color is not None:
+            object.__setattr__(self, "color", _reduce_array(self.color, mask, nb_points, self.storage_dir))
+        if self.normals is not None:
+            object.__setattr__(self, "normals", _reduce_array(self.normals, mask, nb_points, self.storage_dir))
+        for sf_key in self.scalar_fields.keys():
+            self.scalar_fields[sf_key] = _reduce_array(self.scalar_fields[sf_key], mask, nb_points, self.storage_dir)
+
+    def _chunked_mask(self, mask_func: Callable[[slice | np.ndarray], np.ndarray]) -> np.ndarray:
+        # Evaluates a mask in chunks of points, hence the temporaries of memmaps (and of the gathered columns of
+        # deferred reductions) stay small. `mask_func` gets the rows of the stored arrays.
+        nb_points = self.nb_points
+        selection = self._selection
+        if self.storage_dir is None and selection is None:
+            return mask_func(slice(0, nb_points))
+        mask = np.empty((nb_points,), dtype=bool)
+        for start in range(0, nb_points, MEMMAP_CHUNK_SIZE):
+            chunk = slice(start, start + MEMMAP_CHUNK_SIZE)
+            mask[chunk] = mask_func(chunk if selection is None else selection[chunk])
+        return mask
+
     # def copy(self) -> PointCloudData:
     #     xyz = self.xyz.copy()
 
     #    return PointCloudData(self.xyz.copy())
 
+    def select(self, mask: np.ndarray) -> "PointCloudData":
+        """
+        Returns a new point cloud with the selected points (the point cloud itself is not changed). The selected points
+        are always held in memory, also for memory-mapped point clouds (except for slices, which are views), and
+        pending reductions (see `defer_reductions`) are only applied to the selected points.
+
+        Parameters
+        ----------
+        mask : np.ndarray
+            Boolean mask or indices of the points to select.
+
+        Returns
+        -------
+        pcd : DeSpAn.geometry.PointCloudData
+        """
+        if self._selection is not None:
+            mask = self._selection[mask]
+        return PointCloudData(self._xyz[mask],
+                              color=None if self._color is None else self._color[mask],
+                              normals=None if self._normals is None else self._normals[mask],
+                              scalar_fields={sf_key: sf[mask] for sf_key, sf in self._scalar_fields.items()},
+                              origin=self.origin, scale=self.scale)
+
+    def chunks(self, chunk_size: int) -> Iterator["PointCloudData"]:
+        """
+        Consecutive chunks of the points (see `select`), e.g. to write a point cloud without gathering pending
+        reductions as a whole.
+
+        Parameters
+        ----------
+        chunk_size : int
+            Number of points per chunk.
+
+        Yields
+        ------
+        pcd : DeSpAn.geometry.PointCloudData
+        """
+        for start in range(0, self.nb_points, chunk_size):
+            yield self.select(slice(start, start + chunk_size))
+
     def filter(self, sf_filter: str, truth_func: Callable[[np.ndarray], np.ndarray[Any, np.dtype[bool]]]) -> None:
         """
         Filters the point cloud based on the function.
@@ -77,8 +399,9 @@ class PointCloudData:
         truth_func
             Callable that takes a number and returns a `bool`
         """
-        if sf_filter in self.scalar_fields.keys():
-            filter_mask = truth_func(self.scalar_fields[sf_filter])
+        scalar_fields = self._scalar_fields
+        if sf_filter in scalar_fields.keys():
+            filter_mask = self._chunked_mask(lambda rows: truth_func(scalar_fields[sf_filter][rows]))
             self._reduce_points_to(filter_mask)
 
     def box_cut(self, minimum_corner: Tuple[float, float, float], maximum_corner: Tuple[float, float, float]) -> None:
@@ -90,21 +413,801 @@ class PointCloudData:
         minimum_corner[span == 0] = -np.inf
         maximum_corner[span == 0] = np.inf
 
-        mask = np.logical_and(np.all(self.xyz >= minimum_corner, axis=1),
-                              np.all(self.xyz <= maximum_corner, axis=1))
+        if self.origin is not None:
+            # Compared in the local frame, the tolerance absorbs the rounding of the transformation (e.g. of corners
+            # from `bounds`)
+            minimum_corner = self.to_local(minimum_corner) - 1e-6
+            maximum_corner = self.to_local(maximum_corner) + 1e-6
+
+        if self._spatial_index is not None:
+            candidates = self._spatial_index.points_in_box(minimum_corner[:2], maximum_corner[:2])
+            mask = np.zeros((self.nb_points,), dtype=bool)
+            mask[candidates[points_in_box(self.xyz[candidates], minimum_corner, maximum_corner)]] = True
+        else:
+            xyz = self._xyz
+            mask = self._chunked_mask(lambda rows: points_in_box(xyz[rows], minimum_corner, maximum_corner))
         self._reduce_points_to(mask)
 
+    def polygon_crop(self, polygon: Polygon | MultiPolygon, nb_cells: int = 65536) -> None:
+        """
+        Reduces the point cloud to the points within the polygon (in the *xy*-plane).
+
+        Parameters
+        ----------
+        polygon : shapely.geometry.Polygon or shapely.geometry.MultiPolygon
+        nb_cells : int, default=65536
+            Approximate number of grid cells for the prefilter (see `points_in_polygon`).
+        """
+        self._reduce_points_to(self.polygon_mask(polygon, nb_cells=nb_cells))
+
+    def polygon_mask(self, polygon: Polygon | MultiPolygon, nb_cells: int = 65536) -> np.ndarray:
+        """
+        Mask of the points within the polygon (in the *xy*-plane), see `points_in_polygon`.
 
-def merge_pcd(pcds: Iterable[PointCloudData]) -> PointCloudData:
+        Parameters
+        ----------
+        polygon : shapely.geometry.Polygon or shapely.geometry.MultiPolygon
+            Polygon in world coordinates (transformed into the local frame of compact point clouds).
+        nb_cells : int, default=65536
+
+        Returns
+        -------
+        mask : np.ndarray
+        """
+        if self.origin is not None:
+            polygon = shapely.transform(polygon, self.to_local)
+        if self._spatial_index is not None:
+            mask = np.zeros((self.nb_points,), dtype=bool)
+            mask[self._polygon_indices(polygon)] = True
+            return mask
+        xyz = self._xyz
+        return self._chunked_mask(lambda rows: points_in_polygon(xyz[rows, 0], xyz[rows, 1], polygon,
+                                                                 nb_cells=nb_cells))
+
+    def _polygon_indices(self, polygon: Polygon | MultiPolygon) -> np.ndarray:
+        # Polygon in the local frame, only the points of the cells along its boundary are tested exactly
+        inside, boundary = self.spatial_index().points_in_polygon(polygon)
+        if boundary.size:
+            polygon = shapely.from_wkb(shapely.to_wkb(polygon))
+            shapely.prepare(polygon)
+            boundary = boundary[shapely.contains_xy(polygon, self.xyz[boundary, 0], self.xyz[boundary, 1])]
+        return np.sort(np.concatenate((inside, boundary)))
+
+    def box_query(self, minimum_corner: Tuple[float, float, float],
+                  maximum_corner: Tuple[float, float, float]) -> np.ndarray:
+        """
+        Points within an axis-aligned box (see `spatial_index`).
+
+        Parameters
+        ----------
+        minimum_corner : Tuple[float, float, float]
+            World coordinates, use `-np.inf` (`np.inf`) to leave an axis unbounded.
+        maximum_corner : Tuple[float, float, float]
+
+        Returns
+        -------
+        indices : np.ndarray
+            Sorted indices of the points.
+        """
+        minimum_corner = np.asarray(minimum_corner, dtype=float)
+        maximum_corner = np.asarray(maximum_corner, dtype=float)
+        candidates = self.spatial_index().points_in_box(self.to_local(minimum_corner[:2]) - 1e-6,
+                                                        self.to_local(maximum_corner[:2]) + 1e-6)
+        return np.sort(candidates[points_in_box(self.coordinates(candidates), minimum_corner, maximum_corner)])
+
+    def polygon_query(self, polygon: Polygon | MultiPolygon) -> np.ndarray:
+        """
+        Points within a polygon in the *xy*-plane (see `spatial_index`).
+
+        Parameters
+        ----------
+        polygon : shapely.geometry.Polygon or shapely.geometry.MultiPolygon
+            Polygon in world coordinates.
+
+        Returns
+        -------
+        indices : np.ndarray
+            Sorted indices of the points.
+        """
+        if self.origin is not None:
+            polygon = shapely.transform(polygon, self.to_local)
+        return self._polygon_indices(polygon)
+
+    def radius_query(self, center: Tuple[float, float, float], radius: float) -> np.ndarray:
+        """
+        Points within a sphere (see `spatial_index`).
+
+        Parameters
+        ----------
+        center : Tuple[float, float, float]
+            World coordinates.
+        radius : float
+
+        Returns
+        -------
+        indices : np.ndarray
+            Sorted indices of the points.
+        """
+        center = np.asarray(center, dtype=float)
+        candidates = self._disc_candidates(center[:2], radius)
+        distances = np.sum((self.coordinates(candidates) - center) ** 2, axis=1)
+        return np.sort(candidates[distances <= radius ** 2])
+
+    def cylinder_query(self, center: Tuple[float, float], radius: float, z_min: float = -np.inf,
+                       z_max: float = np.inf) -> np.ndarray:
+        """
+        Points within a vertical cylinder (see `spatial_index`).
+
+        Parameters
+        ----------
+        center : Tuple[float, float]
+            World coordinates of the axis in the *xy*-plane.
+        radius : float
+        z_min : float, default=-np.inf
+            Bottom of the cylinder.
+        z_max : float, default=np.inf
+            Top of the cylinder.
+
+        Returns
+        -------
+        indices : np.ndarray
+            Sorted indices of the points.
+        """
+        center = np.asarray(center, dtype=float)[:2]
+        candidates = self._disc_candidates(center, radius)
+        xyz = self.coordinates(candidates)
+        inside = np.sum((xyz[:, :2] - center) ** 2, axis=1) <= radius ** 2
+        inside &= xyz[:, 2] >= z_min
+        inside &= xyz[:, 2] <= z_max
+        return np.sort(candidates[inside])
+
+    def _disc_candidates(self, center: np.ndarray, radius: float) -> np.ndarray:
+        return self.spatial_index().points_in_box(self.to_local(center - radius) - 1e-6,
+                                                  self.to_local(center + radius) + 1e-6)
+
+    def subsample(self, mode: str, size: float) -> "PointCloudData":
+        """
+        Returns a subsampled point cloud, e.g. as M3C2 core points (the point cloud itself is not changed).
+
+        Parameters
+        ----------
+        mode : str
+            *voxel_centroid*: centroid of the points of each voxel, with averaged normals and float scalar fields
+            (colors and other scalar fields of the point nearest to the centroid). *voxel_nearest*: point nearest to
+            the centroid of each voxel. *spacing*: points with a minimum distance of `size` to each other (see
+            `spacing_subsample`).
+        size : float
+            Edge length of the voxels or minimum spacing.
+
+        Returns
+        -------
+        pcd : DeSpAn.geometry.PointCloudData
+            Same local frame as the point cloud (see `compact`).
+        """
+        if mode not in SUBSAMPLE_MODES:
+            raise ValueError(f"Unknown subsample mode '{mode}' ({', '.join(SUBSAMPLE_MODES)})")
+        if size <= 0:
+            raise ValueError(f"Subsample size must be positive ({size})")
+
+        # Relative to the minimum corner, so that the sums of the centroids do not lose precision
+        xyz = self.coordinates()
+        reference = np.min(xyz, axis=0) if xyz.shape[0] else np.zeros((3,))
+        xyz = xyz - reference
+
+        if mode == "spacing":
+            return self.select(spacing_subsample(xyz, size))
+
+        order, starts = voxel_groups(xyz, size)
+        nearest, centroids = _nearest_to_centroids(xyz, order, starts)
+        # In the original order of the points
+        rank = np.argsort(nearest, kind="stable")
+        pcd = self.select(nearest[rank])
+        if mode == "voxel_nearest":
+            return pcd
+
+        counts = np.diff(np.append(starts, xyz.shape[0]))[rank, np.newaxis]
+        normals = None
+        if self.normals is not None:
+            normals = np.add.reduceat(self.normals[order], starts, axis=0)[rank] / counts
+            normals /= np.maximum(np.linalg.norm(normals, axis=1, keepdims=True), np.finfo(float).tiny)
+        scalar_fields = {sf: (np.add.reduceat(values[order], starts, dtype=float)[rank] / counts[:, 0]
+                              if np.issubdtype(values.dtype, np.floating) else pcd.scalar_fields[sf])
+                         for sf, values in self.scalar_fields.items()}
+        pcd = PointCloudData(centroids[rank] + reference, color=pcd.color, normals=normals,
+                             scalar_fields=scalar_fields)
+        if self.origin is not None:
+            pcd.compact(self.origin, scale=self.scale)
+        return pcd
+
+    def estimate_normals(self, scales: float | Iterable[float],
+                         orientation: Tuple[float, float, float] = (0.0, 0.0, 1.0), block_size: int = 50_000,
+                         nb_threads: int = 1) -> None:
+        """
+        Estimates the normals from the neighbourhoods of the points and stores them in `normals` (e.g. to save them
+        with the point cloud and reuse them for M3C2, see `DeSpAn.m3c2.M3C2Parameters`).
+
+        The points are processed in blocks of `block_size` points by `nb_threads` threads, each block with a radius
+        query and the batched eigen-decomposition of the neighbourhood covariances (see `neighbourhood_normals`).
+        Points with fewer than three neighbours at all scales get *nan* normals.
+
+        Parameters
+        ----------
+        scales : float or Iterable[float]
+            Diameters of the neighbourhoods. For multiple scales the most planar neighbourhood is chosen per point.
+        orientation : Tuple[float, float, float], default=(0.0, 0.0, 1.0)
+            The normals are flipped to point along this direction (upward for terrain). `None` keeps the signs of the
+            eigenvectors.
+        block_size : int, default=50_000
+        nb_threads : int, default=1
+        """
+        scales = np.atleast_1d(np.asarray(scales, dtype=float))
+        if scales.size == 0 or np.any(scales <= 0):
+            raise ValueError(f"Normal scales must be positive ({scales})")
+
+        # Relative to the mean, so that the covariances do not lose precision
+        xyz = self.coordinates()
+        xyz = xyz - (np.mean(xyz, axis=0) if xyz.shape[0] else np.zeros((3,)))
+        tree = cKDTree(xyz)
+        normals = allocate_array(xyz.shape, float, self.storage_dir)
+
+        def process_block(block: slice) -> None:
+            block_normals = neighbourhood_normals(tree, xyz, xyz[block], scales)
+            if orientation is not None:
+                block_normals[block_normals @ np.asarray(orientation, dtype=float) < 0] *= -1
+            normals[block] = block_normals
+
+        with ThreadPoolExecutor(max_workers=max(nb_threads, 1)) as executor:
+            list(executor.map(process_block, [slice(start, start + block_size)
+                                              for start in range(0, xyz.shape[0], block_size)]))
+        object.__setattr__(self, "normals", normals)
+
+
+def _point_array(name: str) -> property:
+    # The arrays are stored as `_<name>`, reading them applies the pending reductions (see `defer_reductions`). The
+    # dataclass fields are set through the setter (`object.__setattr__`), assignments are rejected as for any frozen
+    # dataclass.
+    attribute = f"_{name}"
+
+    def get(self: PointCloudData) -> Any:
+        if self._selection is not None:
+            self.materialize()
+        return getattr(self, attribute)
+
+    def set(self: PointCloudData, value: Any) -> None:
+        object.__setattr__(self, attribute, value)
+
+    return property(get, set)
+
+
+for _name in _DEFERRED_ATTRIBUTES:
+    setattr(PointCloudData, _name, _point_array(_name))
+
+
+def coordinates_in_frame(xyz: np.ndarray, origin: np.ndarray = None, scale: np.ndarray = None) -> np.ndarray:
+    """
+    Transforms world coordinates into a local frame.
+
+    Parameters
+    ----------
+    xyz : np.ndarray
+        nx3 float array of world coordinates.
+    origin : np.ndarray, optional
+        `None` returns `xyz` itself.
+    scale : np.ndarray, optional
+        `None` returns float32 coordinates relative to `origin`, otherwise int32 coordinates in units of `scale`.
+
+    Returns
+    -------
+    xyz : np.ndarray
+    """
+    if origin is None:
+        return xyz
+    local = xyz - origin
+    if scale is None:
+        return local.astype(np.float32)
+    local = np.round(local / scale)
+    if local.size and np.amax(np.abs(local)) > INT32_LIMIT:
+        raise ValueError(f"Coordinates exceed the int32 range of the scale {scale} around {origin}.")
+    return local.astype(np.int32)
+
+
+def _xyz_in_frame(pcd: PointCloudData, origin: np.ndarray = None, scale: np.ndarray = None) -> np.ndarray:
+    """
+    Coordinates of `pcd` in the given frame (`pcd.xyz` itself if it already is in that frame).
+    """
+    same_origin = (origin is None and pcd.origin is None) or (origin is not None and pcd.origin is not None and
+                                                              np.array_equal(origin, pcd.origin))
+    same_scale = (scale is None and pcd.scale is None) or (scale is not None and pcd.scale is not None and
+                                                           np.array_equal(scale, pcd.scale))
+    if same_origin and same_scale:
+        return pcd.xyz
+    return coordinates_in_frame(pcd.coordinates(), origin, scale)
+
+
+def allocate_array(shape: tuple[int, ...], dtype: np.dtype, storage_dir: Path = None) -> np.ndarray:
+    """
+    Allocates an uninitialised array, either in memory or as memmap of a new *npy* file in `storage_dir`.
+
+    Parameters
+    ----------
+    shape : tuple[int, ...]
+    dtype : np.dtype
+    storage_dir : pathlib.Path, optional
+
+    Returns
+    -------
+    array : np.ndarray or np.memmap
+    """
+    if storage_dir is None:
+        return np.empty(shape, dtype=dtype)
+    Path(storage_dir).mkdir(parents=True, exist_ok=True)
+    return np.lib.format.open_memmap(Path(storage_dir) / f"{uuid.uuid4().hex}.npy", mode="w+", dtype=dtype,
+                                     shape=shape)
+
+
+def _reduce_array(array: np.ndarray, mask: np.ndarray, nb_points: int, storage_dir: Path) -> np.ndarray:
+    """
+    Copies the masked rows of `array` into a new memmap and removes the file of `array` if it is owned by
+    `storage_dir`.
+    """
+    reduced = allocate_array((nb_points,) + array.shape[1:], array.dtype, storage_dir)
+    offset = 0
+    for start in range(0, array.shape[0], MEMMAP_CHUNK_SIZE):
+        selected = array[start:start + MEMMAP_CHUNK_SIZE][mask[start:start + MEMMAP_CHUNK_SIZE]]
+        reduced[offset:offset + selected.shape[0]] = selected
+        offset += selected.shape[0]
+
+    filename = getattr(array, "filename", None)
+    if filename is not None and Path(filename).parent == Path(storage_dir).absolute():
+        del array
+        try:
+            os.remove(filename)
+        except OSError:
+            # Files that are still mapped cannot be removed on Windows
+            pass
+    return reduced
+
+
+def voxel_groups(xyz: np.ndarray, voxel_size: float) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Groups the points by voxel, by hashing the voxel indices to integer keys and sorting them once.
+
+    Parameters
+    ----------
+    xyz : np.ndarray
+        nx3 array of coordinates.
+    voxel_size : float
+
+    Returns
+    -------
+    order : np.ndarray
+        Indices of the points sorted by voxel (stable within each voxel).
+    starts : np.ndarray
+        Position in `order` of the first point of each voxel.
+    """
+    if xyz.shape[0] == 0:
+        return np.zeros((0,), dtype=np.intp), np.zeros((0,), dtype=np.intp)
+    indices = np.floor((xyz - np.min(xyz, axis=0)) / voxel_size).astype(np.int64)
+    extent = np.max(indices, axis=0) + 1
+    if np.prod(extent.astype(float)) < 2 ** 62:
+        keys = (indices[:, 0] * extent[1] + indices[:, 1]) * extent[2] + indices[:, 2]
+    else:
+        # Too many voxels for a single int64 key
+        keys = np.unique(indices, axis=0, return_inverse=True)[1].ravel()
+    del indices
+
+    order = np.argsort(keys, kind="stable")
+    keys = keys[order]
+    starts = np.flatnonzero(np.concatenate(([True], keys[1:] != keys[:-1])))
+    return order, starts
+
+
+def _nearest_to_centroids(xyz: np.ndarray, order: np.ndarray, starts: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Index of the point nearest to the centroid of each group (see `voxel_groups`) and the centroids.
+    """
+    sorted_xyz = xyz[order]
+    counts = np.diff(np.append(starts, xyz.shape[0]))
+    centroids = np.add.reduceat(sorted_xyz, starts, axis=0) / counts[:, np.newaxis] if starts.size else sorted_xyz
+    distances = np.sum((sorted_xyz - np.repeat(centroids, counts, axis=0)) ** 2, axis=1)
+    if not starts.size:
+        return order, centroids
+    # First point of each group with the minimum distance of its group
+    positions = np.flatnonzero(distances <= np.repeat(np.minimum.reduceat(distances, starts), counts))
+    groups = np.repeat(np.arange(starts.size), counts)[positions]
+    nearest = order[positions[np.concatenate(([True], groups[1:] != groups[:-1]))]]
+    return nearest, centroids
+
+
+def spacing_subsample(xyz: np.ndarray, spacing: float) -> np.ndarray:
+    """
+    Selects points with a minimum distance of `spacing` to each other.
+
+    The candidates are the points nearest to the centroids of voxels with the diagonal `spacing` (see `voxel_groups`).
+    The conflicts between neighbouring candidates are resolved in rounds: a candidate is kept if none of its remaining
+    neighbours within `spacing` precedes it (in voxel order), and the neighbours of the kept candidates are dropped.
+    This is the result of the greedy sequential selection, but vectorized per round.
+
+    Parameters
+    ----------
+    xyz : np.ndarray
+        nx3 array of coordinates.
+    spacing : float
+
+    Returns
+    -------
+    indices : np.ndarray
+        Sorted indices of the selected points.
+    """
+    order, starts = voxel_groups(xyz, spacing / np.sqrt(3))
+    candidates = _nearest_to_centroids(xyz, order, starts)[0]
+    if candidates.size < 2:
+        return np.sort(candidates)
+
+    pairs = cKDTree(xyz[candidates]).query_pairs(spacing, output_type="ndarray")
+    keep = np.zeros((candidates.size,), dtype=bool)
+    active = np.ones((candidates.size,), dtype=bool)
+    while pairs.shape[0]:
+        # Pairs are ordered (i < j), hence a candidate without a pair as second element has no preceding neighbour
+        selected = active.copy()
+        selected[pairs[:, 1]] = False
+        keep |= selected
+        active &= ~selected
+        active[pairs[selected[pairs[:, 0]], 1]] = False
+        pairs = pairs[active[pairs[:, 0]] & active[pairs[:, 1]]]
+    keep |= active
+    return np.sort(candidates[keep])
+
+
+def ball_neighbours(tree: cKDTree, centers: np.ndarray, radius: float) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Flattened result of a radius query: indices of the neighbours and the index of the corresponding center.
+
+    The pairs are found by a dual-tree traversal of a tree of the centers and `tree`, which returns them as arrays
+    (instead of a list per center as `cKDTree.query_ball_point`). The pairs are not ordered by center.
+    """
+    pairs = cKDTree(centers).sparse_distance_matrix(tree, radius, output_type="ndarray")
+    return pairs["j"].astype(np.intp), pairs["i"].astype(np.intp)
+
+
+def neighbourhood_normals(tree: cKDTree, xyz: np.ndarray, centers: np.ndarray, scales: np.ndarray) -> np.ndarray:
+    """
+    Normals from the batched eigen-decomposition of the neighbourhood covariances.
+
+    The covariances of all centers are accumulated with `np.bincount` over the flattened radius query and decomposed
+    at once with `np.linalg.eigh`. For multiple scales (diameters) the scale with the lowest surface variation (most
+    planar neighbourhood) is chosen per center, as the multi-scale mode of M3C2.
+
+    Parameters
+    ----------
+    tree : scipy.spatial.cKDTree
+        Tree of `xyz`.
+    xyz : np.ndarray
+        nx3 array of the neighbours.
+    centers : np.ndarray
+        mx3 array of the points to estimate the normals at.
+    scales : np.ndarray
+        Diameters of the neighbourhoods.
+
+    Returns
+    -------
+    normals : np.ndarray
+        mx3 array of unit normals (not oriented), *nan* for centers with fewer than three neighbours.
+    """
+    normals = np.full(centers.shape, np.nan)
+    best_variation = np.full((centers.shape[0],), np.inf)
+
+    for scale in scales:
+        indices, groups = ball_neighbours(tree, centers, scale / 2)
+        counts = np.bincount(groups, minlength=centers.shape[0])
+
+        neighbours = xyz[indices] - centers[groups]
+        mean = np.stack([np.bincount(groups, neighbours[:, i], centers.shape[0]) for i in range(3)], axis=1)
+        covariance = np.empty((centers.shape[0], 3, 3))
+        for i in range(3):
+            for j in range(i, 3):
+                covariance[:, i, j] = np.bincount(groups, neighbours[:, i] * neighbours[:, j], centers.shape[0])
+                covariance[:, j, i] = covariance[:, i, j]
+
+        valid = counts >= 3
+        mean[valid] /= counts[valid, np.newaxis]
+        covariance[valid] /= counts[valid, np.newaxis, np.newaxis]
+        covariance[valid] -= mean[valid, :, np.newaxis] * mean[valid, np.newaxis, :]
+
+        eigenvalues, eigenvectors = np.linalg.eigh(covariance[valid])
+        variation = eigenvalues[:, 0] / np.maximum(eigenvalues.sum(axis=1), np.finfo(float).tiny)
+
+        better = np.zeros_like(valid)
+        better[valid] = variation < best_variation[valid]
+        best_variation[better] = variation[better[valid]]
+        normals[better] = eigenvectors[better[valid], :, 0]
+
+    return normals
+
+
+class GridIndex:
+    """
+    Uniform grid over the *xy*-coordinates of a point cloud with the points sorted by cell, for box, polygon and
+    radius queries that only visit the points of the intersecting cells.
+
+    Only the occupied cells are stored (sorted cell keys and the offsets of their points), hence the memory does not
+    depend on the extent of the point cloud. The cell size is chosen for about `points_per_cell` points per occupied
+    cell, also for elongated or rotated point clouds (e.g. corridors) that occupy a small part of their bounding box.
+
+    Parameters
+    ----------
+    xyz : np.ndarray
+        nx3 array of coordinates (processed in chunks, memmaps stay on disk).
+    points_per_cell : int, default=64
+
+    Attributes
+    ----------
+    minimum_corner : np.ndarray
+        Minimum corner of the bounding box of the points (in the frame of `xyz`).
+    maximum_corner : np.ndarray
+    cell_size : float
+    nb_cells : np.ndarray
+        Number of cells along *x* and *y*.
+    order : np.ndarray
+        Indices of the points sorted by cell (stable within each cell).
+    keys : np.ndarray
+        Sorted keys (*x* index times the number of cells along *y* plus *y* index) of the occupied cells.
+    starts : np.ndarray
+        Position in `order` of the first point of each occupied cell, followed by the number of points.
+    """
+
+    def __init__(self, xyz: np.ndarray, points_per_cell: int = 64):
+        nb_points = xyz.shape[0]
+        self.minimum_corner = np.zeros((3,))
+        self.maximum_corner = np.zeros((3,))
+        if nb_points:
+            self.minimum_corner = np.amin([np.amin(xyz[start:start + MEMMAP_CHUNK_SIZE], axis=0)
+                                           for start in range(0, nb_points, MEMMAP_CHUNK_SIZE)], axis=0).astype(float)
+            self.maximum_corner = np.amax([np.amax(xyz[start:start + MEMMAP_CHUNK_SIZE], axis=0)
+                                           for start in range(0, nb_points, MEMMAP_CHUNK_SIZE)], axis=0).astype(float)
+
+        extent = self.maximum_corner[:2] - self.minimum_corner[:2]
+        nb_occupied = max(nb_points / points_per_cell, 1.0)
+        cell_size = max(np.sqrt(extent[0] * extent[1] / nb_occupied), np.max(extent) / nb_occupied,
+                        np.finfo(float).eps)
+        keys = self._cell_keys(xyz, cell_size)
+        # Refined once to the fraction of the bounding box that is occupied
+        nb_cells = int(np.prod(self.nb_cells))
+        occupied = np.count_nonzero(np.bincount(keys, minlength=nb_cells)) / nb_cells
+        if occupied < 0.5:
+            keys = self._cell_keys(xyz, max(cell_size * np.sqrt(occupied), np.finfo(float).eps))
+
+        self.order = np.argsort(keys, kind="stable")
+        keys = keys[self.order]
+        starts = np.flatnonzero(np.concatenate(([True], keys[1:] != keys[:-1]))) if nb_points else self.order
+        self.keys = keys[starts]
+        self.starts = np.append(starts, nb_points)
+
+    def _cell_keys(self, xyz: np.ndarray, cell_size: float) -> np.ndarray:
+        self.cell_size = cell_size
+        self.nb_cells = np.floor((self.maximum_corner[:2] - self.minimum_corner[:2]) / cell_size).astype(np.int64) + 1
+        keys = np.empty((xyz.shape[0],), dtype=np.int64)
+        for start in range(0, xyz.shape[0], MEMMAP_CHUNK_SIZE):
+            cells = self.cells(xyz[start:start + MEMMAP_CHUNK_SIZE, :2])
+            keys[start:start + MEMMAP_CHUNK_SIZE] = cells[:, 0] * self.nb_cells[1] + cells[:, 1]
+        return keys
+
+    def cells(self, xy: np.ndarray) -> np.ndarray:
+        """
+        Cell indices (nx2, clipped to the grid) of *xy*-coordinates.
+        """
+        cells = np.floor((np.asarray(xy, dtype=float) - self.minimum_corner[:2]) / self.cell_size)
+        return np.clip(cells, 0, self.nb_cells - 1).astype(np.int64)
+
+    def cells_in_box(self, minimum_xy: np.ndarray, maximum_xy: np.ndarray) -> np.ndarray:
+        """
+        Occupied cells (positions in `keys`) that intersect a rectangle in the *xy*-plane.
+
+        Parameters
+        ----------
+        minimum_xy : np.ndarray
+        maximum_xy : np.ndarray
+
+        Returns
+        -------
+        cells : np.ndarray
+        """
+        if (not self.keys.size or np.any(np.asarray(maximum_xy) < self.minimum_corner[:2]) or
+                np.any(np.asarray(minimum_xy) > self.maximum_corner[:2])):
+            return np.zeros((0,), dtype=np.intp)
+        minimum_cell, maximum_cell = self.cells([minimum_xy, maximum_xy])
+        # The cells of a column are consecutive keys
+        columns = np.arange(minimum_cell[0], maximum_cell[0] + 1, dtype=np.int64) * self.nb_cells[1]
+        return _concatenate_ranges(np.searchsorted(self.keys, columns + minimum_cell[1], side="left"),
+                                   np.searchsorted(self.keys, columns + maximum_cell[1], side="right"))
+
+    def points(self, cells: np.ndarray) -> np.ndarray:
+        """
+        Indices of the points of occupied cells (positions in `keys`).
+        """
+        return self.order[_concatenate_ranges(self.starts[cells], self.starts[cells + 1])]
+
+    def points_in_box(self, minimum_xy: np.ndarray, maximum_xy: np.ndarray) -> np.ndarray:
+        """
+        Indices of the points of the cells that intersect a rectangle in the *xy*-plane, i.e. candidates that contain
+        all points within the rectangle.
+        """
+        return self.points(self.cells_in_box(minimum_xy, maximum_xy))
+
+    def points_in_polygon(self, polygon: Polygon | MultiPolygon) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Classifies the points of the cells that intersect a polygon.
+
+        Parameters
+        ----------
+        polygon : shapely.geometry.Polygon or shapely.geometry.MultiPolygon
+            In the frame of the grid.
+
+        Returns
+        -------
+        inside : np.ndarray
+            Indices of the points in cells completely within the polygon.
+        boundary : np.ndarray
+            Indices of the points in cells along the polygon boundary, which have to be tested exactly.
+        """
+        empty = np.zeros((0,), dtype=np.intp)
+        if polygon.is_empty:
+            return empty, empty
+        min_x, min_y, max_x, max_y = polygon.bounds
+        cells = self.cells_in_box(np.array([min_x, min_y]), np.array([max_x, max_y]))
+        if not cells.size:
+            return empty, empty
+
+        # Slightly enlarged, so that points on the cell edges are never misclassified by rounding
+        margin = 1e-6 * self.cell_size
+        cells_min_x = (self.keys[cells] // self.nb_cells[1]) * self.cell_size + self.minimum_corner[0] - margin
+        cells_min_y = (self.keys[cells] % self.nb_cells[1]) * self.cell_size + self.minimum_corner[1] - margin
+        boxes = shapely.box(cells_min_x, cells_min_y, cells_min_x + self.cell_size + 2 * margin,
+                            cells_min_y + self.cell_size + 2 * margin)
+
+        # Prepared geometries must not be shared between threads, hence a private copy is prepared
+        polygon = shapely.from_wkb(shapely.to_wkb(polygon))
+        shapely.prepare(polygon)
+        cell_inside = shapely.contains_properly(polygon, boxes)
+        cell_boundary = np.logical_and(~cell_inside, shapely.intersects(polygon, boxes))
+        return self.points(cells[cell_inside]), self.points(cells[cell_boundary])
+
+
+def _concatenate_ranges(starts: np.ndarray, stops: np.ndarray) -> np.ndarray:
+    """
+    Concatenation of `np.arange(start, stop)` for all ranges (vectorized).
+    """
+    lengths = stops - starts
+    return np.repeat(starts - np.cumsum(lengths) + lengths, lengths) + np.arange(np.sum(lengths), dtype=np.intp)
+
+
+def points_in_box(xyz: np.ndarray, minimum_corner: np.ndarray, maximum_corner: np.ndarray) -> np.ndarray:
+    """
+    Mask of the points within an axis-aligned box (inclusive), evaluated per axis to avoid nx3 temporaries.
+
+    Parameters
+    ----------
+    xyz : np.ndarray
+        nx3 array of coordinates.
+    minimum_corner : np.ndarray
+        Infinite bounds are skipped.
+    maximum_corner : np.ndarray
+
+    Returns
+    -------
+    mask : np.ndarray
+    """
+    mask = np.ones((xyz.shape[0],), dtype=bool)
+    for axis in range(3):
+        if np.isfinite(minimum_corner[axis]):
+            mask &= xyz[:, axis] >= minimum_corner[axis]
+        if np.isfinite(maximum_corner[axis]):
+            mask &= xyz[:, axis] <= maximum_corner[axis]
+    return mask
+
+
+def points_in_polygon(x: np.ndarray, y: np.ndarray, polygon: Polygon | MultiPolygon,
+                      nb_cells: int = 65536) -> np.ndarray:
+    """
+    Vectorized point in polygon test.
+
+    A grid of (approximately) `nb_cells` square cells is laid over the bounding box of the polygon. Points in cells
+    that are completely inside or outside of the polygon are accepted or rejected based on their cell, only the points
+    in cells along the polygon boundary are tested exactly.
+
+    Parameters
+    ----------
+    x : np.ndarray
+    y : np.ndarray
+    polygon : shapely.geometry.Polygon or shapely.geometry.MultiPolygon
+    nb_cells : int, default=65536
+
+    Returns
+    -------
+    mask : np.ndarray
+        Boolean array, `True` for points within the polygon.
+    """
+    min_x, min_y, max_x, max_y = polygon.bounds
+    mask = np.zeros(x.shape, dtype=bool)
+    if polygon.is_empty:
+        return mask
+
+    # Bounding box prefilter
+    candidates = np.flatnonzero((x >= min_x) & (x <= max_x) & (y >= min_y) & (y <= max_y))
+
+    cell_size = max(np.sqrt((max_x - min_x) * (max_y - min_y) / nb_cells), np.finfo(float).eps)
+    nb_x = int(np.ceil((max_x - min_x) / cell_size)) + 1
+    nb_y = int(np.ceil((max_y - min_y) / cell_size)) + 1
+
+    cell_x = np.arange(nb_x) * cell_size + min_x
+    cell_y = np.arange(nb_y) * cell_size + min_y
+    cells_min_x, cells_min_y = (c.ravel() for c in np.meshgrid(cell_x, cell_y, indexing="ij"))
+    cells = shapely.box(cells_min_x, cells_min_y, cells_min_x + cell_size, cells_min_y + cell_size)
+
+    # Prepared geometries must not be shared between threads, hence a private copy is prepared
+    polygon = shapely.from_wkb(shapely.to_wkb(polygon))
+    shapely.prepare(polygon)
+    cell_inside = shapely.contains_properly(polygon, cells)
+    cell_boundary = np.logical_and(~cell_inside, shapely.intersects(polygon, cells))
+
+    cell_index = (np.minimum(((x[candidates] - min_x) // cell_size).astype(np.intp), nb_x - 1) * nb_y +
+                  np.minimum(((y[candidates] - min_y) // cell_size).astype(np.intp), nb_y - 1))
+
+    mask[candidates[cell_inside[cell_index]]] = True
+
+    exact = candidates[cell_boundary[cell_index]]
+    mask[exact] = shapely.contains_xy(polygon, x[exact], y[exact])
+
+    return mask
+
+
+def color_to_uint8(color: np.ndarray) -> np.ndarray:
+    """
+    Converts colors to the uint8 representation used by `PointCloudData`.
+
+    Wider integer colors (e.g. uint16 from LAS/PLY) are scaled by dropping the least significant bytes, floating point
+    colors are expected in the range [0, 1].
+
+    Parameters
+    ----------
+    color : np.ndarray
+        nx3 color array.
+
+    Returns
+    -------
+    color : np.ndarray
+        nx3 uint8 color array (the input itself if it already is uint8).
+    """
+    if color.dtype == np.uint8:
+        return color
+    if np.issubdtype(color.dtype, np.integer):
+        return (color >> (8 * (color.dtype.itemsize - 1))).astype(np.uint8)
+    return np.clip(np.round(color * 255), 0, 255).astype(np.uint8)
+
+
+def tile_id_dtype(nb_pcds: int) -> np.dtype:
+    """
+    Dtype of the *point_cloud_merge* scalar field of `nb_pcds` merged point clouds: *uint8* (as always) for up to 255
+    point clouds, *uint16* or wider for more (*uint8* tile ids would wrap around).
+    """
+    return np.result_type(np.uint8, np.min_scalar_type(nb_pcds))
+
+
+def merge_pcd(pcds: Iterable[PointCloudData], tile_ids: bool = True) -> PointCloudData:
     """
     Merge multiple point clouds.
 
     Merges two or more point clouds. The new point cloud will only retain scalar fields (and colors and normals) if
-    TODO: Check for dtype (uint8 vs uint16 -> needs to be scaled)
+    they are available in all point clouds. Colors of other dtypes than uint8 are scaled (see `color_to_uint8`) and
+    scalar fields are promoted to a common dtype. The coordinates are merged in the frame of the first point cloud (see
+    `PointCloudData.compact`).
 
     Parameters
     ----------
     pcds : iterable[DeSpAn.geometry.PointCloudData]
+    tile_ids : bool, default=True
+        Add the *point_cloud_merge* scalar field with the (1-based) index of the source point cloud (see
+        `tile_id_dtype`).
 
     Returns
     -------
@@ -114,14 +1217,19 @@ def merge_pcd(pcds: Iterable[PointCloudData]) -> PointCloudData:
     color = []
     normals = []
     scalar_fields = defaultdict(list)
+    origin = None
+    scale = None
 
     for i, pcd in enumerate(pcds):
-        xyz.append(pcd.xyz)
-        color.append(pcd.color)
+        if i == 0:
+            origin, scale = pcd.origin, pcd.scale
+        xyz.append(_xyz_in_frame(pcd, origin, scale))
+        color.append(pcd.color if pcd.color is None else color_to_uint8(pcd.color))
         normals.append(pcd.normals)
         for sf, pcd_sf in pcd.scalar_fields.items():
             scalar_fields[sf].append(pcd_sf)
-        scalar_fields["point_cloud_merge"].append(np.ones((pcd.xyz.shape[0],), dtype=np.uint8) * (i + 1))
+        if tile_ids:
+            scalar_fields["point_cloud_merge"].append(np.full((pcd.xyz.shape[0],), i + 1, dtype=tile_id_dtype(i + 1)))
 
     # Find empty pcd
     # empty_mask = [False if val is None else True for val in xyz]
@@ -167,4 +1275,77 @@ def merge_pcd(pcds: Iterable[PointCloudData]) -> PointCloudData:
 
     scalar_fields = {sf_key: np.hstack(tuple(sf)) for sf_key, sf in scalar_fields.items()}
 
-    return PointCloudData(xyz_np, color=color_np, normals=normals_np, scalar_fields=scalar_fields)
+    return PointCloudData(xyz_np, color=color_np, normals=normals_np, scalar_fields=scalar_fields, origin=origin,
+                          scale=scale)
+
+
+def merge_pcd_preallocated(pcds: Iterable[PointCloudData], nb_points: int, nb_pcds: int, color: bool = False,
+                           normals: bool = False, scalar_fields: dict[str, np.dtype] = None,
+                           storage_dir: Path = None, tile_ids: bool = True) -> PointCloudData:
+    """
+    Merge multiple point clouds into arrays that are allocated once.
+
+    In contrast to `merge_pcd` the point clouds are consumed one at a time and copied into their slice of the merged
+    arrays, hence (if `pcds` is a generator) only the merged point cloud and a single input point cloud are in memory
+    at the same time. The layout of the merged point cloud has to be known in advance (e.g. from the file headers, see
+    `DeSpAn.data_io.read_pcd_header`), only the coordinates are allocated in the frame of the first point cloud.
+
+    Parameters
+    ----------
+    pcds : iterable[DeSpAn.geometry.PointCloudData]
+    nb_points : int
+        Upper bound of the number of points of the merged point cloud (e.g. sum of the point counts prior to
+        filtering). Without filters the point counts of the headers are exact and the arrays are returned as
+        allocated, otherwise the retained points are copied into arrays of their actual number at the end (memmaps are
+        sliced, the unused end of the files is left in place).
+    nb_pcds : int
+        Number of point clouds in `pcds` (determines the dtype of the *point_cloud_merge* scalar field, see
+        `tile_id_dtype`).
+    color : bool, default=False
+        Retain colors (converted to uint8, see `color_to_uint8`).
+    normals : bool, default=False
+        Retain normals.
+    scalar_fields : dict[str, np.dtype], optional
+        Scalar fields to retain and their (common) dtypes.
+    storage_dir : pathlib.Path, optional
+        Merge into memmaps in this directory (out-of-core point cloud, see `PointCloudData`).
+    tile_ids : bool, default=True
+        Add the *point_cloud_merge* scalar field as in `merge_pcd`.
+
+    Returns
+    -------
+    pcd : DeSpAn.geometry.PointCloudData
+    """
+    scalar_fields = dict() if scalar_fields is None else dict(scalar_fields)
+    if tile_ids:
+        scalar_fields["point_cloud_merge"] = tile_id_dtype(nb_pcds)
+    merged_pcd = None
+
+    offset = 0
+    for i, pcd in enumerate(pcds, start=1):
+        if merged_pcd is None:
+            merged_pcd = PointCloudData.empty(nb_points, color=color, normals=normals, scalar_fields=scalar_fields,
+                                              storage_dir=storage_dir, xyz_dtype=pcd.xyz.dtype, origin=pcd.origin,
+                                              scale=pcd.scale)
+        end = offset + pcd.xyz.shape[0]
+        if end > nb_points:
+            raise ValueError(f"Point clouds contain more than the {nb_points:,d} allocated points.")
+
+        merged_pcd.xyz[offset:end] = _xyz_in_frame(pcd, merged_pcd.origin, merged_pcd.scale)
+        if color:
+            merged_pcd.color[offset:end] = color_to_uint8(pcd.color)
+        if normals:
+            merged_pcd.normals[offset:end] = pcd.normals
+        for sf, merged_sf in merged_pcd.scalar_fields.items():
+            if sf == "point_cloud_merge":
+                merged_sf[offset:end] = i
+            else:
+                merged_sf[offset:end] = pcd.scalar_fields[sf]
+        offset = end
+
+    if merged_pcd is None:
+        merged_pcd = PointCloudData.empty(0, color=color, normals=normals, scalar_fields=scalar_fields,
+                                          storage_dir=storage_dir)
+    merged_pcd._truncate(offset)
+
+    return merged_pcd
@@ -0,0 +1,448 @@
+"""Native implementation of the M3C2 distance (Lague et al., 2013) as an alternative to CloudCompare"""
+
+from concurrent.futures import ThreadPoolExecutor
+import configparser
+from dataclasses import dataclass, replace
+from pathlib import Path
+from typing import Any, Callable
+
+import numpy as np
+from scipy.spatial import cKDTree
+
+from DeSpAn.geometry import PointCloudData, ball_neighbours, neighbourhood_normals
+
+
+# Preferred normal orientations as enumerated by CloudCompare (`NormalPreferedOri`)
+_ORIENTATIONS = {0: np.array([1.0, 0.0, 0.0]), 1: np.array([-1.0, 0.0, 0.0]),
+                 2: np.array([0.0, 1.0, 0.0]), 3: np.array([0.0, -1.0, 0.0]),
+                 4: np.array([0.0, 0.0, 1.0]), 5: np.array([0.0, 0.0, -1.0])}
+_PLUS_BARYCENTER = 6
+_MINUS_BARYCENTER = 7
+
+_DEFAULT_NORMAL_MODE = 0
+_CLOUD1_NORMAL_MODE = 1
+_MULTI_SCALE_NORMAL_MODE = 2
+_VERTICAL_NORMAL_MODE = 3
+_CORE_POINTS_NORMAL_MODE = 5
+_NORMAL_MODES = [_DEFAULT_NORMAL_MODE, _CLOUD1_NORMAL_MODE, _MULTI_SCALE_NORMAL_MODE, _VERTICAL_NORMAL_MODE,
+                 _CORE_POINTS_NORMAL_MODE]
+
+
+@dataclass(frozen=True)
+class M3C2Parameters:
+    """
+    Subset of the CloudCompare M3C2 parameters that is evaluated by the native engine (settings of a parameters file
+    that change the distances otherwise are rejected by `from_file`).
+
+    Attributes
+    ----------
+    normal_scale : float
+        Diameter of the neighbourhood for the normal estimation.
+    normal_mode : int
+        0: single scale, 1: normals of the first cloud, 2: multi-scale, 3: vertical, 5: normals of the core points.
+    normal_min_scale, normal_step, normal_max_scale : float
+        Diameters evaluated in the multi-scale mode (the scale with the most planar neighbourhood is used).
+    normal_preferred_orientation : int
+        Orientation of the normals as enumerated by CloudCompare (0-5: +X, -X, +Y, -Y, +Z, -Z, 6/7: +/- barycenter).
+    search_scale : float
+        Diameter of the projection cylinder.
+    search_depth : float
+        Maximum length of the projection cylinder.
+    registration_error : float
+        Added to the level of detection if `registration_error_enabled`.
+    positive_search_only : bool
+        Only search in the direction of the normal.
+    use_median : bool
+        Use the median instead of the mean along the cylinder axis.
+    min_points_for_stat : int
+        Minimum number of points per cloud (if `use_min_points_for_stat`), otherwise the distance is *nan*.
+    max_thread_count : int
+        Number of threads used for the computation.
+    subsample_enabled : bool
+        The core points are the first cloud subsampled with a minimum spacing of `subsample_radius` (as CloudCompare
+        does without a core points cloud), see `DeSpAn.geometry.PointCloudData.subsample`.
+    subsample_radius : float
+    use_single_pass_for_depth : bool
+        Use the cylinder of the full `search_depth` at once instead of extending it progressively.
+    normal_use_core_points : bool
+        Estimate the normals (modes 0 and 2) from the neighbourhood in the core points instead of the first cloud.
+    """
+
+    normal_scale: float
+    normal_mode: int = _DEFAULT_NORMAL_MODE
+    normal_min_scale: float = None
+    normal_step: float = None
+    normal_max_scale: float = None
+    normal_preferred_orientation: int = 4
+    search_scale: float = None
+    search_depth: float = None
+    registration_error: float = 0.0
+    registration_error_enabled: bool = False
+    positive_search_only: bool = False
+    use_median: bool = False
+    use_min_points_for_stat: bool = False
+    min_points_for_stat: int = 5
+    max_thread_count: int = 1
+    subsample_enabled: bool = False
+    subsample_radius: float = None
+    use_single_pass_for_depth: bool = False
+    normal_use_core_points: bool = False
+
+    @classmethod
+    def from_file(cls, params_path: Path) -> "M3C2Parameters":
+        """
+        Reads a CloudCompare M3C2 parameters file (as used with `-M3C2`).
+
+        Parameters
+        ----------
+        params_path : pathlib.Path
+
+        Returns
+        -------
+        params : DeSpAn.m3c2.M3C2Parameters
+
+        Raises
+        ------
+        ValueError
+            If the file sets a normal mode, a normal orientation or precision maps, which the native engine does not
+            support (before any point cloud is loaded, instead of different distances than CloudCompare).
+        """
+        parser = configparser.ConfigParser()
+        parser.optionxform = str
+        with open(params_path, "r") as f:
+            parser.read_file(f)
+        general = parser["General"]
+
+        unsupported = []
+        if general.getint("NormalMode", _DEFAULT_NORMAL_MODE) not in _NORMAL_MODES:
+            unsupported.append(f"NormalMode={general['NormalMode']}")
+        orientation = general.getint("NormalPreferedOri", 4)
+        if orientation not in _ORIENTATIONS and orientation not in [_PLUS_BARYCENTER, _MINUS_BARYCENTER]:
+            unsupported.append(f"NormalPreferedOri={general['NormalPreferedOri']}")
+        if general.getboolean("UsePrecisionMaps", False):
+            unsupported.append(f"UsePrecisionMaps={general['UsePrecisionMaps']}")
+        if unsupported:
+            raise ValueError(f"The native M3C2 engine does not support {', '.join(unsupported)} (in '{params_path}').")
+
+        return cls(normal_scale=general.getfloat("NormalScale"),
+                   normal_mode=general.getint("NormalMode", _DEFAULT_NORMAL_MODE),
+                   normal_min_scale=general.getfloat("NormalMinScale", None),
+                   normal_step=general.getfloat("NormalStep", None),
+                   normal_max_scale=general.getfloat("NormalMaxScale", None),
+                   normal_preferred_orientation=general.getint("NormalPreferedOri", 4),
+                   search_scale=general.getfloat("SearchScale"),
+                   search_depth=general.getfloat("SearchDepth"),
+                   registration_error=general.getfloat("RegistrationError", 0.0),
+                   registration_error_enabled=general.getboolean("RegistrationErrorEnabled", False),
+                   positive_search_only=general.getboolean("PositiveSearchOnly", False),
+                   use_median=general.getboolean("UseMedian", False),
+                   use_min_points_for_stat=general.getboolean("UseMinPoints4Stat", False),
+                   min_points_for_stat=general.getint("MinPoints4Stat", 5),
+                   max_thread_count=general.getint("MaxThreadCount", 1),
+                   subsample_enabled=general.getboolean("SubsampleEnabled", False),
+                   subsample_radius=general.getfloat("SubsampleRadius", None),
+                   use_single_pass_for_depth=general.getboolean("UseSinglePass4Depth", False),
+                   normal_use_core_points=general.getboolean("NormalUseCorePoints", False))
+
+    def with_reference_normals(self) -> "M3C2Parameters":
+        """
+        The same parameters with the normals of the reference point cloud (`NormalMode=1`), e.g. estimated beforehand
+        with `DeSpAn.geometry.PointCloudData.estimate_normals`.
+
+        Returns
+        -------
+        params : DeSpAn.m3c2.M3C2Parameters
+        """
+        return replace(self, normal_mode=_CLOUD1_NORMAL_MODE)
+
+    @property
+    def normal_scales(self) -> np.ndarray:
+        if self.normal_mode == _MULTI_SCALE_NORMAL_MODE:
+            return np.arange(self.normal_min_scale, self.normal_max_scale + 0.5 * self.normal_step, self.normal_step)
+        return np.array([self.normal_scale])
+
+
+@dataclass(frozen=True)
+class M3C2Reference:
+    """
+    Reference side of M3C2, prepared once to compare several epochs with the same reference (see `m3c2_reference`).
+
+    Attributes
+    ----------
+    core_points : DeSpAn.geometry.PointCloudData
+    params : DeSpAn.m3c2.M3C2Parameters
+    origin : np.ndarray
+        Origin of the local coordinates.
+    core_xyz : np.ndarray
+        Local coordinates of the core points.
+    normals : np.ndarray
+        Oriented normals at the core points.
+    position : np.ndarray
+        Position of the reference points along the cylinder axes (mean or median).
+    std : np.ndarray
+        Standard deviation of the reference points along the cylinder axes.
+    count : np.ndarray
+        Number of reference points within the cylinders.
+    block_size : int
+    """
+
+    core_points: PointCloudData
+    params: M3C2Parameters
+    origin: np.ndarray
+    core_xyz: np.ndarray
+    normals: np.ndarray
+    position: np.ndarray
+    std: np.ndarray
+    count: np.ndarray
+    block_size: int = 50_000
+
+    def compare(self, pcd_2: PointCloudData) -> dict[str, np.ndarray]:
+        """
+        Computes the M3C2 distances from the reference to `pcd_2` at the core points.
+
+        Parameters
+        ----------
+        pcd_2 : DeSpAn.geometry.PointCloudData
+            Compared point cloud.
+
+        Returns
+        -------
+        scalar_fields : dict[str, np.ndarray]
+            *m3c2_distance*, *distance_uncertainty*, *significant_change*, *npoints_cloud2* and *std_cloud2*.
+        """
+        xyz_2 = pcd_2.coordinates() - self.origin
+        tree_2 = cKDTree(xyz_2)
+
+        def process_block(block: slice) -> tuple[np.ndarray, ...]:
+            return _cylinder_statistics(tree_2, xyz_2, self.core_xyz[block], self.normals[block], self.params)
+
+        position_2, std_2, count_2 = _map_blocks(process_block, self.core_xyz.shape[0], self.block_size,
+                                                 self.params.max_thread_count)
+
+        distance = position_2 - self.position
+        with np.errstate(divide="ignore", invalid="ignore"):
+            uncertainty = 1.96 * (np.sqrt(self.std ** 2 / self.count + std_2 ** 2 / count_2) +
+                                  (self.params.registration_error if self.params.registration_error_enabled else 0.0))
+
+        if self.params.use_min_points_for_stat:
+            insufficient = np.logical_or(self.count < self.params.min_points_for_stat,
+                                         count_2 < self.params.min_points_for_stat)
+            distance[insufficient] = np.nan
+            uncertainty[insufficient] = np.nan
+
+        return {"m3c2_distance": distance,
+                "distance_uncertainty": uncertainty,
+                "significant_change": (np.abs(distance) > uncertainty).astype(np.uint8),
+                "npoints_cloud2": count_2.astype(np.uint32),
+                "std_cloud2": std_2}
+
+
+def m3c2_reference(core_points: PointCloudData, pcd_1: PointCloudData, params: M3C2Parameters,
+                   block_size: int = 50_000) -> M3C2Reference:
+    """
+    Estimates the normals at the core points and the statistics of the reference cylinders, which only depend on the
+    reference point cloud.
+
+    Parameters
+    ----------
+    core_points : DeSpAn.geometry.PointCloudData
+    pcd_1 : DeSpAn.geometry.PointCloudData
+        Reference point cloud.
+    params : DeSpAn.m3c2.M3C2Parameters
+    block_size : int, default=50_000
+        The core points are processed in blocks of `block_size` points by `params.max_thread_count` threads.
+
+    Returns
+    -------
+    reference : DeSpAn.m3c2.M3C2Reference
+
+    Raises
+    ------
+    ValueError
+        If the normal mode uses the normals of the reference point cloud or of the core points and they have none.
+    """
+    if params.normal_mode == _CLOUD1_NORMAL_MODE and pcd_1.normals is None:
+        raise ValueError("Normal mode 1 uses the normals of the reference point cloud, which has no normals (estimate "
+                         "them with normal_scales or PointCloudData.estimate_normals).")
+    if params.normal_mode == _CORE_POINTS_NORMAL_MODE and core_points.normals is None:
+        raise ValueError("Normal mode 5 uses the normals of the core points, which have no normals.")
+
+    # Local coordinates to avoid a loss of precision with large (e.g. projected) coordinates
+    core_xyz = core_points.coordinates()
+    origin = np.mean(core_xyz, axis=0) if core_xyz.shape[0] else np.zeros((3,))
+    core_xyz = core_xyz - origin
+    xyz_1 = pcd_1.coordinates() - origin
+
+    tree_1 = cKDTree(xyz_1)
+    # Neighbourhood of the estimated normals
+    normals_tree, normals_xyz = (cKDTree(core_xyz), core_xyz) if params.normal_use_core_points else (tree_1, xyz_1)
+
+    if params.normal_preferred_orientation in _ORIENTATIONS:
+        orientation = _ORIENTATIONS[params.normal_preferred_orientation]
+    elif params.normal_preferred_orientation in [_PLUS_BARYCENTER, _MINUS_BARYCENTER]:
+        orientation = np.mean(xyz_1, axis=0)
+    else:
+        raise NotImplementedError(f"Normal orientation {params.normal_preferred_orientation:d} is not supported.")
+
+    def process_block(block: slice) -> tuple[np.ndarray, ...]:
+        block_xyz = core_xyz[block]
+        if params.normal_mode in [_DEFAULT_NORMAL_MODE, _MULTI_SCALE_NORMAL_MODE]:
+            normals = neighbourhood_normals(normals_tree, normals_xyz, block_xyz, params.normal_scales)
+        elif params.normal_mode == _CLOUD1_NORMAL_MODE:
+            normals = pcd_1.normals[tree_1.query(block_xyz)[1]]
+        elif params.normal_mode == _VERTICAL_NORMAL_MODE:
+            normals = np.tile(np.array([0.0, 0.0, 1.0]), (block_xyz.shape[0], 1))
+        elif params.normal_mode == _CORE_POINTS_NORMAL_MODE:
+            normals = core_points.normals[block].astype(float)
+        else:
+            raise NotImplementedError(f"Normal mode {params.normal_mode:d} is not supported.")
+
+        if params.normal_preferred_orientation in _ORIENTATIONS:
+            flip = normals @ orientation < 0
+        elif params.normal_preferred_orientation == _PLUS_BARYCENTER:
+            flip = np.einsum("ij,ij->i", normals, orientation - block_xyz) < 0
+        else:
+            flip = np.einsum("ij,ij->i", normals, orientation - block_xyz) > 0
+        normals[flip] *= -1
+
+        return normals, *_cylinder_statistics(tree_1, xyz_1, block_xyz, normals, params)
+
+    normals, position, std, count = _map_blocks(process_block, core_xyz.shape[0], block_size,
+                                                params.max_thread_count)
+    return M3C2Reference(core_points, params, origin, core_xyz, normals, position, std, count, block_size=block_size)
+
+
+def m3c2(core_points: PointCloudData, pcd_1: PointCloudData, pcd_2: PointCloudData, params: M3C2Parameters,
+         block_size: int = 50_000) -> PointCloudData:
+    """
+    Computes the M3C2 distances from `pcd_1` to `pcd_2` at the core points.
+
+    The normals are estimated from the neighbourhood in `pcd_1` (or in the core points). The projection cylinder is
+    extended progressively (doubling its length up to `search_depth`) until both clouds contain points, comparable to
+    CloudCompare's default behaviour, or used at its full length (`use_single_pass_for_depth`). The core points are
+    processed in blocks of `block_size` points by `params.max_thread_count` threads.
+
+    Parameters
+    ----------
+    core_points : DeSpAn.geometry.PointCloudData
+    pcd_1 : DeSpAn.geometry.PointCloudData
+        Reference point cloud.
+    pcd_2 : DeSpAn.geometry.PointCloudData
+        Compared point cloud.
+    params : DeSpAn.m3c2.M3C2Parameters
+    block_size : int, default=50_000
+
+    Returns
+    -------
+    pcd : DeSpAn.geometry.PointCloudData
+        Core points with the normals and the scalar fields *m3c2_distance*, *distance_uncertainty*,
+        *significant_change*, *npoints_cloud1*, *npoints_cloud2*, *std_cloud1* and *std_cloud2*.
+    """
+    reference = m3c2_reference(core_points, pcd_1, params, block_size=block_size)
+    distances = reference.compare(pcd_2)
+
+    scalar_fields = dict(core_points.scalar_fields)
+    scalar_fields.update({"m3c2_distance": distances["m3c2_distance"],
+                          "distance_uncertainty": distances["distance_uncertainty"],
+                          "significant_change": distances["significant_change"],
+                          "npoints_cloud1": reference.count.astype(np.uint32),
+                          "npoints_cloud2": distances["npoints_cloud2"],
+                          "std_cloud1": reference.std,
+                          "std_cloud2": distances["std_cloud2"]})
+
+    return PointCloudData(core_points.coordinates().copy(), color=core_points.color, normals=reference.normals,
+                          scalar_fields=scalar_fields)
+
+
+def write_params_file(params_path: Path, out_path: Path, settings: dict[str, Any]) -> Path:
+    """
+    Writes a copy of a CloudCompare M3C2 parameters file with some settings replaced (e.g. ``{"NormalMode": 1}``).
+
+    Parameters
+    ----------
+    params_path : pathlib.Path
+    out_path : pathlib.Path
+    settings : dict[str, Any]
+        Keys and values of the *General* section.
+
+    Returns
+    -------
+    out_path : pathlib.Path
+    """
+    parser = configparser.ConfigParser()
+    parser.optionxform = str
+    with open(params_path, "r") as f:
+        parser.read_file(f)
+    for key, value in settings.items():
+        parser["General"][key] = f"{value}"
+    out_path = Path(out_path)
+    out_path.parent.mkdir(parents=True, exist_ok=True)
+    with open(out_path, "w") as f:
+        parser.write(f, space_around_delimiters=False)
+    return out_path
+
+
+def _map_blocks(process_block: Callable[[slice], tuple[np.ndarray, ...]], nb_points: int, block_size: int,
+                nb_threads: int) -> tuple[np.ndarray, ...]:
+    """
+    Processes the blocks of the core points by a thread pool and concatenates the results.
+    """
+    blocks = [slice(start, start + block_size) for start in range(0, max(nb_points, 1), block_size)]
+    with ThreadPoolExecutor(max_workers=max(nb_threads, 1)) as executor:
+        results = list(executor.map(process_block, blocks))
+    return tuple(np.concatenate(column) for column in zip(*results))
+
+
+def _cylinder_statistics(tree: cKDTree, xyz: np.ndarray, centers: np.ndarray, normals: np.ndarray,
+                         params: M3C2Parameters) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Position along the cylinder axis (mean or median), standard deviation and number of the points within the
+    projection cylinders. Cylinders without points are extended (doubled) up to the maximum depth, unless
+    `params.use_single_pass_for_depth`.
+    """
+    radius = params.search_scale / 2
+    max_half_length = params.search_depth / 2
+
+    position = np.full((centers.shape[0],), np.nan)
+    std = np.full((centers.shape[0],), np.nan)
+    count = np.zeros((centers.shape[0],), dtype=np.intp)
+
+    pending = np.arange(centers.shape[0])
+    half_length = max_half_length if params.use_single_pass_for_depth else min(radius, max_half_length)
+    while pending.size:
+        indices, groups = ball_neighbours(tree, centers[pending], np.hypot(radius, half_length))
+        offsets = xyz[indices] - centers[pending][groups]
+        along = np.einsum("ij,ij->i", offsets, normals[pending][groups])
+        across_squared = np.einsum("ij,ij->i", offsets, offsets) - along ** 2
+
+        inside = np.logical_and(across_squared <= radius ** 2, np.abs(along) <= half_length)
+        if params.positive_search_only:
+            inside &= along >= 0
+        along = along[inside]
+        groups = groups[inside]
+
+        pending_count = np.bincount(groups, minlength=pending.size)
+        found = pending_count > 0
+        pending_mean = np.bincount(groups, along, pending.size)[found] / pending_count[found]
+        pending_std = np.sqrt(np.maximum(np.bincount(groups, along ** 2, pending.size)[found] / pending_count[found] -
+                                         pending_mean ** 2, 0.0))
+
+        if params.use_median:
+            order = np.lexsort((along, groups))
+            starts = np.concatenate(([0], np.cumsum(pending_count)[:-1]))[found]
+            lower = along[order][starts + (pending_count[found] - 1) // 2]
+            upper = along[order][starts + pending_count[found] // 2]
+            pending_position = (lower + upper) / 2
+        else:
+            pending_position = pending_mean
+
+        position[pending[found]] = pending_position
+        std[pending[found]] = pending_std
+        count[pending[found]] = pending_count[found]
+
+        if half_length >= max_half_length:
+            break
+        pending = pending[~found]
+        half_length = min(2 * half_length, max_half_length)
+
+    return position, std, count
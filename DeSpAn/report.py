@@ -0,0 +1,360 @@
+"""Instrumentation of the pipeline steps and machine-readable run report"""
+
+import cProfile
+from contextlib import contextmanager
+from dataclasses import asdict, dataclass
+import datetime
+import itertools
+import json
+import os
+from pathlib import Path
+import platform
+import sys
+import threading
+import time
+from typing import Iterable, Iterator
+
+try:
+    import resource
+except ImportError:
+    # Not available on Windows, the memory and child process measurements are omitted
+    resource = None
+
+import DeSpAn
+
+
+REPORT_VERSION = 1
+
+# Peaks of the running measurements (see `start_peak_rss`) before the last reset of the high-water mark
+_peak_lock = threading.Lock()
+_peaks: dict[int, int] = {}
+_peak_keys = itertools.count()
+
+
+@dataclass
+class StepRecord:
+    """
+    Measurements of a step (or a stage) of the pipeline.
+
+    Attributes
+    ----------
+    name : str
+    stage : str or None
+        Pipeline stage running the step.
+    epoch : str or None
+    status : str
+        *completed*, *failed* or *skipped* (stages that are up to date).
+    start : float
+        Seconds since the start of the run.
+    wall_time : float
+        Seconds.
+    cpu_time : float
+        CPU seconds of the process (all threads) and of the child processes that terminated during the step. Includes
+        concurrently running steps.
+    children_cpu_time : float or None
+        CPU seconds of the child processes (worker pools, CloudCompare) that terminated during the step (included in
+        `cpu_time`). Includes the children of concurrently running steps.
+    peak_rss : int or None
+        Peak resident set size of the process (in bytes) during the step (see `start_peak_rss`, the peak of the run so
+        far on platforms other than Linux). Includes concurrently running steps.
+    children_peak_rss : int or None
+        Peak resident set size of the largest child process terminated so far (in bytes).
+    points_in : int or None
+    points_out : int or None
+    bytes_read : int or None
+        Size of the input files.
+    bytes_written : int or None
+        Size of the output files.
+    profile : str or None
+        cProfile statistics of the step (see `pstats.Stats`).
+    """
+
+    name: str
+    stage: str = None
+    epoch: str = None
+    status: str = "completed"
+    start: float = 0.0
+    wall_time: float = 0.0
+    cpu_time: float = 0.0
+    children_cpu_time: float = None
+    peak_rss: int = None
+    children_peak_rss: int = None
+    points_in: int = None
+    points_out: int = None
+    bytes_read: int = None
+    bytes_written: int = None
+    profile: str = None
+
+
+class RunReport:
+    """
+    Collects the records of the steps of a run (from any thread) and writes them as *json* file.
+
+    Parameters
+    ----------
+    report_path : pathlib.Path
+    profile_dir : pathlib.Path, optional
+        Profile each step with cProfile and store the statistics in this directory.
+    settings : dict, optional
+        Configuration of the run (stored in the report).
+    """
+
+    def __init__(self, report_path: Path, profile_dir: Path = None, settings: dict = None):
+        self.report_path = Path(report_path)
+        self.profile_dir = None if profile_dir is None else Path(profile_dir)
+        self.settings = settings
+        self.stages: list[StepRecord] = []
+        self.steps: list[StepRecord] = []
+        self.current_stage = None
+        self._lock = threading.Lock()
+        self._start = time.perf_counter()
+        self._start_time = datetime.datetime.now()
+        self._peak_key = start_peak_rss()
+
+    @contextmanager
+    def step(self, name: str, epoch: str = None, points_in: int = None, files_in: Iterable[Path] = (),
+             files_out: Iterable[Path] = ()) -> Iterator[StepRecord]:
+        """
+        Measures the enclosed step and records it.
+
+        Parameters
+        ----------
+        name : str
+        epoch : str, optional
+        points_in : int, optional
+        files_in : Iterable[pathlib.Path], optional
+            Files read by the step.
+        files_out : Iterable[pathlib.Path], optional
+            Files written by the step (measured at its end).
+
+        Yields
+        ------
+        record : DeSpAn.report.StepRecord
+            Set `points_out` (or other measures) within the step.
+        """
+        record = StepRecord(name, stage=self.current_stage, epoch=epoch, points_in=points_in,
+                            bytes_read=_file_sizes(files_in))
+        try:
+            with self._measure(record, profile_name="_".join(filter(None, [self.current_stage, name, epoch]))):
+                yield record
+        finally:
+            record.bytes_written = _file_sizes(files_out)
+            with self._lock:
+                self.steps.append(record)
+
+    @contextmanager
+    def stage(self, name: str) -> Iterator[StepRecord]:
+        """
+        Measures the enclosed pipeline stage, the steps within are assigned to it.
+
+        Parameters
+        ----------
+        name : str
+
+        Yields
+        ------
+        record : DeSpAn.report.StepRecord
+        """
+        record = StepRecord(name, stage=name)
+        self.current_stage = name
+        try:
+            with self._measure(record):
+                yield record
+        finally:
+            self.current_stage = None
+            with self._lock:
+                self.stages.append(record)
+
+    def skip_stage(self, name: str) -> None:
+        """
+        Records a stage that did not run.
+
+        Parameters
+        ----------
+        name : str
+        """
+        with self._lock:
+            self.stages.append(StepRecord(name, stage=name, status="skipped",
+                                          start=time.perf_counter() - self._start))
+
+    @contextmanager
+    def _measure(self, record: StepRecord, profile_name: str = None) -> Iterator[None]:
+        profiler = None
+        if self.profile_dir is not None and profile_name is not None:
+            profiler = cProfile.Profile()
+            try:
+                profiler.enable()
+            except ValueError:
+                # Another profiler is active in this thread
+                profiler = None
+
+        children_cpu = _children_cpu_time()
+        peak_key = start_peak_rss()
+        record.start = time.perf_counter() - self._start
+        cpu_start = time.process_time()
+        try:
+            yield
+        except BaseException:
+            record.status = "failed"
+            raise
+        finally:
+            record.wall_time = time.perf_counter() - self._start - record.start
+            record.cpu_time = time.process_time() - cpu_start
+            if children_cpu is not None:
+                record.children_cpu_time = _children_cpu_time() - children_cpu
+                record.cpu_time += record.children_cpu_time
+            record.peak_rss = read_peak_rss(peak_key)
+            record.children_peak_rss = peak_rss()[1]
+
+            if profiler is not None:
+                profiler.disable()
+                self.profile_dir.mkdir(parents=True, exist_ok=True)
+                record.profile = f"{self.profile_dir / f'{profile_name}.prof'}"
+                profiler.dump_stats(record.profile)
+
+    def write(self, status: str = "completed") -> None:
+        """
+        Writes the report.
+
+        Parameters
+        ----------
+        status : str, default="completed"
+            Status of the run.
+        """
+        with self._lock:
+            report = {
+                "version": REPORT_VERSION,
+                "despan_version": DeSpAn.__version__,
+                "status": status,
+                "start": self._start_time.isoformat(timespec="seconds"),
+                "wall_time": time.perf_counter() - self._start,
+                "peak_rss": read_peak_rss(self._peak_key, stop=False),
+                "host": host_info(),
+                "settings": self.settings,
+                "stages": [asdict(record) for record in self.stages],
+                "steps": [asdict(record) for record in sorted(self.steps, key=lambda record: record.start)],
+            }
+        self.report_path.parent.mkdir(parents=True, exist_ok=True)
+        with open(self.report_path, "w") as f:
+            json.dump(report, f, indent=2, default=str)
+        print(f"Run report written to '{self.report_path}'")
+
+
+def peak_rss() -> tuple[int | None, int | None]:
+    """
+    Peak resident set size of the process and of its largest terminated child process.
+
+    On Linux, the peak of the process is reset by `start_peak_rss`, use `read_peak_rss` for the peak of a part of the
+    run.
+
+    Returns
+    -------
+    peak_rss : int or None
+        Bytes (`None` if not available on the platform).
+    children_peak_rss : int or None
+        Bytes (`None` if not available on the platform).
+    """
+    if resource is None:
+        return None, None
+    # Kilobytes on Linux, bytes on macOS
+    unit = 1 if sys.platform == "darwin" else 1024
+    return (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * unit,
+            resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * unit)
+
+
+def start_peak_rss() -> int:
+    """
+    Starts measuring the peak resident set size of the process (see `read_peak_rss`).
+
+    The high-water mark of the process is reset (Linux only). The peak before the reset is kept for the measurements
+    that are already running, hence measurements can be nested and run concurrently (they measure the whole process).
+
+    Returns
+    -------
+    key : int
+    """
+    with _peak_lock:
+        _update_peaks()
+        try:
+            with open("/proc/self/clear_refs", "w") as f:
+                f.write("5")
+        except OSError:
+            # Elsewhere the peak of the process so far is measured
+            pass
+        key = next(_peak_keys)
+        _peaks[key] = 0
+    return key
+
+
+def read_peak_rss(key: int, stop: bool = True) -> int | None:
+    """
+    Peak resident set size of the process since `start_peak_rss`.
+
+    Parameters
+    ----------
+    key : int
+        See `start_peak_rss`.
+    stop : bool, default=True
+        End the measurement.
+
+    Returns
+    -------
+    peak_rss : int or None
+        Bytes (`None` if not available on the platform).
+    """
+    with _peak_lock:
+        available = _update_peaks()
+        peak = _peaks.pop(key) if stop else _peaks[key]
+    return peak if available else None
+
+
+def _update_peaks() -> bool:
+    # Folds the current high-water mark into the peaks of the running measurements (with `_peak_lock` held)
+    peak = _high_water_mark()
+    if peak is None:
+        return False
+    for key, key_peak in _peaks.items():
+        _peaks[key] = max(key_peak, peak)
+    return True
+
+
+def _high_water_mark() -> int | None:
+    # High-water mark since the last reset
+    try:
+        with open("/proc/self/status", "r") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return peak_rss()[0]
+
+
+def host_info() -> dict:
+    """
+    Description of the machine (to size the nodes).
+
+    Returns
+    -------
+    host : dict
+    """
+    try:
+        memory = os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES")
+    except (AttributeError, ValueError, OSError):
+        memory = None
+    return {"node": platform.node(), "platform": platform.platform(), "python": platform.python_version(),
+            "cpu_count": os.cpu_count(), "memory": memory}
+
+
+def _children_cpu_time() -> float | None:
+    if resource is None:
+        return None
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage.ru_utime + usage.ru_stime
+
+
+def _file_sizes(paths: Iterable[Path]) -> int | None:
+    paths = list(paths)
+    if not paths:
+        return None
+    return sum(Path(path).stat().st_size for path in paths if Path(path).is_file())
@@ -0,0 +1,343 @@
+"""Segmentation of elongated point clouds along the corridor axis"""
+
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field, replace
+import multiprocessing
+from pathlib import Path
+
+import numpy as np
+from shapely.geometry import MultiPolygon, Polygon
+
+from DeSpAn.core import ordered_map
+from DeSpAn.geometry import MEMMAP_CHUNK_SIZE, PointCloudData
+from DeSpAn.m3c2 import M3C2Parameters, m3c2
+
+
+@dataclass(frozen=True)
+class CorridorSegment:
+    """
+    Segment of the corridor between two stations along the corridor axis.
+
+    Attributes
+    ----------
+    start : float
+        First station owned by the segment.
+    end : float
+        Station after the last station owned by the segment.
+    overlap : float
+        The segment is extended by `overlap` on both sides for the neighbourhood of the owned points.
+    """
+
+    start: float
+    end: float
+    overlap: float
+
+
+@dataclass(frozen=True)
+class _MemmapSegment:
+    """
+    Points of a segment of a memory-mapped point cloud, by the paths of its *npy* files and the indices of the points
+    (gathered by the worker).
+    """
+
+    indices: np.ndarray
+    xyz: Path
+    color: Path = None
+    normals: Path = None
+    scalar_fields: dict[str, Path] = field(default_factory=dict)
+    origin: np.ndarray = None
+    scale: np.ndarray = None
+
+    def load(self) -> PointCloudData:
+        def gather(path: Path) -> np.ndarray | None:
+            return None if path is None else np.asarray(np.load(path, mmap_mode="r")[self.indices])
+
+        return PointCloudData(gather(self.xyz), color=gather(self.color), normals=gather(self.normals),
+                              scalar_fields={sf: gather(path) for sf, path in self.scalar_fields.items()},
+                              origin=self.origin, scale=self.scale)
+
+
+class _StitchedPoints:
+    """
+    Results of the segments, copied into arrays allocated for an upper bound of their number as they arrive (in memory
+    or as memmaps in `storage_dir`, see `DeSpAn.geometry.PointCloudData.empty`). The results of all segments share the
+    layout and the frame of the coordinates.
+    """
+
+    def __init__(self, nb_points: int, storage_dir: Path = None):
+        self.nb_points = nb_points
+        self.storage_dir = storage_dir
+        self.pcd = None
+        self.offset = 0
+
+    def append(self, pcd: PointCloudData) -> None:
+        if self.pcd is None:
+            self.pcd = PointCloudData.empty(self.nb_points, color=pcd.color is not None,
+                                            normals=pcd.normals is not None,
+                                            scalar_fields={sf: array.dtype for sf, array in pcd.scalar_fields.items()},
+                                            storage_dir=self.storage_dir, xyz_dtype=pcd.xyz.dtype, origin=pcd.origin,
+                                            scale=pcd.scale)
+        end = self.offset + pcd.nb_points
+        self.pcd.xyz[self.offset:end] = pcd.xyz
+        if pcd.color is not None:
+            self.pcd.color[self.offset:end] = pcd.color
+        if pcd.normals is not None:
+            self.pcd.normals[self.offset:end] = pcd.normals
+        for sf, array in self.pcd.scalar_fields.items():
+            array[self.offset:end] = pcd.scalar_fields[sf]
+        self.offset = end
+
+    def result(self) -> PointCloudData:
+        # Memmaps are sliced, arrays in memory are copied to the number of points
+        self.pcd._truncate(self.offset)
+        return self.pcd
+
+
+def corridor_axis(pcd: PointCloudData) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Principal axis of the *xy*-coordinates of a point cloud (accumulated chunk by chunk).
+
+    The axis is a straight line, i.e. the stations are only meaningful for roughly straight corridors. On curved
+    corridors (e.g. a bend of more than a few degrees over the corridor length) the slabs perpendicular to the axis
+    cut the corridor obliquely or several times, the segments become unbalanced and an overlap measured along the axis
+    is shorter than along the corridor. Process such corridors in a single block (or in straight parts).
+
+    Parameters
+    ----------
+    pcd : DeSpAn.geometry.PointCloudData
+
+    Returns
+    -------
+    origin : np.ndarray
+        Mean of the *xy*-coordinates.
+    direction : np.ndarray
+        Unit vector of the principal axis.
+    """
+    # Sums relative to the first point, large (e.g. projected) coordinates would cancel in the covariance
+    shift = pcd.coordinates(slice(0, 1))[0, 0:2]
+    total = np.zeros((2,))
+    products = np.zeros((2, 2))
+    for chunk in pcd.chunks(MEMMAP_CHUNK_SIZE):
+        xy = chunk.coordinates()[:, 0:2] - shift
+        total += np.sum(xy, axis=0)
+        products += xy.T @ xy
+    mean = total / pcd.nb_points
+    covariance = (products - pcd.nb_points * np.outer(mean, mean)) / (pcd.nb_points - 1)
+    eigenvalues, eigenvectors = np.linalg.eigh(covariance)
+    return shift + mean, eigenvectors[:, np.argmax(eigenvalues)]
+
+
+def station_coordinates(pcd: PointCloudData, origin: np.ndarray, direction: np.ndarray) -> np.ndarray:
+    """
+    Stations of the points along an axis, computed chunk by chunk (without a copy of all coordinates).
+
+    Parameters
+    ----------
+    pcd : DeSpAn.geometry.PointCloudData
+    origin : np.ndarray
+    direction : np.ndarray
+        Unit vector of the axis (see `corridor_axis`).
+
+    Returns
+    -------
+    stations : np.ndarray
+    """
+    stations = np.empty((pcd.nb_points,), dtype=float)
+    for start, chunk in zip(range(0, pcd.nb_points, MEMMAP_CHUNK_SIZE), pcd.chunks(MEMMAP_CHUNK_SIZE)):
+        stations[start:start + chunk.nb_points] = (chunk.coordinates()[:, 0:2] - origin) @ direction
+    return stations
+
+
+def split_corridor(first_station: float, last_station: float, segment_length: float,
+                   overlap: float) -> list[CorridorSegment]:
+    """
+    Splits the stations into segments of `segment_length`. The first and last segment are open ended, so that each
+    station is owned by exactly one segment.
+
+    Parameters
+    ----------
+    first_station : float
+    last_station : float
+    segment_length : float
+    overlap : float
+
+    Returns
+    -------
+    segments : list[DeSpAn.segmentation.CorridorSegment]
+    """
+    nb_segments = max(int(np.ceil((last_station - first_station) / segment_length)), 1)
+    boundaries = first_station + np.arange(nb_segments + 1) * segment_length
+    boundaries[0] = -np.inf
+    boundaries[-1] = np.inf
+    return [CorridorSegment(boundaries[i], boundaries[i + 1], overlap) for i in range(nb_segments)]
+
+
+def process_segments(pcd_1: PointCloudData, pcd_2: PointCloudData, border: Polygon | MultiPolygon,
+                     segment_length: float, overlap: float, m3c2_params: M3C2Parameters = None,
+                     nb_workers: int = 1, core_point_subsample: tuple[str, float] = None
+                     ) -> tuple[PointCloudData, PointCloudData, PointCloudData | None]:
+    """
+    Crops both epochs to the border (and computes M3C2) segment by segment in a process pool.
+
+    The segments are slabs perpendicular to the principal axis of the corridor (see `corridor_axis`, only suited for
+    roughly straight corridors). Every worker receives the points of a segment extended by `overlap` on both sides,
+    but only the points owned by the segment are returned (and used as core points), hence each point appears exactly
+    once in the stitched results. `overlap` should cover the M3C2 neighbourhood (normal and projection scales as well
+    as the search depth), it is not needed (and not applied) without M3C2.
+
+    The segments are cut in the parent, i.e. only the points of a segment are transferred to its worker. Memory-mapped
+    point clouds (see `DeSpAn.geometry.PointCloudData.storage_dir`) are not transferred at all, the workers gather
+    their points from the *npy* files (pending reductions are applied first). The results of the segments are copied
+    into the outputs as they arrive (memmaps in the `storage_dir` of the corresponding epoch) and dropped, hence the
+    parent holds the stations of the points and the results of the pending segments besides the outputs.
+
+    Parameters
+    ----------
+    pcd_1 : DeSpAn.geometry.PointCloudData
+    pcd_2 : DeSpAn.geometry.PointCloudData
+    border : shapely.geometry.Polygon or shapely.geometry.MultiPolygon
+    segment_length : float
+    overlap : float
+    m3c2_params : DeSpAn.m3c2.M3C2Parameters, optional
+        Compute the M3C2 distances (core points: cropped points of `pcd_1`). The threads of
+        `m3c2_params.max_thread_count` are split among the workers.
+    nb_workers : int, default=1
+    core_point_subsample : tuple[str, float], optional
+        Mode and size to subsample the core points of each segment (see `DeSpAn.geometry.PointCloudData.subsample`).
+        The voxel grids are aligned per segment and the minimum spacing only holds within each segment.
+
+    Returns
+    -------
+    pcd_1 : DeSpAn.geometry.PointCloudData
+        Cropped first epoch.
+    pcd_2 : DeSpAn.geometry.PointCloudData
+        Cropped second epoch.
+    pcd_m3c2 : DeSpAn.geometry.PointCloudData or None
+        M3C2 results (if `m3c2_params` is given).
+    """
+    if m3c2_params is None:
+        overlap = 0.0
+    source_1 = _memmap_files(pcd_1)
+    source_2 = _memmap_files(pcd_2)
+
+    origin, direction = corridor_axis(pcd_1)
+    stations_1 = station_coordinates(pcd_1, origin, direction)
+    stations_2 = station_coordinates(pcd_2, origin, direction)
+    order_1 = np.argsort(stations_1, kind="stable")
+    order_2 = np.argsort(stations_2, kind="stable")
+    stations_1 = stations_1[order_1]
+    stations_2 = stations_2[order_2]
+
+    segments = split_corridor(min(stations_1[0], stations_2[0]), max(stations_1[-1], stations_2[-1]),
+                              segment_length, overlap)
+    print(f"Processing {len(segments):,d} segment(s) of {segment_length:.1f} (overlap {overlap:.1f})")
+
+    if m3c2_params is not None:
+        m3c2_params = replace(m3c2_params, max_thread_count=max(m3c2_params.max_thread_count // nb_workers, 1))
+
+    def segment_args():
+        for segment in segments:
+            segment_1 = _segment_points(pcd_1, source_1, order_1, stations_1, segment)
+            segment_2 = _segment_points(pcd_2, source_2, order_2, stations_2, segment)
+            yield segment_1 + segment_2 + (_segment_border(border, origin, direction, segment), m3c2_params,
+                                           core_point_subsample)
+
+    # Each point is owned by one segment and at most all points of the first epoch are core points
+    cropped_1 = _StitchedPoints(pcd_1.nb_points, pcd_1.storage_dir)
+    cropped_2 = _StitchedPoints(pcd_2.nb_points, pcd_2.storage_dir)
+    stitched_m3c2 = _StitchedPoints(pcd_1.nb_points, pcd_1.storage_dir)
+    with ProcessPoolExecutor(max_workers=nb_workers, mp_context=multiprocessing.get_context("spawn")) as executor:
+        for owned_1, owned_2, segment_m3c2 in ordered_map(executor, _process_segment, segment_args(),
+                                                          max_pending=2 * nb_workers):
+            cropped_1.append(owned_1)
+            cropped_2.append(owned_2)
+            if segment_m3c2 is not None:
+                stitched_m3c2.append(segment_m3c2)
+
+    return (cropped_1.result(), cropped_2.result(), None if m3c2_params is None else stitched_m3c2.result())
+
+
+def _memmap_files(pcd: PointCloudData) -> _MemmapSegment | None:
+    """
+    Paths of the *npy* files of a memory-mapped point cloud (without indices), `None` if any array is held in memory
+    (or is not a prefix of an *npy* file).
+    """
+    if pcd.storage_dir is None:
+        return None
+    # Pending reductions are written to new memmaps
+    pcd.materialize()
+
+    def npy_path(array: np.ndarray) -> Path | None:
+        filename = getattr(array, "filename", None)
+        if filename is None or Path(filename).suffix != ".npy":
+            return None
+        # Truncated point clouds keep a prefix of their files (see `DeSpAn.geometry.PointCloudData._truncate`)
+        stored = np.load(filename, mmap_mode="r")
+        if stored.dtype != array.dtype or stored.shape[1:] != array.shape[1:] or stored.shape[0] < array.shape[0]:
+            return None
+        return Path(filename)
+
+    arrays = {"xyz": pcd.xyz, "color": pcd.color, "normals": pcd.normals}
+    paths = {key: None if array is None else npy_path(array) for key, array in arrays.items()}
+    sf_paths = {sf: npy_path(array) for sf, array in pcd.scalar_fields.items()}
+    if any(paths[key] is None for key, array in arrays.items() if array is not None) or None in sf_paths.values():
+        return None
+    return _MemmapSegment(np.empty((0,), dtype=np.intp), **paths, scalar_fields=sf_paths, origin=pcd.origin,
+                          scale=pcd.scale)
+
+
+def _segment_points(pcd: PointCloudData, source: _MemmapSegment | None, order: np.ndarray,
+                    sorted_stations: np.ndarray,
+                    segment: CorridorSegment) -> tuple[PointCloudData | _MemmapSegment, np.ndarray]:
+    """
+    Points of the extended segment (or their indices in the files of `source`) and the mask of the points owned by
+    the segment.
+    """
+    first, start, end, last = np.searchsorted(sorted_stations, [segment.start - segment.overlap, segment.start,
+                                                                segment.end, segment.end + segment.overlap])
+    owned = np.zeros((last - first,), dtype=bool)
+    owned[start - first:end - first] = True
+    if source is not None:
+        return replace(source, indices=order[first:last]), owned
+    return pcd.select(order[first:last]), owned
+
+
+def _segment_border(border: Polygon | MultiPolygon, origin: np.ndarray, direction: np.ndarray,
+                    segment: CorridorSegment) -> Polygon | MultiPolygon:
+    """
+    Part of the border within the extended segment.
+    """
+    minx, miny, maxx, maxy = border.bounds
+    reach = np.hypot(maxx - minx, maxy - miny) + np.linalg.norm(np.array([minx, miny]) - origin)
+    start = max(segment.start - segment.overlap, -reach)
+    end = min(segment.end + segment.overlap, reach)
+    normal = np.array([-direction[1], direction[0]])
+    slab = Polygon([origin + start * direction - reach * normal, origin + end * direction - reach * normal,
+                    origin + end * direction + reach * normal, origin + start * direction + reach * normal])
+    return border.intersection(slab)
+
+
+def _process_segment(pcd_1: PointCloudData | _MemmapSegment, owned_1: np.ndarray,
+                     pcd_2: PointCloudData | _MemmapSegment, owned_2: np.ndarray,
+                     border: Polygon | MultiPolygon, m3c2_params: M3C2Parameters = None,
+                     core_point_subsample: tuple[str, float] = None
+                     ) -> tuple[PointCloudData, PointCloudData, PointCloudData | None]:
+    """
+    Crops the extended segment to the border and returns the owned points (and their M3C2 results).
+    """
+    if isinstance(pcd_1, _MemmapSegment):
+        pcd_1 = pcd_1.load()
+    if isinstance(pcd_2, _MemmapSegment):
+        pcd_2 = pcd_2.load()
+    inside_1 = pcd_1.polygon_mask(border)
+    inside_2 = pcd_2.polygon_mask(border)
+    pcd_1 = pcd_1.select(inside_1)
+    pcd_2 = pcd_2.select(inside_2)
+
+    owned_points = pcd_1.select(owned_1[inside_1])
+    pcd_m3c2 = None
+    if m3c2_params is not None:
+        core_points = owned_points if core_point_subsample is None else owned_points.subsample(*core_point_subsample)
+        pcd_m3c2 = m3c2(core_points, pcd_1, pcd_2, m3c2_params)
+
+    return owned_points, pcd_2.select(owned_2[inside_2]), pcd_m3c2
@@ -0,0 +1,138 @@
+"""Pipeline stages with declared inputs and outputs, checkpointed for resuming"""
+
+from dataclasses import dataclass, field
+import hashlib
+import json
+from pathlib import Path
+from typing import Any, Callable
+
+from DeSpAn.report import RunReport
+
+
+@dataclass(frozen=True)
+class Stage:
+    """
+    Named step of the pipeline.
+
+    Attributes
+    ----------
+    name : str
+    inputs : tuple[pathlib.Path, ...]
+        Files read by the stage.
+    outputs : tuple[pathlib.Path, ...]
+        Files written by the stage.
+    func : Callable[[], None]
+        Runs the stage (and writes all `outputs`).
+    settings : dict[str, Any]
+        Configuration values that affect the outputs (see `config_hash`).
+    """
+
+    name: str
+    inputs: tuple[Path, ...]
+    outputs: tuple[Path, ...]
+    func: Callable[[], None]
+    settings: dict[str, Any] = field(default_factory=dict)
+
+
+def config_hash(settings: dict[str, Any]) -> str:
+    """
+    Hash of the configuration values of a stage (values that are not JSON serializable are hashed by their `str`).
+
+    Parameters
+    ----------
+    settings : dict[str, Any]
+
+    Returns
+    -------
+    hash : str
+    """
+    return hashlib.sha256(json.dumps(settings, sort_keys=True, default=str).encode()).hexdigest()
+
+
+def is_up_to_date(stage: Stage, record: dict = None) -> bool:
+    """
+    A stage is up to date if it completed with the same configuration hash before and all its outputs exist and are
+    newer than its inputs.
+
+    Parameters
+    ----------
+    stage : DeSpAn.stages.Stage
+    record : dict, optional
+        Record of the last completed run of the stage (see `run_stages`).
+
+    Returns
+    -------
+    up_to_date : bool
+    """
+    if record is None or record.get("config_hash") != config_hash(stage.settings):
+        return False
+    if not all(output.is_file() for output in stage.outputs):
+        return False
+    if not all(stage_input.exists() for stage_input in stage.inputs):
+        return False
+    newest_input = max((stage_input.stat().st_mtime_ns for stage_input in stage.inputs), default=0)
+    return all(output.stat().st_mtime_ns >= newest_input for output in stage.outputs)
+
+
+def run_stages(stages: list[Stage], state_path: Path, from_stage: str = None, until_stage: str = None,
+               report: RunReport = None) -> None:
+    """
+    Runs the stages in order and skips the stages that are up to date (see `is_up_to_date`).
+
+    The completed stages are recorded in `state_path` after each stage, hence a failed run resumes with the failed
+    stage. A stage that runs changes its outputs, hence all stages depending on them run as well.
+
+    Parameters
+    ----------
+    stages : list[DeSpAn.stages.Stage]
+    state_path : pathlib.Path
+        *json* file with the records of the completed stages.
+    from_stage : str, optional
+        Run this and all following stages regardless of their records. The outputs of the previous stages have to
+        exist.
+    until_stage : str, optional
+        Stop after this stage.
+    report : DeSpAn.report.RunReport, optional
+        Records the stages (and the steps within).
+    """
+    names = [stage.name for stage in stages]
+    for name in [from_stage, until_stage]:
+        if name is not None and name not in names:
+            raise ValueError(f"Unknown stage '{name}' ({', '.join(names)})")
+    first = 0 if from_stage is None else names.index(from_stage)
+    last = len(stages) - 1 if until_stage is None else names.index(until_stage)
+
+    records = dict()
+    if state_path.is_file():
+        with open(state_path, "r") as f:
+            records = json.load(f)
+
+    for i, stage in enumerate(stages[:last + 1]):
+        if i < first or (from_stage is None and is_up_to_date(stage, records.get(stage.name))):
+            missing = [output for output in stage.outputs if not output.is_file()]
+            if missing:
+                raise FileNotFoundError(f"Stage '{stage.name}' is skipped, but its outputs are missing: "
+                                        f"{', '.join(f'{output}' for output in missing)}")
+            print(f"Stage '{stage.name}' skipped" + ("" if i < first else " (up to date)"))
+            if report is not None:
+                report.skip_stage(stage.name)
+            continue
+
+        print(f"Running stage '{stage.name}'")
+        # The record is removed first, so that partial outputs of a failed run are never considered up to date
+        if records.pop(stage.name, None) is not None:
+            _write_records(state_path, records)
+        if report is None:
+            stage.func()
+        else:
+            with report.stage(stage.name):
+                stage.func()
+        records[stage.name] = {"config_hash": config_hash(stage.settings),
+                               "outputs": [f"{output}" for output in stage.outputs]}
+        _write_records(state_path, records)
+
+
+def _write_records(state_path: Path, records: dict) -> None:
+    state_path.parent.mkdir(parents=True, exist_ok=True)
+    with open(state_path, "w") as f:
+        json.dump(records, f, indent=2)
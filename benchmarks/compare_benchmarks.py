@@ -0,0 +1,64 @@
+"""Comparison of benchmark results across commits"""
+
+import argparse
+import json
+from pathlib import Path
+import sys
+
+
+def load_results(results_path: Path) -> tuple[str, dict[tuple[str, str], dict]]:
+    """
+    Loads a results file of `run_benchmarks.py`.
+
+    Parameters
+    ----------
+    results_path : pathlib.Path
+
+    Returns
+    -------
+    label : str
+        Commit (or file name).
+    results : dict[tuple[str, str], dict]
+        Results by benchmark and size.
+    """
+    with open(results_path, "r") as f:
+        report = json.load(f)
+    label = (report.get("commit") or results_path.stem)[:12] + ("+" if report.get("dirty") else "")
+    return label, {(result["benchmark"], result["size"]): result for result in report["results"]}
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Compares benchmark results against the first (baseline) file")
+    parser.add_argument("results", type=Path, nargs="+")
+    parser.add_argument("-m", "--metric", default="wall_time", help="Result to compare (e.g. wall_time or peak_rss)")
+    parser.add_argument("-t", "--threshold", type=float, default=1.1,
+                        help="Ratio to the baseline above which a result counts as regression")
+    args = parser.parse_args()
+
+    labels, runs = zip(*(load_results(results_path) for results_path in args.results))
+    keys = list(dict.fromkeys(key for run in runs for key in run))
+
+    print(f"{'benchmark':<30s} {'size':>6s} " + " ".join(f"{label:>14s}" for label in labels))
+    regressions = 0
+    for key in keys:
+        baseline = runs[0].get(key, {}).get(args.metric)
+        cells = []
+        for run in runs:
+            value = run.get(key, {}).get(args.metric)
+            if value is None:
+                cells.append(f"{'-':>14s}")
+            elif run is runs[0] or not baseline:
+                cells.append(f"{value:>14.4g}")
+            else:
+                ratio = value / baseline
+                regressions += ratio > args.threshold
+                cells.append(f"{value:>7.4g} ({ratio:4.2f})")
+        print(f"{key[0]:<30s} {key[1]:>6s} " + " ".join(cells))
+
+    if regressions:
+        print(f"{regressions:d} result(s) exceed {args.threshold:.2f} times the baseline {args.metric}")
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,268 @@
+"""Benchmarks of the pipeline hot paths on synthetic corridors"""
+
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from dataclasses import replace
+from datetime import datetime
+from functools import partial
+import json
+import multiprocessing
+import os
+from pathlib import Path
+import subprocess
+import time
+from typing import Callable, Iterator
+
+import numpy as np
+
+import DeSpAn
+from DeSpAn.core import border_extraction, cut_to_common_box, get_point_cloud_data
+from DeSpAn.data_io import load_laz, load_ply, save_laz, save_ply
+from DeSpAn.filters import PointFilter
+from DeSpAn.geometry import PointCloudData, merge_pcd
+from DeSpAn.m3c2 import M3C2Parameters, m3c2
+from DeSpAn.report import host_info, peak_rss, read_peak_rss, start_peak_rss
+
+from synthetic_corridor import GROUND_CLASS, Corridor, generate_corridor, parse_size
+
+
+M3C2_SETTINGS = Path(DeSpAn.__file__).parent / "conf" / "m3c2" / "m3c2_params_0.2_0.2_2_proj_0.3.txt"
+# As in the pipeline (intensities retained, ground points only)
+SCALAR_FIELDS = ["intensity"]
+FILTER_FUNCTIONS = [PointFilter(f"classification == {GROUND_CLASS}")]
+
+
+@contextmanager
+def measure(result: dict) -> Iterator[None]:
+    """
+    Measures the wall and CPU time of the enclosed code, the peak memory of the setup and of the enclosed code (the
+    high-water mark is reset in between on Linux, see `DeSpAn.report.start_peak_rss`).
+    """
+    result["setup_rss"] = peak_rss()[0]
+    peak_key = start_peak_rss()
+    wall_start = time.perf_counter()
+    cpu_start = time.process_time()
+    yield
+    result["wall_time"] = time.perf_counter() - wall_start
+    result["cpu_time"] = time.process_time() - cpu_start
+    result["peak_rss"] = read_peak_rss(peak_key)
+
+
+def _load_epoch(tiles: list[Path], cache_dir: Path) -> PointCloudData:
+    # Merged epochs are cached, hence only the first benchmark of a size pays for loading them
+    return get_point_cloud_data(tiles, pcd_file_types=[".laz"], greedy=False, scalar_fields=SCALAR_FIELDS,
+                                filter_functions=FILTER_FUNCTIONS, cache_dir=cache_dir)
+
+
+def bench_load_laz(corridor: Corridor, tiles: dict, work_dir: Path) -> dict:
+    result = {"points": 0, "bytes": sum(tile.stat().st_size for tile in tiles["laz"][0])}
+    with measure(result):
+        for tile in tiles["laz"][0]:
+            result["points"] += load_laz(tile, scalar_fields=SCALAR_FIELDS).xyz.shape[0]
+    return result
+
+
+def bench_load_ply(corridor: Corridor, tiles: dict, work_dir: Path) -> dict:
+    result = {"points": 0, "bytes": sum(tile.stat().st_size for tile in tiles["ply"][0])}
+    with measure(result):
+        for tile in tiles["ply"][0]:
+            result["points"] += load_ply(tile, scalar_fields=SCALAR_FIELDS).xyz.shape[0]
+    return result
+
+
+def bench_merge_pcd(corridor: Corridor, tiles: dict, work_dir: Path) -> dict:
+    pcds = [load_laz(tile, scalar_fields=SCALAR_FIELDS) for tile in tiles["laz"][0]]
+    result = {"points": sum(pcd.xyz.shape[0] for pcd in pcds)}
+    with measure(result):
+        merge_pcd(pcds)
+    return result
+
+
+def bench_save_ply(corridor: Corridor, tiles: dict, work_dir: Path) -> dict:
+    pcd = _load_epoch(tiles["laz"][0], work_dir / "cache")
+    pcd_path = work_dir / "save_ply.ply"
+    result = {"points": pcd.xyz.shape[0]}
+    with measure(result):
+        save_ply(pcd_path, pcd)
+    result["bytes"] = pcd_path.stat().st_size
+    pcd_path.unlink()
+    return result
+
+
+def bench_save_laz(corridor: Corridor, tiles: dict, work_dir: Path) -> dict:
+    pcd = _load_epoch(tiles["laz"][0], work_dir / "cache")
+    pcd_path = work_dir / "save_laz.laz"
+    result = {"points": pcd.xyz.shape[0]}
+    with measure(result):
+        save_laz(pcd_path, pcd)
+    result["bytes"] = pcd_path.stat().st_size
+    pcd_path.unlink()
+    return result
+
+
+def bench_cut_to_common_box(corridor: Corridor, tiles: dict, work_dir: Path) -> dict:
+    pcds = [_load_epoch(tiles["laz"][i], work_dir / "cache") for i in (0, 1)]
+    result = {"points": sum(pcd.xyz.shape[0] for pcd in pcds)}
+    with measure(result):
+        cut_to_common_box(pcds)
+    return result
+
+
+def bench_border_extraction(corridor: Corridor, tiles: dict, work_dir: Path, mode: str = "raster") -> dict:
+    pcd = _load_epoch(tiles["laz"][0], work_dir / "cache")
+    result = {"points": pcd.xyz.shape[0]}
+    with measure(result):
+        border = border_extraction(pcd, mode=mode)
+    result["border_area"] = border.area
+    return result
+
+
+def bench_crop(corridor: Corridor, tiles: dict, work_dir: Path) -> dict:
+    pcds = [_load_epoch(tiles["laz"][i], work_dir / "cache") for i in (0, 1)]
+    cut_to_common_box(pcds)
+    border = border_extraction(pcds[0], mode="raster").intersection(border_extraction(pcds[1], mode="raster"))
+    result = {"points": sum(pcd.xyz.shape[0] for pcd in pcds)}
+    with measure(result):
+        for pcd in pcds:
+            pcd.polygon_crop(border)
+    result["points_out"] = sum(pcd.xyz.shape[0] for pcd in pcds)
+    return result
+
+
+def bench_spatial_index(corridor: Corridor, tiles: dict, work_dir: Path, nb_queries: int = 10_000) -> dict:
+    pcd = _load_epoch(tiles["laz"][0], work_dir / "cache")
+    rng = np.random.default_rng(0)
+    centers = pcd.coordinates(rng.integers(0, pcd.xyz.shape[0], nb_queries))
+    result = {"points": pcd.xyz.shape[0], "queries": nb_queries, "points_found": 0}
+    with measure(result):
+        build_start = time.perf_counter()
+        pcd.spatial_index()
+        result["build_time"] = time.perf_counter() - build_start
+        for center in centers:
+            result["points_found"] += pcd.radius_query(center, 1.0).size
+    result["queries_per_second"] = nb_queries / (result["wall_time"] - result["build_time"])
+    return result
+
+
+def bench_m3c2(corridor: Corridor, tiles: dict, work_dir: Path, nb_core_points: int = 100_000) -> dict:
+    pcd_1, pcd_2 = (_load_epoch(tiles["laz"][i], work_dir / "cache") for i in (0, 1))
+    rng = np.random.default_rng(0)
+    core_points = pcd_1.select(np.sort(rng.choice(pcd_1.xyz.shape[0], min(nb_core_points, pcd_1.xyz.shape[0]),
+                                                  replace=False)))
+    params = replace(M3C2Parameters.from_file(M3C2_SETTINGS), max_thread_count=os.cpu_count())
+    result = {"points": core_points.xyz.shape[0], "cloud_points": pcd_1.xyz.shape[0] + pcd_2.xyz.shape[0]}
+    with measure(result):
+        pcd_m3c2 = m3c2(core_points, pcd_1, pcd_2, params)
+
+    # Accuracy with respect to the known deformation (within the overlap of the epochs)
+    xyz = pcd_m3c2.coordinates()
+    distance = pcd_m3c2.scalar_fields["m3c2_distance"]
+    valid = np.isfinite(distance)
+    error = distance[valid] - corridor.deformation(xyz[valid, 0], xyz[valid, 1])
+    result["valid_distances"] = int(np.count_nonzero(valid))
+    result["median_absolute_error"] = float(np.median(np.abs(error))) if error.size else None
+    return result
+
+
+BENCHMARKS: dict[str, Callable[[Corridor, dict, Path], dict]] = {
+    "load_laz": bench_load_laz,
+    "load_ply": bench_load_ply,
+    "merge_pcd": bench_merge_pcd,
+    "save_ply": bench_save_ply,
+    "save_laz": bench_save_laz,
+    "cut_to_common_box": bench_cut_to_common_box,
+    "border_extraction": bench_border_extraction,
+    "border_extraction_alphashape": partial(bench_border_extraction, mode="alphashape"),
+    "crop": bench_crop,
+    "spatial_index": bench_spatial_index,
+    "m3c2": bench_m3c2,
+}
+
+
+def run_benchmark(name: str, corridor: Corridor, tiles: dict, work_dir: Path) -> dict:
+    """
+    Runs a benchmark in a fresh process, so that its peak memory is not affected by the previous benchmarks.
+
+    Parameters
+    ----------
+    name : str
+        See `BENCHMARKS`.
+    corridor : benchmarks.synthetic_corridor.Corridor
+    tiles : dict
+        See `benchmarks.synthetic_corridor.generate_corridor`.
+    work_dir : pathlib.Path
+
+    Returns
+    -------
+    result : dict
+        *wall_time*, *cpu_time*, *setup_rss* and *peak_rss* (bytes, process high-water mark of the setup and of the
+        measured part, see `measure`), the processed *points* (and *bytes*), their throughput per second and benchmark
+        specific measures.
+    """
+    with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn")) as executor:
+        result = executor.submit(BENCHMARKS[name], corridor, tiles, work_dir).result()
+    result["points_per_second"] = result["points"] / result["wall_time"] if result["wall_time"] > 0 else None
+    if "bytes" in result:
+        result["bytes_per_second"] = result["bytes"] / result["wall_time"] if result["wall_time"] > 0 else None
+    return result
+
+
+def git_commit() -> tuple[str | None, bool | None]:
+    """
+    Commit of the working tree and whether it has uncommitted changes (`None` outside of a git repository).
+    """
+    repository = Path(__file__).parent.parent
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], cwd=repository, check=True, capture_output=True,
+                                text=True).stdout.strip()
+        status = subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], cwd=repository, check=True,
+                                capture_output=True, text=True).stdout
+    except (OSError, subprocess.CalledProcessError):
+        return None, None
+    return commit, bool(status.strip())
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmarks the DeSpAn hot paths on synthetic corridors")
+    parser.add_argument("-s", "--sizes", nargs="+", default=["1M"],
+                        help="Points per epoch (e.g. 1M 10M 100M 500M)")
+    parser.add_argument("-b", "--benchmarks", nargs="+", choices=list(BENCHMARKS), default=list(BENCHMARKS))
+    parser.add_argument("-w", "--work_dir", type=Path, default=Path("benchmark_data"),
+                        help="Generated corridors and cached epochs (reused between runs)")
+    parser.add_argument("-t", "--points_per_tile", type=parse_size, default="2M")
+    parser.add_argument("-o", "--output", type=Path,
+                        help="Results file (default: <work_dir>/results/<date>_<commit>.json)")
+    args = parser.parse_args()
+
+    commit, dirty = git_commit()
+    start = datetime.now()
+    output = args.output
+    if output is None:
+        output = args.work_dir / "results" / f"{start:%Y%m%dT%H%M%S}_{(commit or 'unknown')[:12]}.json"
+    report = {"commit": commit, "dirty": dirty, "despan_version": DeSpAn.__version__,
+              "start": start.isoformat(timespec="seconds"), "host": host_info(), "results": []}
+
+    file_types = ["laz", "ply"] if "load_ply" in args.benchmarks else ["laz"]
+    for size in args.sizes:
+        corridor = Corridor(parse_size(size), points_per_tile=args.points_per_tile)
+        corridor_dir = args.work_dir / f"corridor_{size}"
+        print(f"Generating corridor of {corridor.nb_points:,d} points per epoch")
+        tiles = generate_corridor(corridor, corridor_dir, file_types)
+
+        for name in args.benchmarks:
+            print(f"Running {name} ({size})")
+            result = run_benchmark(name, corridor, tiles, corridor_dir)
+            report["results"].append({"benchmark": name, "size": size, "nb_points": corridor.nb_points, **result})
+            print(f"{name} ({size}): {result['wall_time']:.2f} s, {result['points']:,d} points"
+                  + ("" if result["peak_rss"] is None else f", peak {result['peak_rss'] / 2 ** 30:.2f} GiB"))
+
+            # Written after each benchmark, so that the results of interrupted runs are kept
+            output.parent.mkdir(parents=True, exist_ok=True)
+            with open(output, "w") as f:
+                json.dump(report, f, indent=2)
+    print(f"Results written to '{output}'")
+
+
+if __name__ == "__main__":
+    main()
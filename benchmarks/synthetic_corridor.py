@@ -0,0 +1,282 @@
+"""Synthetic two-epoch corridor point clouds with a known deformation"""
+
+import argparse
+from dataclasses import asdict, dataclass
+import json
+from pathlib import Path
+
+import laspy
+import numpy as np
+
+from DeSpAn.data_io import save_ply
+from DeSpAn.geometry import PointCloudData
+
+
+ORIGIN = np.array([2_600_000.0, 1_200_000.0, 400.0])
+GROUND_CLASS = 2
+VEGETATION_CLASS = 5
+FILE_TYPES = {"laz": ".laz", "ply": ".ply"}
+
+
+@dataclass(frozen=True)
+class Corridor:
+    """
+    Straight corridor (e.g. along a road or a railway) rotated by `azimuth`, scanned twice.
+
+    The terrain is smooth and the second epoch is deformed by Gaussian subsidence bowls every `bowl_spacing` along the
+    corridor (see `deformation`). The second epoch is shifted along the corridor and narrower, so that both the box
+    cut and the border cut remove points.
+
+    Attributes
+    ----------
+    nb_points : int
+        Points per epoch.
+    points_per_tile : int, default=2_000_000
+    width : float, default=40.0
+    density : float, default=100.0
+        Points per square metre.
+    azimuth : float, default=30.0
+        Direction of the corridor axis (degrees from the *x*-axis).
+    deformation_amplitude : float, default=-0.05
+        Vertical displacement at the centres of the bowls.
+    bowl_radius : float, default=15.0
+        Standard deviation of the bowls.
+    bowl_spacing : float, default=200.0
+    noise : float, default=0.005
+        Standard deviation of the measurement noise.
+    vegetation_fraction : float, default=0.1
+        Fraction of the points classified as vegetation (above the ground).
+    seed : int, default=0
+    """
+
+    nb_points: int
+    points_per_tile: int = 2_000_000
+    width: float = 40.0
+    density: float = 100.0
+    azimuth: float = 30.0
+    deformation_amplitude: float = -0.05
+    bowl_radius: float = 15.0
+    bowl_spacing: float = 200.0
+    noise: float = 0.005
+    vegetation_fraction: float = 0.1
+    seed: int = 0
+
+    @property
+    def length(self) -> float:
+        return self.nb_points / (self.width * self.density)
+
+    @property
+    def nb_tiles(self) -> int:
+        return max(int(np.ceil(self.nb_points / self.points_per_tile)), 1)
+
+    def extent(self, epoch: int) -> tuple[float, float, float, float]:
+        """
+        Extent of an epoch in corridor coordinates.
+
+        Parameters
+        ----------
+        epoch : int
+            1 or 2.
+
+        Returns
+        -------
+        station_min, station_max, offset_min, offset_max : float
+        """
+        if epoch == 1:
+            return 0.0, self.length, -self.width / 2, self.width / 2
+        shift = 0.05 * self.length
+        return shift, self.length + shift, -self.width / 2 + 1.0, self.width / 2 - 1.0
+
+    def to_world(self, stations: np.ndarray, offsets: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Converts corridor coordinates (along and across the axis) to world coordinates.
+        """
+        azimuth = np.radians(self.azimuth)
+        x = ORIGIN[0] + stations * np.cos(azimuth) - offsets * np.sin(azimuth)
+        y = ORIGIN[1] + stations * np.sin(azimuth) + offsets * np.cos(azimuth)
+        return x, y
+
+    def to_corridor(self, x: np.ndarray, y: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Converts world coordinates to corridor coordinates (along and across the axis).
+        """
+        azimuth = np.radians(self.azimuth)
+        dx = x - ORIGIN[0]
+        dy = y - ORIGIN[1]
+        return dx * np.cos(azimuth) + dy * np.sin(azimuth), -dx * np.sin(azimuth) + dy * np.cos(azimuth)
+
+    def terrain(self, stations: np.ndarray, offsets: np.ndarray) -> np.ndarray:
+        """
+        Height of the terrain of the first epoch.
+        """
+        return ORIGIN[2] + 0.01 * stations + 0.5 * np.sin(stations / 40.0) + 0.2 * np.cos(offsets / 8.0)
+
+    def deformation(self, x: np.ndarray, y: np.ndarray) -> np.ndarray:
+        """
+        Vertical displacement of the terrain between the epochs at the world coordinates.
+
+        Parameters
+        ----------
+        x : np.ndarray
+        y : np.ndarray
+
+        Returns
+        -------
+        dz : np.ndarray
+        """
+        stations, offsets = self.to_corridor(x, y)
+        # Distance to the nearest bowl centre (at the corridor axis)
+        along = (stations - self.bowl_spacing / 2) % self.bowl_spacing
+        along = np.minimum(along, self.bowl_spacing - along)
+        return self.deformation_amplitude * np.exp(-(along ** 2 + offsets ** 2) / (2 * self.bowl_radius ** 2))
+
+    def tile(self, epoch: int, index: int) -> PointCloudData:
+        """
+        Generates a tile of an epoch (deterministic for `seed`, `epoch` and `index`).
+
+        Parameters
+        ----------
+        epoch : int
+            1 or 2.
+        index : int
+
+        Returns
+        -------
+        pcd : DeSpAn.geometry.PointCloudData
+            Points with color and the scalar fields *classification* and *intensity*.
+        """
+        rng = np.random.default_rng([self.seed, epoch, index])
+        station_min, station_max, offset_min, offset_max = self.extent(epoch)
+        tile_length = (station_max - station_min) / self.nb_tiles
+        nb_points = self.nb_points // self.nb_tiles + (index < self.nb_points % self.nb_tiles)
+
+        stations = rng.uniform(station_min + index * tile_length, station_min + (index + 1) * tile_length, nb_points)
+        offsets = rng.uniform(offset_min, offset_max, nb_points)
+        x, y = self.to_world(stations, offsets)
+        z = self.terrain(stations, offsets) + rng.normal(0.0, self.noise, nb_points)
+        if epoch == 2:
+            z += self.deformation(x, y)
+
+        classification = np.full((nb_points,), GROUND_CLASS, dtype=np.uint8)
+        vegetation = rng.random(nb_points) < self.vegetation_fraction
+        classification[vegetation] = VEGETATION_CLASS
+        z[vegetation] += rng.uniform(0.2, 10.0, np.count_nonzero(vegetation))
+
+        intensity = np.where(vegetation, 12_000, 30_000) + rng.integers(0, 5_000, nb_points)
+        grey = (intensity // 256).astype(np.uint8)
+        return PointCloudData(np.column_stack((x, y, z)), color=np.column_stack((grey, grey, grey)),
+                              scalar_fields={"classification": classification,
+                                             "intensity": intensity.astype(np.uint16)})
+
+
+def parse_size(size: str) -> int:
+    """
+    Parses a number of points with an optional suffix (e.g. *500k*, *10M* or *1G*).
+
+    Parameters
+    ----------
+    size : str
+
+    Returns
+    -------
+    nb_points : int
+    """
+    factors = {"k": 10 ** 3, "m": 10 ** 6, "g": 10 ** 9}
+    size = size.strip().lower()
+    if size and size[-1] in factors:
+        return int(float(size[:-1]) * factors[size[-1]])
+    return int(size)
+
+
+def save_laz(pcd_path: Path, pcd: PointCloudData) -> None:
+    """
+    Writes a tile as *las*/*laz* file (point format 3, millimetre resolution).
+
+    Parameters
+    ----------
+    pcd_path : pathlib.Path
+    pcd : DeSpAn.geometry.PointCloudData
+    """
+    header = laspy.LasHeader(point_format=3, version="1.2")
+    header.scales = np.array([0.001, 0.001, 0.001])
+    header.offsets = ORIGIN
+    las = laspy.LasData(header)
+    las.x = pcd.xyz[:, 0]
+    las.y = pcd.xyz[:, 1]
+    las.z = pcd.xyz[:, 2]
+    las.classification = pcd.scalar_fields["classification"]
+    las.intensity = pcd.scalar_fields["intensity"]
+    color = pcd.color.astype(np.uint16) * 257
+    las.red = color[:, 0]
+    las.green = color[:, 1]
+    las.blue = color[:, 2]
+    las.write(pcd_path)
+
+
+def generate_corridor(corridor: Corridor, directory: Path, file_types: list[str] = ("laz",)
+                      ) -> dict[str, tuple[list[Path], list[Path]]]:
+    """
+    Writes the tiles of both epochs to `<directory>/<file type>/epoch<1|2>`.
+
+    Existing tiles of the same corridor are reused (see *corridor.json*).
+
+    Parameters
+    ----------
+    corridor : benchmarks.synthetic_corridor.Corridor
+    directory : pathlib.Path
+    file_types : list[str], default=("laz",)
+        *laz* and/or *ply*.
+
+    Returns
+    -------
+    tiles : dict[str, tuple[list[pathlib.Path], list[pathlib.Path]]]
+        Tiles of both epochs per file type.
+    """
+    directory = Path(directory)
+    description_path = directory / "corridor.json"
+    if description_path.is_file():
+        with open(description_path, "r") as f:
+            if json.load(f) != asdict(corridor):
+                raise ValueError(f"'{directory}' contains a different corridor")
+    directory.mkdir(parents=True, exist_ok=True)
+    with open(description_path, "w") as f:
+        json.dump(asdict(corridor), f, indent=2)
+
+    tiles = dict()
+    for file_type in file_types:
+        tiles[file_type] = ([], [])
+        for epoch in (1, 2):
+            epoch_dir = directory / file_type / f"epoch{epoch}"
+            epoch_dir.mkdir(parents=True, exist_ok=True)
+            for index in range(corridor.nb_tiles):
+                tile_path = epoch_dir / f"tile_{index:05d}{FILE_TYPES[file_type]}"
+                tiles[file_type][epoch - 1].append(tile_path)
+                if tile_path.is_file():
+                    continue
+                pcd = corridor.tile(epoch, index)
+                # Written under a temporary name, so that interrupted runs never leave partial tiles
+                tmp_path = tile_path.with_name(f".{tile_path.name}")
+                if file_type == "laz":
+                    save_laz(tmp_path, pcd)
+                else:
+                    save_ply(tmp_path, pcd)
+                tmp_path.replace(tile_path)
+                print(f"Generated '{tile_path}' ({pcd.xyz.shape[0]:,d} points)")
+    return tiles
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Generates a synthetic two-epoch corridor")
+    parser.add_argument("directory", type=Path)
+    parser.add_argument("-n", "--nb_points", type=parse_size, default="1M", help="Points per epoch (e.g. 10M)")
+    parser.add_argument("-t", "--points_per_tile", type=parse_size, default="2M")
+    parser.add_argument("-f", "--file_types", nargs="+", choices=list(FILE_TYPES), default=["laz"])
+    parser.add_argument("-s", "--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    generate_corridor(Corridor(args.nb_points, points_per_tile=args.points_per_tile, seed=args.seed), args.directory,
+                      args.file_types)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,40 @@
+"""Fixtures of the DeSpAn tests: small synthetic las/laz tiles"""
+
+from pathlib import Path
+
+import laspy
+import numpy as np
+import pytest
+
+
+def write_tile(tile_path: Path, nb_points: int, offset: tuple[float, float] = (0.0, 0.0), seed: int = 0,
+               z_std: float = 0.05) -> Path:
+    """
+    Writes a tile with random points in a 10 m square (heights with a standard deviation of `z_std`), colors,
+    intensities, classifications (ground: 2) and flags.
+    """
+    rng = np.random.default_rng(seed)
+    header = laspy.LasHeader(point_format=3, version="1.2")
+    header.scales = np.full((3,), 0.001)
+    header.offsets = np.array([2_600_000.0 + offset[0], 1_200_000.0 + offset[1], 400.0])
+    las = laspy.LasData(header)
+    las.x = header.offsets[0] + rng.uniform(0, 10, nb_points)
+    las.y = header.offsets[1] + rng.uniform(0, 10, nb_points)
+    las.z = header.offsets[2] + rng.normal(0, z_std, nb_points)
+    las.intensity = rng.integers(0, 2 ** 16, nb_points, dtype=np.uint16)
+    las.classification = rng.choice(np.array([1, 2, 2, 9], dtype=np.uint8), nb_points)
+    las.withheld = rng.random(nb_points) < 0.1
+    las.red, las.green, las.blue = (rng.integers(0, 256, nb_points, dtype=np.uint16) * 257 for _ in range(3))
+    las.write(tile_path)
+    return tile_path
+
+
+@pytest.fixture
+def tiles(tmp_path: Path) -> list[Path]:
+    """
+    Three adjacent *laz* tiles of different sizes.
+    """
+    tile_dir = tmp_path / "tiles"
+    tile_dir.mkdir()
+    return [write_tile(tile_dir / f"tile_{i:d}.laz", nb_points, offset=(10.0 * i, 0.0), seed=i)
+            for i, nb_points in enumerate([1000, 1500, 700])]
@@ -0,0 +1,88 @@
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import threading
+import time
+
+import pytest
+
+from DeSpAn import batch
+from DeSpAn.batch import BatchJob, run_batch
+
+
+class FakeJobs:
+    """
+    Replaces `run_job` and records the interval of each job, jobs named *broken* break the pool.
+    """
+
+    def __init__(self, durations: dict[str, float]):
+        self.durations = durations
+        self.intervals = {}
+        self._lock = threading.Lock()
+
+    def __call__(self, job: BatchJob) -> dict:
+        start = time.perf_counter()
+        time.sleep(self.durations.get(job.name, 0.05))
+        with self._lock:
+            self.intervals[job.name] = (start, time.perf_counter())
+        if job.name == "broken":
+            raise BrokenProcessPool("killed")
+        return {"status": "completed", "peak_rss": None}
+
+    def overlap(self, name_a: str, name_b: str) -> bool:
+        (start_a, end_a), (start_b, end_b) = self.intervals[name_a], self.intervals[name_b]
+        return start_a < end_b and start_b < end_a
+
+    def max_concurrency(self) -> int:
+        events = sorted([(start, 1) for start, _ in self.intervals.values()]
+                        + [(end, -1) for _, end in self.intervals.values()])
+        running = peak = 0
+        for _, delta in events:
+            running += delta
+            peak = max(peak, running)
+        return peak
+
+
+@pytest.fixture
+def fake_jobs(monkeypatch):
+    def install(durations: dict[str, float]) -> FakeJobs:
+        fake = FakeJobs(durations)
+        monkeypatch.setattr(batch, "run_job", fake)
+        monkeypatch.setattr(batch, "_new_executor", lambda nb_workers, jobs_per_worker=None:
+                            ThreadPoolExecutor(max_workers=nb_workers))
+        return fake
+    return install
+
+
+def _jobs(tmp_path, budgets: dict[str, float]) -> list[BatchJob]:
+    return [BatchJob(name, tmp_path / "e1", tmp_path / "e2", tmp_path / name, memory_gb=memory_gb, index=index)
+            for index, (name, memory_gb) in enumerate(budgets.items())]
+
+
+def test_jobs_over_the_budget_run_alone(tmp_path, fake_jobs):
+    fake = fake_jobs({"large": 0.2})
+    jobs = _jobs(tmp_path, {"a": 1, "b": 1, "large": 8, "c": 1, "d": None, "e": 3})
+    summary = run_batch(jobs, tmp_path / "summary.json", nb_workers=3, max_memory_gb=4)
+
+    assert summary["completed"] == len(jobs)
+    assert [record["name"] for record in summary["jobs"]] == [job.name for job in jobs]
+    for name in ["a", "b", "c", "d", "e"]:
+        assert not fake.overlap("large", name)
+    assert fake.max_concurrency() <= 3
+
+
+def test_memory_budget_limits_concurrency(tmp_path, fake_jobs):
+    fake = fake_jobs({})
+    jobs = _jobs(tmp_path, {name: 2 for name in "abcdef"})
+    run_batch(jobs, tmp_path / "summary.json", nb_workers=4, max_memory_gb=4)
+    assert fake.max_concurrency() == 2
+
+
+def test_broken_pool_is_drained_before_restarting(tmp_path, fake_jobs):
+    fake = fake_jobs({"broken": 0.01, "slow": 0.3})
+    jobs = _jobs(tmp_path, {"broken": None, "slow": None, "next": None})
+    summary = run_batch(jobs, tmp_path / "summary.json", nb_workers=2)
+
+    assert (summary["completed"], summary["failed"]) == (2, 1)
+    assert summary["jobs"][0]["status"] == "failed"
+    # No job is submitted to the broken pool
+    assert not fake.overlap("slow", "next")
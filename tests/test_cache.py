@@ -0,0 +1,66 @@
+import os
+
+import numpy as np
+
+from DeSpAn.cache import MANIFEST_NAME, epoch_cache_key, load_cached_pcd, store_cached_pcd
+from DeSpAn.filters import PointFilter
+from DeSpAn.geometry import PointCloudData
+
+
+def _pcd(nb_points: int, seed: int = 0) -> PointCloudData:
+    rng = np.random.default_rng(seed)
+    return PointCloudData(rng.uniform(0, 10, (nb_points, 3)),
+                          color=rng.integers(0, 256, (nb_points, 3), dtype=np.uint8),
+                          scalar_fields={"intensity": rng.integers(0, 2 ** 16, nb_points, dtype=np.uint16)})
+
+
+def _entry_size(cache_dir, key) -> int:
+    return sum(f.stat().st_size for f in (cache_dir / key).iterdir())
+
+
+def test_epoch_cache_key(tiles):
+    key = epoch_cache_key(tiles, scalar_fields=["intensity"], filter_functions=[PointFilter("classification == 2")])
+    assert key == epoch_cache_key(tiles, scalar_fields=["intensity"],
+                                  filter_functions=[PointFilter("classification == 2")])
+    assert key != epoch_cache_key(tiles, scalar_fields=["intensity"])
+    assert key != epoch_cache_key(tiles, scalar_fields=["intensity"],
+                                  filter_functions=[PointFilter("classification == 9")])
+    assert key != epoch_cache_key(tiles[::-1], scalar_fields=["intensity"],
+                                  filter_functions=[PointFilter("classification == 2")])
+    assert key != epoch_cache_key(tiles, scalar_fields=["intensity"], merged=False,
+                                  filter_functions=[PointFilter("classification == 2")])
+
+    # Rewritten files invalidate the key
+    stat = tiles[0].stat()
+    os.utime(tiles[0], ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+    assert key != epoch_cache_key(tiles, scalar_fields=["intensity"],
+                                  filter_functions=[PointFilter("classification == 2")])
+
+
+def test_cache_round_trip(tmp_path):
+    pcd = _pcd(100)
+    assert load_cached_pcd(tmp_path, "a") is None
+    assert store_cached_pcd(tmp_path, "a", pcd)
+    for storage_dir in [None, tmp_path / "memmaps"]:
+        cached = load_cached_pcd(tmp_path, "a", storage_dir=storage_dir)
+        np.testing.assert_array_equal(cached.xyz, pcd.xyz)
+        np.testing.assert_array_equal(cached.color, pcd.color)
+        np.testing.assert_array_equal(cached.scalar_fields["intensity"], pcd.scalar_fields["intensity"])
+        assert cached.normals is None
+
+
+def test_cache_evicts_least_recently_used(tmp_path):
+    for i, key in enumerate(["a", "b"]):
+        store_cached_pcd(tmp_path, key, _pcd(100, seed=i))
+        os.utime(tmp_path / key / MANIFEST_NAME, ns=(i * 10 ** 9, i * 10 ** 9))
+    entry_size = _entry_size(tmp_path, "a")
+
+    # Loading "a" marks it as recently used, hence "b" is evicted
+    assert load_cached_pcd(tmp_path, "a") is not None
+    store_cached_pcd(tmp_path, "c", _pcd(100, seed=2), max_size=2 * entry_size)
+    assert sorted(entry.name for entry in tmp_path.iterdir()) == ["a", "c"]
+
+
+def test_cache_rejects_oversized_point_clouds(tmp_path):
+    assert not store_cached_pcd(tmp_path, "a", _pcd(100), max_size=1000)
+    assert load_cached_pcd(tmp_path, "a") is None
@@ -0,0 +1,64 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pytest
+
+from conftest import write_tile
+from DeSpAn.core import ordered_map, border_extraction, cut_to_common_box, get_point_cloud_data, plan_tiles
+from DeSpAn.filters import PointFilter
+
+
+def _assert_same_pcd(pcd_a, pcd_b):
+    np.testing.assert_array_equal(pcd_a.xyz, pcd_b.xyz)
+    np.testing.assert_array_equal(pcd_a.color, pcd_b.color)
+    assert pcd_a.scalar_fields.keys() == pcd_b.scalar_fields.keys()
+    for sf in pcd_a.scalar_fields:
+        np.testing.assert_array_equal(pcd_a.scalar_fields[sf], pcd_b.scalar_fields[sf])
+
+
+def testordered_map_keeps_submission_order():
+    with ThreadPoolExecutor(max_workers=3) as executor:
+        results = list(ordered_map(executor, lambda i: i * i, [(i,) for i in range(20)], max_pending=4))
+    assert results == [i * i for i in range(20)]
+
+
+def test_parallel_loading_matches_serial(tiles):
+    filters = [PointFilter("classification == 2")]
+    serial = get_point_cloud_data(tiles, scalar_fields=["intensity"], filter_functions=filters)
+    parallel = get_point_cloud_data(tiles, scalar_fields=["intensity"], filter_functions=filters, nb_workers=2)
+    _assert_same_pcd(serial, parallel)
+    # The tile ids follow the order of the files
+    assert np.all(np.diff(parallel.scalar_fields["point_cloud_merge"].astype(int)) >= 0)
+
+
+def _sorted_rows(pcd):
+    xyz = pcd.coordinates()
+    return xyz[np.lexsort(xyz.T[::-1])]
+
+
+def test_pruned_tiles_keep_the_common_box(tmp_path):
+    # The second tile of epoch 1 is outside of epoch 2 in x, but sets the height range of epoch 1
+    tiles_1 = [write_tile(tmp_path / "e1_0.laz", 500, seed=0),
+               write_tile(tmp_path / "e1_1.laz", 500, offset=(20.0, 0.0), seed=1, z_std=2.0)]
+    tiles_2 = [write_tile(tmp_path / "e2_0.laz", 500, seed=2, z_std=2.0)]
+
+    (pruned_1, pruned_2), box = plan_tiles([tiles_1, tiles_2])
+    assert pruned_1 == tiles_1[:1] and pruned_2 == tiles_2
+
+    unpruned = [get_point_cloud_data(tiles_1), get_point_cloud_data(tiles_2)]
+    cut_to_common_box(unpruned)
+    pruned = [get_point_cloud_data(pruned_1), get_point_cloud_data(pruned_2)]
+    recomputed = [get_point_cloud_data(pruned_1), get_point_cloud_data(pruned_2)]
+    cut_to_common_box(pruned, box=box)
+    cut_to_common_box(recomputed)
+
+    for unpruned_pcd, pruned_pcd in zip(unpruned, pruned):
+        np.testing.assert_array_equal(_sorted_rows(pruned_pcd), _sorted_rows(unpruned_pcd))
+    # The box of the pruned point clouds is lower
+    assert recomputed[1].nb_points < unpruned[1].nb_points
+
+
+def test_border_extraction_rejects_unknown_mode(tiles):
+    pcd = get_point_cloud_data(tiles[:1])
+    with pytest.raises(ValueError, match="Unknown border mode"):
+        border_extraction(pcd, mode="convex_hull")
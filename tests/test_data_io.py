@@ -0,0 +1,117 @@
+import tracemalloc
+
+import numpy as np
+from plyfile import PlyData
+import pytest
+
+from conftest import write_tile
+
+from DeSpAn.data_io import PlyWriter, box_cut_ply, load_laz, load_ply, ply_bounds, ply_dtype, save_ply
+from DeSpAn.filters import PointFilter
+
+
+def _assert_same_pcd(pcd_a, pcd_b):
+    np.testing.assert_array_equal(pcd_a.coordinates(), pcd_b.coordinates())
+    np.testing.assert_array_equal(pcd_a.color, pcd_b.color)
+    assert pcd_a.scalar_fields.keys() == pcd_b.scalar_fields.keys()
+    for sf in pcd_a.scalar_fields:
+        np.testing.assert_array_equal(pcd_a.scalar_fields[sf], pcd_b.scalar_fields[sf])
+
+
+@pytest.mark.parametrize("expressions", [[], ["classification == 2", "not withheld"]])
+def test_chunked_laz_loading_matches_unchunked(tiles, expressions):
+    filters = [PointFilter(expression) for expression in expressions]
+    pcd = load_laz(tiles[1], scalar_fields=["intensity", "classification"], filter_functions=filters)
+    chunked = load_laz(tiles[1], scalar_fields=["intensity", "classification"], filter_functions=filters,
+                       chunk_size=128)
+    _assert_same_pcd(chunked, pcd)
+
+
+def test_chunked_laz_loading_memory_follows_the_retained_points(tmp_path):
+    nb_points = 200_000
+    tile = write_tile(tmp_path / "tile.laz", nb_points)
+    filters = [PointFilter("intensity < 650")]
+    tracemalloc.start()
+    try:
+        pcd = load_laz(tile, scalar_fields=["intensity"], filter_functions=filters, chunk_size=5_000)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    assert 0 < pcd.nb_points < nb_points // 50
+    # Far below the coordinates of all points of the file (24 bytes per point)
+    assert peak < nb_points * 24 // 4
+    _assert_same_pcd(pcd, load_laz(tile, scalar_fields=["intensity"], filter_functions=filters))
+
+
+def test_ply_writer_corrects_the_vertex_count(tiles, tmp_path):
+    pcds = [load_laz(tile, scalar_fields=["intensity"]) for tile in tiles[:2]]
+    ply_path = tmp_path / "merged.ply"
+    with PlyWriter(ply_path, ply_dtype(pcds[0]), max_points=10_000, block_size=300) as writer:
+        for pcd in pcds:
+            writer.write(pcd)
+
+    nb_points = sum(pcd.nb_points for pcd in pcds)
+    with open(ply_path, "rb") as f:
+        header = f.read(1000).split(b"end_header")[0].decode("ascii")
+    assert f"element vertex {nb_points:05d}\n" in header
+
+    pcd = load_ply(ply_path)
+    assert pcd.nb_points == nb_points
+    np.testing.assert_array_equal(pcd.xyz, np.concatenate([pcd.xyz for pcd in pcds]))
+    np.testing.assert_array_equal(pcd.scalar_fields["intensity"],
+                                  np.concatenate([pcd.scalar_fields["intensity"] for pcd in pcds]))
+    np.testing.assert_array_equal(writer.minimum_corner, np.amin(pcd.xyz, axis=0))
+    np.testing.assert_array_equal(writer.maximum_corner, np.amax(pcd.xyz, axis=0))
+    # Readers that parse the header themselves accept the zero-padded count
+    assert PlyData.read(str(ply_path))["vertex"].count == nb_points
+
+
+def test_ply_writer_removes_the_file_on_errors(tiles, tmp_path):
+    pcd = load_laz(tiles[0])
+    ply_path = tmp_path / "overflow.ply"
+    with pytest.raises(ValueError, match="announced points"):
+        with PlyWriter(ply_path, ply_dtype(pcd), max_points=pcd.nb_points - 1) as writer:
+            writer.write(pcd)
+    assert not ply_path.exists()
+
+
+def test_save_ply_round_trip(tiles, tmp_path):
+    pcd = load_laz(tiles[0], scalar_fields=["intensity", "classification"])
+    save_ply(tmp_path / "tile.ply", pcd, block_size=256)
+    _assert_same_pcd(load_ply(tmp_path / "tile.ply"), pcd)
+
+
+def test_box_cut_ply(tiles, tmp_path):
+    pcd = load_laz(tiles[0], scalar_fields=["intensity"])
+    save_ply(tmp_path / "tile.ply", pcd)
+    minimum_corner, maximum_corner = ply_bounds(tmp_path / "tile.ply", chunk_size=128)
+    np.testing.assert_array_equal(minimum_corner, np.amin(pcd.xyz, axis=0))
+    np.testing.assert_array_equal(maximum_corner, np.amax(pcd.xyz, axis=0))
+
+    box = (minimum_corner + [2, 3, -1], maximum_corner - [4, 2, -1])
+    nb_points = box_cut_ply(tmp_path / "tile.ply", tmp_path / "cut.ply", *box, chunk_size=128)
+    pcd.box_cut(*box)
+    assert nb_points == pcd.nb_points
+    _assert_same_pcd(load_ply(tmp_path / "cut.ply"), pcd)
+
+
+@pytest.mark.parametrize("xyz_dtype", ["f8", "f4"])
+def test_load_ply_coordinates(tiles, tmp_path, xyz_dtype):
+    ply_path = tmp_path / "tile.ply"
+    save_ply(ply_path, load_laz(tiles[0], scalar_fields=["intensity"]), xyz_dtype=xyz_dtype)
+    pcd = load_ply(ply_path)
+    assert pcd.xyz.dtype == np.float64
+
+    # Views of the mapping for f8 coordinates
+    mapped = load_ply(ply_path, memory_map=True)
+    np.testing.assert_array_equal(mapped.xyz, pcd.xyz)
+    assert (mapped.xyz.base is not None) == (xyz_dtype == "f8")
+
+    for scale in [None, np.full((3,), 0.001)]:
+        origin = np.round(np.mean(pcd.xyz, axis=0))
+        compact = load_ply(ply_path, origin=origin, scale=scale, filter_functions=[PointFilter("intensity > 1000")])
+        expected = pcd.select(pcd.scalar_fields["intensity"] > 1000)
+        expected.compact(origin, scale)
+        assert compact.xyz.dtype == expected.xyz.dtype
+        np.testing.assert_array_equal(compact.xyz, expected.xyz)
+        np.testing.assert_array_equal(compact.coordinates(), expected.coordinates())
@@ -0,0 +1,63 @@
+import pickle
+
+import numpy as np
+import pytest
+
+from DeSpAn.filters import PointFilter, filter_description, filter_dimensions, filter_mask
+
+COLUMNS = {
+    "classification": np.array([1, 2, 2, 9, 7], dtype=np.uint8),
+    "intensity": np.array([10, 2000, 50000, 300, 40000], dtype=np.uint16),
+    "withheld": np.array([False, True, False, False, True]),
+    "return_number": np.array([1, 2, 1, 3, 1], dtype=np.uint8),
+    "number_of_returns": np.array([1, 2, 3, 3, 1], dtype=np.uint8),
+}
+
+
+@pytest.mark.parametrize("expression, expected", [
+    ("classification == 2", [False, True, True, False, False]),
+    ("classification in (2, 9)", [False, True, True, True, False]),
+    ("classification not in [1, 7]", [False, True, True, True, False]),
+    ("1000 <= intensity < 40000", [False, True, False, False, False]),
+    ("not withheld and classification != 1", [False, False, True, True, False]),
+    ("withheld or intensity < 100", [True, True, False, False, True]),
+    ("return_number == number_of_returns", [True, True, False, True, True]),
+    ("classification & 1 == 1", [True, False, False, True, True]),
+    ("intensity // 2 > 15000", [False, False, True, False, True]),
+    ("True", [True] * 5),
+])
+def test_point_filter(expression, expected):
+    np.testing.assert_array_equal(PointFilter(expression)(COLUMNS), expected)
+
+
+def test_point_filter_dimensions():
+    point_filter = PointFilter("classification == 2 and intensity > classification")
+    assert point_filter.dimensions == ("classification", "intensity")
+    assert filter_dimensions([point_filter, ("withheld", np.logical_not)]) == ["classification", "intensity",
+                                                                               "withheld"]
+    np.testing.assert_array_equal(filter_mask([point_filter, ("withheld", np.logical_not)], COLUMNS, 5),
+                                  [False, False, True, False, False])
+    assert filter_description([point_filter]) == ["classification == 2 and intensity > classification"]
+
+
+def test_point_filter_pickles():
+    point_filter = pickle.loads(pickle.dumps(PointFilter("classification in (2, 9)")))
+    np.testing.assert_array_equal(point_filter(COLUMNS), [False, True, True, True, False])
+
+
+@pytest.mark.parametrize("expression", [
+    "__import__('os').system('true')",
+    "classification.__class__",
+    "intensity[0] > 1",
+    "open('file')",
+    "lambda: 1",
+    "[x for x in intensity]",
+    "classification == 'ground'",
+    "classification in intensity",
+    "classification in (2, unknown)",
+    "1 < classification in (2, 9)",
+    "classification ==",
+])
+def test_point_filter_rejects_unsafe_and_invalid_expressions(expression):
+    with pytest.raises(ValueError, match="Invalid filter expression"):
+        PointFilter(expression)
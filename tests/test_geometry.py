@@ -0,0 +1,81 @@
+from dataclasses import FrozenInstanceError
+import pickle
+
+import numpy as np
+import pytest
+
+from DeSpAn.core import get_point_cloud_data
+from DeSpAn.filters import PointFilter
+from DeSpAn.geometry import PointCloudData, merge_pcd, merge_pcd_preallocated, tile_id_dtype
+
+
+def _random_pcd(nb_points: int, seed: int) -> PointCloudData:
+    rng = np.random.default_rng(seed)
+    return PointCloudData(rng.uniform(0, 10, (nb_points, 3)),
+                          color=rng.integers(0, 256, (nb_points, 3), dtype=np.uint8),
+                          scalar_fields={"intensity": rng.integers(0, 2 ** 16, nb_points, dtype=np.uint16)})
+
+
+def test_tile_id_dtype():
+    assert tile_id_dtype(1) == np.uint8
+    assert tile_id_dtype(255) == np.uint8
+    assert tile_id_dtype(256) == np.uint16
+
+
+@pytest.mark.parametrize("nb_allocated", [0, 7])
+def test_merge_pcd_preallocated_matches_merge_pcd(nb_allocated):
+    pcds = [_random_pcd(nb_points, seed) for seed, nb_points in enumerate([5, 0, 11])]
+    merged = merge_pcd(pcds)
+    preallocated = merge_pcd_preallocated(iter(pcds), nb_points=16 + nb_allocated, nb_pcds=3, color=True,
+                                          scalar_fields={"intensity": np.uint16})
+
+    np.testing.assert_array_equal(preallocated.xyz, merged.xyz)
+    np.testing.assert_array_equal(preallocated.color, merged.color)
+    for sf in ["intensity", "point_cloud_merge"]:
+        np.testing.assert_array_equal(preallocated.scalar_fields[sf], merged.scalar_fields[sf])
+        assert preallocated.scalar_fields[sf].dtype == merged.scalar_fields[sf].dtype
+    assert merged.scalar_fields["point_cloud_merge"].dtype == np.uint8
+
+
+def test_merge_pcd_preallocated_too_many_points():
+    with pytest.raises(ValueError):
+        merge_pcd_preallocated(iter([_random_pcd(5, 0)]), nb_points=4, nb_pcds=1)
+
+
+def test_truncate_keeps_views_valid():
+    pcd = PointCloudData.empty(10, scalar_fields={"intensity": np.uint16})
+    pcd.xyz[:] = np.arange(30).reshape(10, 3)
+    view = pcd.xyz[:4]
+    pcd._truncate(4)
+    np.testing.assert_array_equal(view, np.arange(12).reshape(4, 3))
+    np.testing.assert_array_equal(pcd.xyz, view)
+    assert pcd.scalar_fields["intensity"].shape == (4,)
+
+
+def test_deferred_reductions_are_applied_on_access():
+    pcd = _random_pcd(100, 0)
+    expected = pcd.select(pcd.scalar_fields["intensity"] > 2 ** 15)
+    pcd.defer_reductions()
+    pcd.filter("intensity", lambda intensity: intensity > 2 ** 15)
+    assert pcd.nb_points == expected.nb_points
+    assert pcd._xyz.shape[0] == 100
+
+    restored = pickle.loads(pickle.dumps(pcd))
+    np.testing.assert_array_equal(pcd.select(slice(None)).xyz, expected.xyz)
+    np.testing.assert_array_equal(pcd.color, expected.color)
+    assert pcd._xyz.shape[0] == expected.nb_points
+    np.testing.assert_array_equal(restored.scalar_fields["intensity"], expected.scalar_fields["intensity"])
+    with pytest.raises(FrozenInstanceError):
+        pcd.xyz = expected.xyz
+
+
+@pytest.mark.parametrize("expressions", [[], ["classification == 2", "not withheld"]])
+def test_preallocated_loading_matches_merge(tiles, expressions):
+    filters = [PointFilter(expression) for expression in expressions]
+    merged = get_point_cloud_data(tiles, scalar_fields=["intensity"], filter_functions=filters)
+    preallocated = get_point_cloud_data(tiles, scalar_fields=["intensity"], filter_functions=filters,
+                                        preallocate=True)
+    np.testing.assert_array_equal(preallocated.xyz, merged.xyz)
+    np.testing.assert_array_equal(preallocated.color, merged.color)
+    for sf in ["intensity", "point_cloud_merge"]:
+        np.testing.assert_array_equal(preallocated.scalar_fields[sf], merged.scalar_fields[sf])
@@ -0,0 +1,97 @@
+from dataclasses import replace
+from pathlib import Path
+
+import numpy as np
+import pytest
+from scipy.spatial import cKDTree
+
+from DeSpAn.geometry import PointCloudData, ball_neighbours, merge_pcd
+from DeSpAn.m3c2 import M3C2Parameters, m3c2, m3c2_reference, write_params_file
+
+_PARAMS_FILE = Path(__file__).parents[1] / "DeSpAn" / "conf" / "m3c2" / "m3c2_params_0.2_0.2_2_proj_0.3.txt"
+
+
+def _surface(nb_points: int, seed: int, dz: float = 0.0) -> PointCloudData:
+    rng = np.random.default_rng(seed)
+    xy = rng.uniform(0, 5, (nb_points, 2))
+    z = 0.1 * xy[:, 0] + rng.normal(0, 0.005, nb_points) + dz
+    return PointCloudData(np.column_stack([xy, z]))
+
+
+@pytest.mark.parametrize("nb_centers", [0, 50])
+def test_ball_neighbours_matches_query_ball_point(nb_centers):
+    rng = np.random.default_rng(0)
+    xyz = rng.uniform(0, 1, (500, 3))
+    centers = rng.uniform(0, 1, (nb_centers, 3))
+    tree = cKDTree(xyz)
+    neighbours, center_ids = ball_neighbours(tree, centers, 0.2)
+    expected = {(int(c), int(n)) for c, indices in enumerate(tree.query_ball_point(centers, 0.2)) for n in indices}
+    assert set(zip(center_ids.tolist(), neighbours.tolist())) == expected
+
+
+def test_reference_normals_are_required():
+    pcd = _surface(200, 0)
+    params = M3C2Parameters(normal_scale=0.5, search_scale=0.3, search_depth=1.0).with_reference_normals()
+    with pytest.raises(ValueError, match="no normals"):
+        m3c2_reference(pcd, pcd, params)
+
+
+def test_estimated_normals_match_single_scale_mode():
+    pcd_1, pcd_2 = _surface(2000, 0), _surface(2000, 1, dz=0.05)
+    params = M3C2Parameters(normal_scale=0.5, search_scale=0.3, search_depth=1.0)
+    expected = m3c2(pcd_1, pcd_1, pcd_2, params)
+
+    pcd_1.estimate_normals(params.normal_scale)
+    result = m3c2(pcd_1, pcd_1, pcd_2, params.with_reference_normals())
+    np.testing.assert_allclose(result.scalar_fields["m3c2_distance"], expected.scalar_fields["m3c2_distance"],
+                               rtol=1e-9, atol=1e-12)
+
+
+def test_single_pass_depth():
+    pcd_1 = _surface(2000, 0)
+    # Two layers, the progressive search stops at the first one
+    pcd_2 = merge_pcd([_surface(2000, 1, dz=0.05), _surface(2000, 2, dz=0.3)], tile_ids=False)
+    params = M3C2Parameters(normal_scale=0.5, search_scale=0.3, search_depth=1.0, normal_mode=3)
+    progressive = m3c2(pcd_1, pcd_1, pcd_2, params).scalar_fields
+    single_pass = m3c2(pcd_1, pcd_1, pcd_2, replace(params, use_single_pass_for_depth=True)).scalar_fields
+    inner = np.all(np.abs(pcd_1.xyz[:, 0:2] - 2.5) < 2.0, axis=1)
+    assert np.all(single_pass["npoints_cloud2"] >= progressive["npoints_cloud2"])
+    assert np.mean(single_pass["npoints_cloud2"][inner]) > 1.5 * np.mean(progressive["npoints_cloud2"][inner])
+    assert np.nanmean(single_pass["m3c2_distance"][inner]) > np.nanmean(progressive["m3c2_distance"][inner]) + 0.05
+
+
+def test_normals_from_core_points():
+    pcd_1, pcd_2 = _surface(2000, 0), _surface(2000, 1, dz=0.05)
+    params = M3C2Parameters(normal_scale=0.5, search_scale=0.3, search_depth=1.0)
+    core_points = pcd_1.subsample("spacing", 0.2)
+    with_core_points = m3c2(core_points, pcd_1, pcd_2, replace(params, normal_use_core_points=True))
+    # The neighbourhoods are equal if the core points are the first cloud
+    np.testing.assert_allclose(
+        m3c2(pcd_1, pcd_1, pcd_2, replace(params, normal_use_core_points=True)).scalar_fields["m3c2_distance"],
+        m3c2(pcd_1, pcd_1, pcd_2, params).scalar_fields["m3c2_distance"])
+    assert not np.allclose(with_core_points.normals, m3c2(core_points, pcd_1, pcd_2, params).normals)
+
+
+@pytest.mark.parametrize("setting", ["NormalMode=4", "NormalPreferedOri=8", "UsePrecisionMaps=true"])
+def test_unsupported_settings_are_rejected(tmp_path, setting):
+    key, value = setting.split("=")
+    params_path = write_params_file(_PARAMS_FILE, tmp_path / "params.txt", {key: value})
+    with pytest.raises(ValueError, match=setting):
+        M3C2Parameters.from_file(params_path)
+
+
+def test_depth_and_core_point_normal_settings(tmp_path):
+    params_path = write_params_file(_PARAMS_FILE, tmp_path / "params.txt",
+                                    {"UseSinglePass4Depth": "true", "NormalUseCorePoints": "true"})
+    params = M3C2Parameters.from_file(params_path)
+    assert params.use_single_pass_for_depth and params.normal_use_core_points
+    defaults = M3C2Parameters.from_file(_PARAMS_FILE)
+    assert not defaults.use_single_pass_for_depth and not defaults.normal_use_core_points
+
+
+def test_write_params_file(tmp_path):
+    out_path = write_params_file(_PARAMS_FILE, tmp_path / "params.txt", {"NormalMode": 1})
+    params = M3C2Parameters.from_file(out_path)
+    assert params == M3C2Parameters.from_file(_PARAMS_FILE).with_reference_normals()
+    # CloudCompare reads the keys as they are written
+    assert "NormalMode=1" in out_path.read_text().splitlines()
@@ -0,0 +1,44 @@
+import subprocess
+import sys
+
+import numpy as np
+import pytest
+
+from DeSpAn.report import RunReport, read_peak_rss, start_peak_rss
+
+linux_only = pytest.mark.skipif(not sys.platform.startswith("linux"), reason="The high-water mark is reset on Linux")
+
+
+@linux_only
+def test_peak_rss_per_step(tmp_path):
+    report = RunReport(tmp_path / "report.json")
+    nb_bytes = 400 * 2 ** 20
+    with report.step("outer") as outer:
+        with report.step("large") as large:
+            array = np.ones((nb_bytes // 8,))
+            del array
+    with report.step("small") as small:
+        array = np.ones((1000,))
+
+    assert large.peak_rss - small.peak_rss > nb_bytes // 2
+    assert outer.peak_rss >= large.peak_rss
+    report.write()
+
+
+@linux_only
+def test_nested_peak_measurements():
+    outer = start_peak_rss()
+    array = np.ones((50 * 2 ** 20,))
+    del array
+    inner = start_peak_rss()
+    assert read_peak_rss(outer) - read_peak_rss(inner) > 200 * 2 ** 20
+
+
+def test_cpu_time_includes_children(tmp_path):
+    report = RunReport(tmp_path / "report.json")
+    with report.step("child") as record:
+        subprocess.run([sys.executable, "-c", "sum(i * i for i in range(3_000_000))"], check=True)
+    if record.children_cpu_time is None:
+        pytest.skip("Child process times are not available")
+    assert record.children_cpu_time > 0.05
+    assert record.cpu_time >= record.children_cpu_time
@@ -0,0 +1,52 @@
+from pathlib import Path
+
+import numpy as np
+import pytest
+from shapely.geometry import Polygon
+
+from DeSpAn.core import get_point_cloud_data
+from DeSpAn.geometry import PointCloudData
+from DeSpAn.segmentation import corridor_axis, process_segments, split_corridor
+
+
+def _sorted_rows(pcd):
+    xyz = pcd.coordinates()
+    return xyz[np.lexsort(xyz.T[::-1])]
+
+
+def test_split_corridor_owns_every_station():
+    segments = split_corridor(0.0, 25.0, 10.0, 2.0)
+    assert len(segments) == 3
+    assert segments[0].start == -np.inf and segments[-1].end == np.inf
+    assert all(a.end == b.start for a, b in zip(segments[:-1], segments[1:]))
+
+
+def test_corridor_axis():
+    rng = np.random.default_rng(0)
+    xy = np.column_stack([rng.uniform(0, 100, 1000), rng.uniform(0, 5, 1000)]) @ np.array([[0.6, 0.8], [-0.8, 0.6]])
+    pcd = PointCloudData(np.column_stack([xy + [2_600_000.0, 1_200_000.0], np.zeros(1000)]))
+    origin, direction = corridor_axis(pcd)
+    np.testing.assert_allclose(origin, np.mean(pcd.xyz[:, 0:2], axis=0))
+    eigenvalues, eigenvectors = np.linalg.eigh(np.cov(xy, rowvar=False))
+    np.testing.assert_allclose(np.abs(direction), np.abs(eigenvectors[:, np.argmax(eigenvalues)]))
+
+
+@pytest.mark.parametrize("memmap", [False, True])
+def test_segmented_crop_matches_crop(tiles, tmp_path, memmap):
+    storage_dir = tmp_path / "memmaps" if memmap else None
+    pcd_1 = get_point_cloud_data(tiles, scalar_fields=["intensity"], storage_dir=storage_dir)
+    pcd_2 = get_point_cloud_data(tiles[1:], scalar_fields=["intensity"])
+    x0, y0, _ = pcd_1.coordinates().min(axis=0)
+    border = Polygon([(x0 + 2, y0 + 2), (x0 + 27, y0 + 3), (x0 + 26, y0 + 8), (x0 + 3, y0 + 7)])
+
+    cropped_1, cropped_2, pcd_m3c2 = process_segments(pcd_1, pcd_2, border, segment_length=6.0, overlap=1.0)
+    assert pcd_m3c2 is None
+    for pcd, cropped in [(pcd_1, cropped_1), (pcd_2, cropped_2)]:
+        expected = pcd.select(pcd.polygon_mask(border))
+        assert cropped.nb_points == expected.nb_points
+        np.testing.assert_array_equal(_sorted_rows(cropped), _sorted_rows(expected))
+    # The stitched output of a memory-mapped epoch stays in its storage directory
+    assert cropped_1.storage_dir == storage_dir
+    if memmap:
+        for array in [cropped_1.xyz, cropped_1.color, *cropped_1.scalar_fields.values()]:
+            assert isinstance(array, np.memmap) and Path(array.filename).parent == storage_dir